@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 
@@ -43,14 +44,20 @@ INSTALLED_APPS = [
     'authentication',
     'reviews',
     'social',
+    'performance',
 ]
 
 MIDDLEWARE = [
+    # First: its timings cover the other middlewares
+    'performance.middleware.ServerTimingMiddleware',
+    # Before the middlewares reading the database
+    'performance.middleware.ReplicaStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'performance.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,13 +88,110 @@ WSGI_APPLICATION = 'LitReview.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# The LITREVIEW_DB_PROFILE environment variable selects a profile:
+#   - 'development' (default): SQLite defaults, one connection per request;
+#   - 'production': WAL journal (readers do not block the writer), tuned
+#     pragmas run on every new connection (init_command), persistent
+#     connections, and write transactions (atomic blocks) started with
+#     BEGIN IMMEDIATE, so that they wait for the write lock with the busy
+#     timeout instead of failing with "database is locked" when a read
+#     transaction is upgraded.
+# The WAL mode is stored in the database file: going back to the default
+# journal needs `PRAGMA journal_mode = DELETE`.
+DATABASE_PROFILES = {
+    'development': {},
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode = WAL;'
+                # Durable at each checkpoint rather than at each commit (WAL)
+                'PRAGMA synchronous = NORMAL;'
+                # Milliseconds to wait for a lock before "database is locked"
+                'PRAGMA busy_timeout = 5000;'
+                'PRAGMA mmap_size = 268435456;'
+                # Negative: in KiB (64 MiB of page cache per connection)
+                'PRAGMA cache_size = -65536;'
+                'PRAGMA temp_store = MEMORY;'
+            ),
+        },
+    },
+}
+DATABASE_PROFILE = os.environ.get('LITREVIEW_DB_PROFILE', 'development')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **DATABASE_PROFILES[DATABASE_PROFILE],
+    }
+}
+
+# Read replicas: LITREVIEW_DB_REPLICAS lists SQLite files (comma-separated,
+# relative to BASE_DIR, e.g. "replica.sqlite3") holding copies of the primary
+# database, refreshed by `python manage.py sync_replicas --interval 5`. Reads are routed to them and
+# writes to the primary (see performance/routers.py); after a write, the
+# reads of the user stay on the primary for DATABASE_REPLICA_STICKY_SECONDS,
+# which must exceed the lag of the copies.
+DATABASE_REPLICAS = []
+for index, name in enumerate(filter(None, os.environ.get('LITREVIEW_DB_REPLICAS', '')
+                                    .split(',')), start=1):
+    alias = f'replica{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / name.strip(),
+        # The tests use the primary test database
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['performance.routers.PrimaryReplicaRouter']
+DATABASE_REPLICA_STICKY_SECONDS = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# Backend of the feed cache by database profile. The versions invalidating
+# the cached pages must be shared by every worker process: the production
+# profile keeps them in a table of the database (create it with
+# `python manage.py createcachetable`). The memory of the process is only
+# shared by a single process, such as `runserver`.
+FEED_CACHE_BACKENDS = {
+    'development': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'feed',
+    },
+    'production': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'feed_cache',
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Feed pages (see reviews/cache.py): TIMEOUT is the lifetime of a cached
+    # page in seconds, MAX_ENTRIES the number of pages kept before eviction.
+    'feed': {
+        **FEED_CACHE_BACKENDS[DATABASE_PROFILE],
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
 
+FEED_CACHE_ALIAS = 'feed'
+
+# Addresses allowed to read the feed cache metrics without a staff account.
+# Behind a reverse proxy, every request comes from the address of the proxy:
+# list only the addresses of the scrapers reaching the server directly.
+FEED_CACHE_METRICS_IPS = []
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -146,8 +250,80 @@ LOGOUT_REDIRECT_URL = LOGIN_URL
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR.joinpath('media/')
 
+# Default upload handlers, which also hash the uploaded files (photo deduplication)
+FILE_UPLOAD_HANDLERS = [
+    'reviews.uploads.HashingMemoryFileUploadHandler',
+    'reviews.uploads.HashingTemporaryFileUploadHandler',
+]
+
 
 GRAPH_MODELS = {
   'all_applications': True,
   'group_models': True,
 }
+
+# Pagination of the feeds: 'cursor' (keyset, constant cost per page)
+# or 'offset' (numbered pages). `?page=N` links are always honoured.
+FEED_PAGINATION = 'cursor'
+
+# Read the home feeds from the materialized FeedEntry table, maintained on
+# write. Run `python manage.py rebuild_timeline` after enabling it.
+FEED_MATERIALIZED = False
+
+# Serve the feed pages (home, posts) with their async views, whose queries run
+# concurrently (reviews/concurrency.py). Opt-in, for ASGI deployments only, with
+# LITREVIEW_ASYNC_VIEWS=1: under WSGI, every async view would run in an event
+# loop of its own.
+FEED_ASYNC_VIEWS = os.environ.get('LITREVIEW_ASYNC_VIEWS') == '1'
+
+# Processing of the uploaded photos (see reviews/tasks.py): 'thread' (pool of
+# the web process), 'worker' (`python manage.py process_photos`) or 'sync'.
+PHOTO_PROCESSING = 'thread'
+PHOTO_PROCESSING_WORKERS = 2
+PHOTO_PROCESSING_MAX_ATTEMPTS = 3
+# Seconds after which a photo still being processed is requeued
+PHOTO_PROCESSING_TIMEOUT = 300
+
+# Per-request instrumentation (performance.middleware.ServerTimingMiddleware)
+PERFORMANCE_SERVER_TIMING = True
+# Requests slower than this (in ms) are logged with their slowest SQL
+# statements and query plans; None disables the capture
+PERFORMANCE_SLOW_REQUEST_MS = 500
+PERFORMANCE_SLOW_REQUEST_QUERIES = 5
+
+# Profiling of single requests by staff users (?profile=1 or X-Profile: 1),
+# listed on /performance/profiles/ (see performance/profiling.py)
+PERFORMANCE_PROFILING = True
+# Fraction of the flagged requests actually profiled
+PERFORMANCE_PROFILE_SAMPLE_RATE = 1.0
+PERFORMANCE_PROFILE_DIR = BASE_DIR / 'profiles'
+# Retention: newest profiles kept, and maximum age in seconds
+PERFORMANCE_PROFILE_MAX_FILES = 50
+PERFORMANCE_PROFILE_MAX_AGE = 7 * 24 * 3600
+
+# Seconds between two reloads of the username autocomplete index of each
+# process (social/autocomplete.py); users created in the process are added at once
+AUTOCOMPLETE_INDEX_TTL = 300
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # INFO logs a JSON line with the timings of every request
+        'performance.requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'performance.slow_requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
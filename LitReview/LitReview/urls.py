@@ -22,9 +22,15 @@ from django.conf import settings
 from django.conf.urls.static import static
 from authentication.forms import CustomAuthenticationForm
 import authentication.views
+import performance.views
 import reviews.views
 import social.views
 
+# The feed pages are served by their async views in the ASGI application
+if getattr(settings, 'FEED_ASYNC_VIEWS', False):
+    home_view, posts_view = reviews.views.ahome, reviews.views.adisplay_user_posts
+else:
+    home_view, posts_view = reviews.views.home, reviews.views.display_user_posts
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -35,7 +41,7 @@ urlpatterns = [
     ), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('signup/', authentication.views.signup_user, name='signup'),
-    path('home/', reviews.views.home, name='home'),
+    path('home/', home_view, name='home'),
     path('reviews/create-ticket/', reviews.views.create_or_edit_ticket, name='create-ticket'),
     path('reviews/<int:ticket_id>/edit', reviews.views.create_or_edit_ticket, name='edit-ticket'),
     path('reviews/<int:review_id>/edit/', reviews.views.create_or_edit_review, name='edit-review'),
@@ -45,8 +51,17 @@ urlpatterns = [
          name='create-review'),
     path('create_both_ticket_review/', reviews.views.create_ticket_and_review,
          name='create-ticket-and-review'),
-    path('reviews/my-posts.html/', reviews.views.display_user_posts, name='posts'),
+    path('reviews/my-posts.html/', posts_view, name='posts'),
+    path('search/', reviews.views.search, name='search'),
     path('follow-users-form/', social.views.follow_users_form, name='follow-users-form'),
+    path('follow-users-form/autocomplete/', social.views.username_autocomplete,
+         name='username-autocomplete'),
+    path('metrics/feed-cache/', reviews.views.feed_cache_metrics, name='feed-cache-metrics'),
+    path('performance/profiles/', performance.views.profile_list, name='profile-list'),
+    path('performance/profiles/<str:name>/download/', performance.views.profile_download,
+         name='profile-download'),
+    path('performance/profiles/<str:name>/', performance.views.profile_summary,
+         name='profile-summary'),
 
 ]
 
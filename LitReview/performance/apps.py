@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class PerformanceConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'performance'
+
+    def ready(self):
+        # Time the template rendering and the cache calls of the requests
+        from . import metrics
+        metrics.install()
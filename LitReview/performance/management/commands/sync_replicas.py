@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from performance import routers
+
+
+class Command(BaseCommand):
+    help = ("Copies the primary SQLite database into the replica databases "
+            "(DATABASE_REPLICAS setting), once or every --interval seconds.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help="Seconds between two copies; without it, copy once and exit. "
+                                 "Keep it under DATABASE_REPLICA_STICKY_SECONDS.")
+
+    def handle(self, *args, **options):
+        replicas = routers.get_replicas()
+        if not replicas:
+            raise CommandError("Aucun réplica configuré (DATABASE_REPLICAS).")
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError("La copie des réplicas nécessite SQLite.")
+        while True:
+            started = time.perf_counter()
+            primary.ensure_connection()
+            for alias in replicas:
+                routers.backup(primary.connection, str(connections[alias].settings_dict['NAME']))
+            self.stdout.write(f"{len(replicas)} réplica(s) copié(s) en "
+                              f"{time.perf_counter() - started:.2f} s.")
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
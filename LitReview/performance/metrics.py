@@ -0,0 +1,135 @@
+"""
+Per-request performance metrics.
+
+`ServerTimingMiddleware` creates a `RequestMetrics` for each request and
+makes it current; the SQL queries, the template rendering and the cache
+calls of the request are then recorded in it.
+
+The queries are recorded by an execute wrapper added to every database
+connection when it opens (`record_query`), so the queries that async views
+run in other threads are counted too: the current metrics follow the
+request into these threads with its context. Template and cache timings are
+recorded by wrapping `Template.render` and the methods of the configured
+cache backends (`install()`, called when the application is ready). Nested
+calls (included templates, `get_many` calling `get`...) are only counted
+once, at the outermost level of each thread.
+"""
+import contextvars
+import functools
+import threading
+import time
+from collections import defaultdict
+from django.core.cache import caches
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+current = contextvars.ContextVar('performance_request_metrics', default=None)
+
+CACHE_METHODS = ['get', 'set', 'add', 'delete', 'touch', 'get_many', 'set_many',
+                 'delete_many', 'get_or_set', 'has_key', 'incr', 'decr', 'clear']
+
+
+class RequestMetrics:
+    """
+    Timings of a request, in seconds.
+
+    Attributes:
+        - queries (list): (duration, sql, params, database alias) of each query.
+        - template_time (float): Time spent rendering templates.
+        - cache_calls (int) / cache_time (float): Cache calls and their time.
+        - view_time (float): Time spent in the view.
+    """
+
+    def __init__(self, capture_sql=False):
+        self.capture_sql = capture_sql
+        self.queries = []
+        self.sql_count = 0
+        self.sql_time = 0
+        self.slowest_query = (0, None)
+        self.template_time = 0
+        self.cache_calls = 0
+        self.cache_time = 0
+        self.view_time = 0
+        # Nesting level of the timed calls, per kind and thread
+        self.depth = defaultdict(int)
+        # Async views record from several threads at once
+        self.lock = threading.Lock()
+
+    def record_query(self, duration, sql, params, alias):
+        with self.lock:
+            self.sql_count += 1
+            self.sql_time += duration
+            if duration >= self.slowest_query[0]:
+                self.slowest_query = (duration, sql)
+            if self.capture_sql:
+                self.queries.append((duration, sql, params, alias))
+
+    def record_call(self, kind, duration):
+        with self.lock:
+            setattr(self, f'{kind}_time', getattr(self, f'{kind}_time') + duration)
+            if kind == 'cache':
+                self.cache_calls += 1
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper recording the queries in the current metrics.
+    """
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(time.perf_counter() - start, sql, params,
+                             context['connection'].alias)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """
+    Adds `record_query` to a new database connection (`connection_created`).
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def timed(kind):
+    """
+    Decorator recording the time of the outermost calls of a function in the
+    `<kind>_time` attribute of the current request metrics.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = current.get()
+            depth = (kind, threading.get_ident())
+            if metrics is None or metrics.depth[depth]:
+                return function(*args, **kwargs)
+            metrics.depth[depth] += 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.depth[depth] -= 1
+                metrics.record_call(kind, time.perf_counter() - start)
+        wrapper.performance_timed = True
+        return wrapper
+    return decorator
+
+
+def install():
+    """
+    Wraps the database connections, the template rendering and the methods
+    of the cache backends.
+    """
+    connection_created.connect(instrument_connection,
+                               dispatch_uid='performance_instrument_connection')
+    if not getattr(Template.render, 'performance_timed', False):
+        Template.render = timed('template')(Template.render)
+    for alias in caches.settings:
+        backend = type(caches[alias])
+        for name in CACHE_METHODS:
+            method = getattr(backend, name, None)
+            if method is not None and not getattr(method, 'performance_timed', False):
+                setattr(backend, name, timed('cache')(method))
@@ -0,0 +1,265 @@
+import json
+import logging
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from . import profiling, routers
+from .metrics import RequestMetrics, current
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+logger = logging.getLogger('performance.requests')
+slow_logger = logging.getLogger('performance.slow_requests')
+
+
+def explain(alias, sql, params):
+    """
+    Returns the query plan of a SELECT statement, or None.
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    connection = connections[alias]
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            return [' '.join(str(value) for value in row) for row in cursor.fetchall()]
+    except Exception as error:
+        return [f'EXPLAIN impossible : {error}']
+
+
+class Middleware:
+    """
+    Base of the middlewares of the application, usable in synchronous (WSGI)
+    and asynchronous (ASGI) stacks: with an async stack, `__call__` returns
+    the coroutine of `__acall__`, so async views run without a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.call(request)
+
+
+class ServerTimingMiddleware(Middleware):
+    """
+    Measures the time spent in the view, in SQL, in template rendering and in
+    cache calls for every request.
+
+    The metrics are sent in a `Server-Timing` header (PERFORMANCE_SERVER_TIMING
+    setting) and logged as a JSON line on the `performance.requests` logger.
+    Requests slower than PERFORMANCE_SLOW_REQUEST_MS are also logged on the
+    `performance.slow_requests` logger with their slowest SQL statements and
+    the plans of these statements.
+
+    Installed first in MIDDLEWARE, so that the total time covers the other
+    middlewares; the view time runs from `process_view` to the response.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.server_timing = getattr(settings, 'PERFORMANCE_SERVER_TIMING', True)
+        self.slow_request_ms = getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', None)
+        self.slow_queries = getattr(settings, 'PERFORMANCE_SLOW_REQUEST_QUERIES', 5)
+
+    def call(self, request):
+        metrics = RequestMetrics(capture_sql=self.slow_request_ms is not None)
+        token = current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            end = time.perf_counter()
+        finally:
+            current.reset(token)
+        summary = self.finish(request, response, metrics, start, end)
+        if summary is not None:
+            self.log_slow_request(summary, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics(capture_sql=self.slow_request_ms is not None)
+        token = current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            end = time.perf_counter()
+        finally:
+            current.reset(token)
+        summary = self.finish(request, response, metrics, start, end)
+        if summary is not None:
+            # The query plans are read from the database
+            await sync_to_async(self.log_slow_request)(summary, metrics)
+        return response
+
+    def finish(self, request, response, metrics, start, end):
+        """
+        Adds the Server-Timing header and logs the request.
+
+        Returns:
+            dict: The summary of the request if it is slow, None otherwise.
+        """
+        view_start = getattr(request, '_performance_view_start', None)
+        if view_start is not None:
+            metrics.view_time = end - view_start
+        total = end - start
+        if self.server_timing:
+            response['Server-Timing'] = self.server_timing_header(metrics, total)
+        summary = self.summary(request, response, metrics, total)
+        logger.info(json.dumps(summary))
+        if self.slow_request_ms is not None and total * 1000 >= self.slow_request_ms:
+            return summary
+        return None
+
+    def log_slow_request(self, summary, metrics):
+        summary['slow_queries'] = self.slowest_queries(metrics)
+        slow_logger.warning(json.dumps(summary))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._performance_view_start = time.perf_counter()
+
+    def server_timing_header(self, metrics, total):
+        return ', '.join([
+            f'total;dur={total * 1000:.1f}',
+            f'view;dur={metrics.view_time * 1000:.1f}',
+            f'sql;dur={metrics.sql_time * 1000:.1f};desc="{metrics.sql_count} queries"',
+            f'tpl;dur={metrics.template_time * 1000:.1f}',
+            f'cache;dur={metrics.cache_time * 1000:.1f};desc="{metrics.cache_calls} calls"',
+        ])
+
+    def summary(self, request, response, metrics, total):
+        return {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'view_ms': round(metrics.view_time * 1000, 2),
+            'sql_count': metrics.sql_count,
+            'sql_ms': round(metrics.sql_time * 1000, 2),
+            'sql_slowest_ms': round(metrics.slowest_query[0] * 1000, 2),
+            'sql_slowest': metrics.slowest_query[1],
+            'template_ms': round(metrics.template_time * 1000, 2),
+            'cache_calls': metrics.cache_calls,
+            'cache_ms': round(metrics.cache_time * 1000, 2),
+        }
+
+    def slowest_queries(self, metrics):
+        """
+        Returns the slowest statements of a request with their query plans.
+
+        The statements are logged with their placeholders only: the parameters
+        hold session keys, password hashes and user content.
+        """
+        queries = sorted(metrics.queries, key=lambda query: query[0], reverse=True)
+        return [{
+            'ms': round(duration * 1000, 2),
+            'sql': sql,
+            'plan': explain(alias, sql, params),
+        } for duration, sql, params, alias in queries[:self.slow_queries]]
+
+
+class ProfilerMiddleware(Middleware):
+    """
+    Runs the requests of staff users flagged with `?profile=1` or the
+    `X-Profile: 1` header under a profiler (see `performance.profiling`).
+
+    The name of the stored profile is returned in the `X-Profile` header of
+    the response. Requests that are not sampled, or that arrive while
+    another request is profiled, run normally.
+
+    Installed after AuthenticationMiddleware: the profile covers the view
+    and the middlewares listed after this one.
+    """
+
+    def is_flagged(self, request):
+        if not getattr(settings, 'PERFORMANCE_PROFILING', False):
+            return False
+        if request.GET.get('profile') != '1' and request.headers.get('X-Profile') != '1':
+            return False
+        return random.random() < getattr(settings, 'PERFORMANCE_PROFILE_SAMPLE_RATE', 1.0)
+
+    def call(self, request):
+        if (not self.is_flagged(request) or not request.user.is_staff
+                or not profiling.acquire()):
+            return self.get_response(request)
+        try:
+            with profiling.Profiler() as profiler:
+                response = self.get_response(request)
+            response['X-Profile'] = profiling.save(profiler, request)
+        finally:
+            profiling.release()
+        return response
+
+    async def __acall__(self, request):
+        # The profiler samples the thread of the event loop: the other
+        # requests served meanwhile appear in the profile too
+        if (not self.is_flagged(request) or not (await request.auser()).is_staff
+                or not profiling.acquire()):
+            return await self.get_response(request)
+        try:
+            with profiling.Profiler() as profiler:
+                response = await self.get_response(request)
+            response['X-Profile'] = await sync_to_async(profiling.save)(profiler, request)
+        finally:
+            profiling.release()
+        return response
+
+
+class ReplicaStickinessMiddleware(Middleware):
+    """
+    Keeps the reads of a request on the primary database when its user wrote
+    recently (see `performance.routers`).
+
+    The reads of the requests with an unsafe method, and of the requests
+    carrying the sticky cookie, go to the primary. A request which wrote sets
+    the cookie for DATABASE_REPLICA_STICKY_SECONDS, so that the next pages of
+    the user show their changes before the replicas catch up.
+
+    Installed before the middlewares reading the database (authentication).
+    """
+
+    def call(self, request):
+        if not routers.get_replicas():
+            return self.get_response(request)
+        tokens = self.start(request)
+        try:
+            return self.finish(request, self.get_response(request))
+        finally:
+            self.reset(tokens)
+
+    async def __acall__(self, request):
+        if not routers.get_replicas():
+            return await self.get_response(request)
+        tokens = self.start(request)
+        try:
+            return self.finish(request, await self.get_response(request))
+        finally:
+            self.reset(tokens)
+
+    def start(self, request):
+        # The state of the previous request of the thread is discarded
+        unsafe = request.method not in SAFE_METHODS
+        return (routers.pinned.set(unsafe or routers.STICKY_COOKIE in request.COOKIES),
+                routers.wrote.set(False))
+
+    def finish(self, request, response):
+        if request.method not in SAFE_METHODS or routers.wrote.get():
+            response.set_cookie(
+                routers.STICKY_COOKIE, '1', httponly=True, samesite='Lax',
+                max_age=getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 10))
+        return response
+
+    def reset(self, tokens):
+        pinned, wrote = tokens
+        routers.pinned.reset(pinned)
+        routers.wrote.reset(wrote)
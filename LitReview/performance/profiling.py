@@ -0,0 +1,180 @@
+"""
+Opt-in profiling of single requests.
+
+A staff user adds `?profile=1` to a URL, or sends the `X-Profile: 1` header,
+and `ProfilerMiddleware` runs the request under a profiler: pyinstrument
+(sampling, low overhead) when it is installed, cProfile otherwise. The
+result is written in PERFORMANCE_PROFILE_DIR and listed on the staff page
+`performance/profiles/`.
+
+Limits, so that the mechanism can stay enabled in production:
+    - PERFORMANCE_PROFILE_SAMPLE_RATE: fraction of the flagged requests
+      actually profiled;
+    - a single request is profiled at a time in the process, the others
+      run normally;
+    - PERFORMANCE_PROFILE_MAX_FILES / PERFORMANCE_PROFILE_MAX_AGE: older
+      profiles are deleted after each capture.
+"""
+import cProfile
+import io
+import pstats
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from django.conf import settings
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# One profile at a time: profilers hook the interpreter, not a thread
+_lock = threading.Lock()
+
+NAME_PATTERN = re.compile(r'^[\w.-]+\.(prof|html)$')
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def profiles_dir():
+    return Path(get_setting('PERFORMANCE_PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+
+class Profiler:
+    """
+    Profiles a block of code and writes the result in a file.
+
+    Attributes:
+        - kind (str): 'pyinstrument' or 'cprofile'.
+        - extension (str): Extension of the written file ('html' or 'prof').
+    """
+
+    def __init__(self):
+        if pyinstrument is not None:
+            self.kind, self.extension = 'pyinstrument', 'html'
+            self.profiler = pyinstrument.Profiler(async_mode='enabled')
+        else:
+            self.kind, self.extension = 'cprofile', 'prof'
+            self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        if self.kind == 'cprofile':
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.kind == 'cprofile':
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+
+    def save(self, path):
+        if self.kind == 'cprofile':
+            self.profiler.dump_stats(path)
+        else:
+            path.write_text(self.profiler.output_html(), encoding='utf-8')
+
+
+def acquire():
+    """
+    Reserves the profiler of the process.
+
+    Returns:
+        bool: False if another request is being profiled.
+    """
+    return _lock.acquire(blocking=False)
+
+
+def release():
+    _lock.release()
+
+
+def profile_name(request, extension):
+    """
+    Returns the file name of a profile: date, user and view of the request.
+    """
+    match = request.resolver_match
+    view = match.view_name if match else request.path
+    view = re.sub(r'[^\w-]+', '-', view).strip('-') or 'root'
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S-%f')
+    return f'{stamp}-u{request.user.pk}-{view}.{extension}'
+
+
+def save(profiler, request):
+    """
+    Writes a profile and applies the retention limits.
+
+    Returns:
+        str: The name of the profile file.
+    """
+    directory = profiles_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = profile_name(request, profiler.extension)
+    profiler.save(directory / name)
+    prune()
+    return name
+
+
+def list_profiles():
+    """
+    Returns the stored profiles, newest first, as dicts with the name, the
+    modification date and the size of the file.
+    """
+    directory = profiles_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in directory.iterdir():
+        if NAME_PATTERN.match(path.name) and path.is_file():
+            stat = path.stat()
+            profiles.append({
+                'name': path.name,
+                'modified': datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+                'size': stat.st_size,
+            })
+    profiles.sort(key=lambda profile: profile['modified'], reverse=True)
+    return profiles
+
+
+def get_path(name):
+    """
+    Returns the path of a stored profile, or None if `name` is not one.
+    """
+    if not NAME_PATTERN.match(name):
+        return None
+    path = profiles_dir() / name
+    return path if path.is_file() else None
+
+
+def prune():
+    """
+    Deletes the profiles beyond PERFORMANCE_PROFILE_MAX_FILES or older than
+    PERFORMANCE_PROFILE_MAX_AGE seconds.
+
+    Returns:
+        int: The number of deleted profiles.
+    """
+    max_files = get_setting('PERFORMANCE_PROFILE_MAX_FILES', 50)
+    max_age = get_setting('PERFORMANCE_PROFILE_MAX_AGE', 7 * 24 * 3600)
+    limit = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    deleted = 0
+    for index, profile in enumerate(list_profiles()):
+        if index >= max_files or profile['modified'] < limit:
+            (profiles_dir() / profile['name']).unlink(missing_ok=True)
+            deleted += 1
+    return deleted
+
+
+def summary(path, limit=40):
+    """
+    Returns the functions of a cProfile file with the highest cumulative time, as text.
+    """
+    output = io.StringIO()
+    stats = pstats.Stats(str(path), stream=output)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,113 @@
+"""
+Routing of the read-only queries to replica databases.
+
+The aliases listed in the DATABASE_REPLICAS setting are copies of the
+`default` (primary) database, refreshed by `python manage.py sync_replicas`.
+Reads go to one of the replicas, writes to the primary. A replica lags
+behind the primary until the next synchronization, so reads stay on the
+primary ("pinned"):
+
+    - for the rest of the current request or task after a write, and for
+      every request with an unsafe method (POST...);
+    - for DATABASE_REPLICA_STICKY_SECONDS after a request that wrote, so
+      that its user sees their own new posts (`ReplicaStickinessMiddleware`
+      sets a cookie for this window).
+
+Without replicas, every query goes to the primary.
+"""
+import contextvars
+import random
+import sqlite3
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Apps always read from the primary: a session missing from a lagging replica
+# would log its user out, and a cache version read from it would serve pages
+# invalidated since (database cache backend)
+PRIMARY_APPS = {'sessions', 'django_cache'}
+
+# Cookie keeping the reads of a user on the primary after a write
+STICKY_COOKIE = 'db_primary'
+
+# True while the reads of the current request (or thread / task) must use the primary
+pinned = contextvars.ContextVar('replicas_pinned', default=False)
+# True once the current request (or thread / task) wrote to the primary
+wrote = contextvars.ContextVar('replicas_wrote', default=False)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin():
+    """
+    Sends the next reads of the current context to the primary.
+    """
+    pinned.set(True)
+
+
+def is_pinned():
+    return pinned.get()
+
+
+@contextmanager
+def use_primary():
+    """
+    Sends the reads of the block to the primary.
+    """
+    token = pinned.set(True)
+    try:
+        yield
+    finally:
+        pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends the reads to a random replica, unless pinned or of PRIMARY_APPS,
+    and the writes to the primary. Migrations only run on the primary: the replicas receive
+    its schema with the data.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or is_pinned() or model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            # Read from the primary anyway: storing a session or a cached
+            # page does not need to pin the other reads
+            return DEFAULT_DB_ALIAS
+        # The reads following a write must see it
+        pin()
+        wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_replicas()
+
+
+def backup(source, path):
+    """
+    Copies a database into the SQLite file `path`, in one transaction: the
+    readers of the file see either the previous copy or the new one.
+
+    Args:
+        source (sqlite3.Connection): Connection to the database to copy.
+        path (str): File of the replica, created if needed.
+    """
+    target = sqlite3.connect(path, timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
@@ -0,0 +1,266 @@
+import contextvars
+import json
+import os
+import sqlite3
+import tempfile
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from reviews.models import Ticket
+from . import profiling, routers
+from .middleware import ReplicaStickinessMiddleware
+
+
+class ServerTimingTests(TestCase):
+    """
+    The middleware measures the requests and logs the slow ones with their plans.
+    """
+
+    def setUp(self):
+        caches['feed'].clear()
+        self.user = get_user_model().objects.create_user(username='lecteur', password='secret')
+        Ticket.objects.create(title='Billet', user=self.user)
+        self.client.force_login(self.user)
+
+    def timings(self, response):
+        timings = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            timings[name] = dict(param.split('=', 1) for param in params)
+        return timings
+
+    def test_server_timing_header(self):
+        with self.assertLogs('performance.requests', 'INFO') as logs:
+            response = self.client.get(reverse('home'))
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'total', 'view', 'sql', 'tpl', 'cache'})
+        self.assertGreater(float(timings['tpl']['dur']), 0)
+        self.assertLessEqual(float(timings['view']['dur']), float(timings['total']['dur']))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['view'], line['status']), ('home', 200))
+        self.assertEqual(timings['sql']['desc'], f'"{line["sql_count"]} queries"')
+        self.assertGreater(line['cache_calls'], 0)
+        self.assertTrue(line['sql_slowest'].startswith('SELECT'))
+
+    @override_settings(PERFORMANCE_SLOW_REQUEST_MS=0, PERFORMANCE_SLOW_REQUEST_QUERIES=2)
+    def test_slow_request_captures_plans(self):
+        with self.assertLogs('performance.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('home'))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(len(line['slow_queries']), 2)
+        self.assertTrue(all(query['plan'] for query in line['slow_queries']
+                            if query['sql'].startswith('SELECT')))
+
+    @override_settings(PERFORMANCE_SLOW_REQUEST_MS=0, PERFORMANCE_SLOW_REQUEST_QUERIES=20)
+    def test_slow_request_log_has_no_parameters(self):
+        with self.assertLogs('performance.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('home'))
+        message = logs.records[0].getMessage()
+        self.assertNotIn(self.client.session.session_key, message)
+        queries = json.loads(message)['slow_queries']
+        self.assertTrue(any('%s' in query['sql'] for query in queries))
+        self.assertTrue(all(set(query) == {'ms', 'sql', 'plan'} for query in queries))
+
+    @override_settings(PERFORMANCE_SERVER_TIMING=False)
+    def test_header_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('home')))
+
+
+class ProfilerTests(TestCase):
+    """
+    Staff users profile single requests and download the stored profiles.
+    """
+
+    def setUp(self):
+        caches['feed'].clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings = override_settings(PERFORMANCE_PROFILING=True,
+                                     PERFORMANCE_PROFILE_SAMPLE_RATE=1.0,
+                                     PERFORMANCE_PROFILE_DIR=self.directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        User = get_user_model()
+        self.staff = User.objects.create_user(username='admin', password='secret', is_staff=True)
+        self.user = User.objects.create_user(username='lecteur', password='secret')
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('home'), {'profile': '1'})
+        name = response['X-Profile']
+        self.assertRegex(name, r'-home\.prof$')
+        self.assertIn(name, [profile['name'] for profile in profiling.list_profiles()])
+
+        listing = self.client.get(reverse('profile-list'))
+        self.assertContains(listing, name)
+        download = self.client.get(reverse('profile-download', args=[name]))
+        self.assertEqual(download['Content-Disposition'], f'attachment; filename="{name}"')
+        summary = self.client.get(reverse('profile-summary', args=[name]))
+        self.assertContains(summary, 'cumulative')
+
+    def test_requests_not_profiled(self):
+        self.client.force_login(self.staff)
+        self.assertNotIn('X-Profile', self.client.get(reverse('home')))
+        self.client.force_login(self.user)
+        self.assertNotIn('X-Profile', self.client.get(reverse('home'), HTTP_X_PROFILE='1'))
+        self.assertEqual(self.client.get(reverse('profile-list')).status_code, 403)
+        with override_settings(PERFORMANCE_PROFILE_SAMPLE_RATE=0):
+            self.client.force_login(self.staff)
+            self.assertNotIn('X-Profile', self.client.get(reverse('home'), {'profile': '1'}))
+        self.assertEqual(profiling.list_profiles(), [])
+
+    def test_download_rejects_other_files(self):
+        self.client.force_login(self.staff)
+        for name in ['settings.py', '..prof']:
+            response = self.client.get(reverse('profile-download', args=[name]))
+            self.assertEqual(response.status_code, 404)
+
+    @override_settings(PERFORMANCE_PROFILE_MAX_FILES=2, PERFORMANCE_PROFILE_MAX_AGE=3600)
+    def test_retention(self):
+        for index, age in enumerate([0, 10, 20, 7200]):
+            path = os.path.join(self.directory.name, f'profile-{index}.prof')
+            open(path, 'w').close()
+            modified = os.path.getmtime(path) - age
+            os.utime(path, (modified, modified))
+        self.assertEqual(profiling.prune(), 2)
+        self.assertEqual([profile['name'] for profile in profiling.list_profiles()],
+                         ['profile-0.prof', 'profile-1.prof'])
+
+
+class DatabaseProfileTests(TestCase):
+    """
+    The 'production' database profile configures every new connection.
+    """
+
+    def connect(self, profile):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = {
+            **connection.settings_dict,
+            'NAME': os.path.join(directory.name, 'db.sqlite3'),
+            'OPTIONS': {},
+            **settings.DATABASE_PROFILES[profile],
+        }
+        wrapper = DatabaseWrapper(settings_dict, alias='profile')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_production_pragmas(self):
+        wrapper = self.connect('production')
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma(wrapper, 'cache_size'), -64 * 1024)
+        self.assertEqual(self.pragma(wrapper, 'temp_store'), 2)  # MEMORY
+        self.assertEqual(self.pragma(wrapper, 'foreign_keys'), 1)
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+
+    def test_development_defaults(self):
+        wrapper = self.connect('development')
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+        self.assertIsNone(wrapper.transaction_mode)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], DATABASE_REPLICA_STICKY_SECONDS=10)
+class ReplicaRoutingTests(TestCase):
+    """
+    Reads go to the replicas unless the user wrote recently.
+    """
+
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        # The writes of the test setup pinned the thread
+        self.addCleanup(routers.pinned.reset, routers.pinned.set(False))
+
+    def read_alias(self, request, write=False):
+        """
+        Returns the database of a read made by the view of `request`, and the response.
+        """
+        used = []
+
+        def view(request):
+            if write:
+                self.router.db_for_write(Ticket)
+            used.append(self.router.db_for_read(Ticket))
+            return HttpResponse()
+
+        response = ReplicaStickinessMiddleware(view)(request)
+        return used[0], response
+
+    def test_router(self):
+        def route():
+            reads = [self.router.db_for_read(Ticket)]
+            with routers.use_primary():
+                reads.append(self.router.db_for_read(Ticket))
+            reads.append(self.router.db_for_read(Ticket))
+            self.assertEqual(self.router.db_for_write(Ticket), 'default')
+            reads.append(self.router.db_for_read(Ticket))
+            return reads
+
+        self.assertEqual(contextvars.copy_context().run(route),
+                         ['replica1', 'default', 'replica1', 'default'])
+        self.assertEqual(self.router.db_for_read(Session), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'reviews'))
+        self.assertTrue(self.router.allow_migrate('default', 'reviews'))
+
+    def test_database_cache_uses_primary_without_pinning(self):
+        cache_model = DatabaseCache('feed_cache', {}).cache_model_class
+        self.assertEqual(self.router.db_for_read(cache_model), 'default')
+        self.assertEqual(self.router.db_for_write(cache_model), 'default')
+        self.assertFalse(routers.is_pinned())
+        self.assertEqual(self.router.db_for_read(Ticket), 'replica1')
+
+    def test_without_replicas(self):
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.router.db_for_read(Ticket), 'default')
+
+    def test_sticky_window(self):
+        alias, response = self.read_alias(self.factory.get('/'))
+        self.assertEqual(alias, 'replica1')
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+
+        # Unsafe methods and writes pin the request and the next ones
+        for request, write in [(self.factory.post('/'), False), (self.factory.get('/'), True)]:
+            alias, response = self.read_alias(request, write)
+            self.assertEqual(alias, 'default')
+            self.assertEqual(response.cookies[routers.STICKY_COOKIE]['max-age'], 10)
+
+        request = self.factory.get('/')
+        request.COOKIES[routers.STICKY_COOKIE] = '1'
+        alias, response = self.read_alias(request)
+        self.assertEqual(alias, 'default')
+        # The window is not extended by reads
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+        self.assertFalse(routers.is_pinned())
+
+
+class ReplicaBackupTests(TransactionTestCase):
+    """
+    The replicas are copied from the primary by the SQLite backup API.
+    """
+
+    def test_backup(self):
+        user = get_user_model().objects.create_user(username='alice', password='pass')
+        Ticket.objects.create(title='Copié', user=user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'replica.sqlite3')
+        connection.ensure_connection()
+        routers.backup(connection.connection, path)
+        replica = sqlite3.connect(path)
+        self.addCleanup(replica.close)
+        self.assertEqual(replica.execute('SELECT title FROM reviews_ticket').fetchall(),
+                         [('Copié',)])
@@ -0,0 +1,56 @@
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, Http404, HttpResponseForbidden
+from django.shortcuts import render
+from . import profiling
+
+
+def get_profile_path(name):
+    """
+    Returns the path of a stored profile, or raises Http404.
+    """
+    path = profiling.get_path(name)
+    if path is None:
+        raise Http404("Profil introuvable.")
+    return path
+
+
+@login_required
+def profile_list(request):
+    """
+    Lists the stored request profiles, newest first. Staff users only.
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    context = {
+        'profiles': profiling.list_profiles(),
+        'enabled': profiling.get_setting('PERFORMANCE_PROFILING', False),
+    }
+    return render(request, 'performance/profile_list.html', context=context)
+
+
+@login_required
+def profile_download(request, name):
+    """
+    Downloads a stored profile (`.prof` files open with pstats or snakeviz).
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    path = get_profile_path(name)
+    return FileResponse(path.open('rb'), as_attachment=True, filename=name)
+
+
+@login_required
+def profile_summary(request, name):
+    """
+    Displays the functions of a cProfile profile with the highest cumulative time.
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    path = get_profile_path(name)
+    if path.suffix != '.prof':
+        raise Http404("Résumé disponible uniquement pour les profils cProfile.")
+    context = {
+        'name': name,
+        'summary': profiling.summary(path),
+    }
+    return render(request, 'performance/profile_summary.html', context=context)
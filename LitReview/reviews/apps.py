@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class ReviewsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'reviews'
+
+    def ready(self):
+        # Connect the signal handlers maintaining the materialized feeds
+        from . import signals  # noqa: F401
+        # Register the system checks of the feed cache
+        from . import checks  # noqa: F401
@@ -0,0 +1,156 @@
+"""
+Per-user cache of the feed pages.
+
+The cache stores the resolved index rows of a page (post kinds, IDs and
+dates) and the feed count, never the rendered HTML: pages contain CSRF
+tokens, and loading the posts of a cached page only costs two primary key
+queries. Every key embeds a per-user version, which the signal handlers
+(`reviews.signals`) replace whenever a change affects the feeds of the user.
+
+The cache alias is set by the FEED_CACHE_ALIAS setting ('feed' by default);
+its TIMEOUT and OPTIONS['MAX_ENTRIES'] bound the lifetime and the number of
+cached pages. Caching is disabled if the alias is not configured.
+"""
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from performance.routers import use_primary
+from .feed import Feed
+
+VERSION_KEY = 'feed-version:{user_id}'
+
+
+class CacheStats:
+    """
+    Hit and miss counters of the feed cache in the current process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    """
+    Returns the cache backend of the feeds, or None if it is not configured.
+    """
+    alias = getattr(settings, 'FEED_CACHE_ALIAS', 'feed')
+    if not alias:
+        return None
+    try:
+        return caches[alias]
+    except InvalidCacheBackendError:
+        return None
+
+
+def new_version():
+    # Time-based so that a version evicted from the cache is never reused
+    return str(time.time_ns())
+
+
+def get_version(user_id):
+    """
+    Returns the current cache version of the feeds of a user.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        cache.add(key, version, timeout=None)
+        version = cache.get(key, version)
+    return version
+
+
+def bump_versions(user_ids):
+    """
+    Invalidates every cached feed page of the given users.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    version = new_version()
+    cache.set_many({VERSION_KEY.format(user_id=user_id): version for user_id in set(user_ids)},
+                   timeout=None)
+
+
+class CachedFeed:
+    """
+    Wraps a `Feed` and caches its index slices and its count per user.
+
+    The wrapper exposes the interface of `Feed` used by the paginators
+    (`rows`, `count`, `hydrate`, slicing); only the posts themselves are
+    loaded from the database when a page is served from the cache.
+
+    Attributes:
+        - feed (Feed): The wrapped feed.
+        - namespace (str): Name of the feed ('home', 'posts'...).
+        - version (str): Cache version of the feeds of the user.
+    """
+
+    def __init__(self, feed, user, namespace):
+        self.feed = feed
+        self.namespace = namespace
+        self.user_id = user.pk
+        self.version = get_version(user.pk)
+
+    def key(self, *parts):
+        digest = hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+        return f'feed:{self.namespace}:{self.user_id}:{self.version}:{digest}'
+
+    def get_or_compute(self, key, compute):
+        cache = get_cache()
+        value = cache.get(key)
+        stats.record(hit=value is not None)
+        if value is None:
+            # A replica lagging behind the version bump would cache a stale
+            # page under the new version: cached values come from the primary
+            with use_primary():
+                value = compute()
+            cache.set(key, value)
+        return value
+
+    def rows(self, start, stop, cursor=None, older=True):
+        return self.get_or_compute(
+            self.key('rows', start, stop, cursor, older),
+            lambda: self.feed.rows(start, stop, cursor, older))
+
+    def count(self):
+        return self.get_or_compute(self.key('count'), self.feed.count)
+
+    def hydrate(self, rows):
+        return self.feed.hydrate(rows)
+
+    async def ahydrate(self, rows):
+        return await self.feed.ahydrate(rows)
+
+    __getitem__ = Feed.__getitem__
+
+
+def cached_feed(feed, user, namespace):
+    """
+    Returns `feed` wrapped in a `CachedFeed` if the feed cache is configured.
+    """
+    if get_cache() is None:
+        return feed
+    return CachedFeed(feed, user, namespace)
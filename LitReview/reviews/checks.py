@@ -0,0 +1,32 @@
+import os
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Backends keeping their entries in the memory of each process
+PROCESS_LOCAL_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+}
+
+
+@register()
+def check_feed_cache(app_configs, **kwargs):
+    """
+    Warns when the feed cache is local to each process while several worker
+    processes serve the application: a version bump made by one worker does
+    not reach the others, which keep serving the invalidated pages until
+    their TIMEOUT.
+    """
+    alias = getattr(settings, 'FEED_CACHE_ALIAS', 'feed')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND') if alias else None
+    if backend not in PROCESS_LOCAL_BACKENDS:
+        return []
+    # Number of worker processes, as read by gunicorn and uvicorn
+    workers = os.environ.get('WEB_CONCURRENCY', '1')
+    if getattr(settings, 'DATABASE_PROFILE', 'development') == 'development' and workers == '1':
+        return []
+    return [Warning(
+        f"Le cache des fils d'actualité ({alias}) est propre à chaque processus.",
+        hint="Avec plusieurs processus, utilisez un cache partagé (DatabaseCache, "
+             "Redis, Memcached) : voir FEED_CACHE_BACKENDS dans settings.py.",
+        id='reviews.W001',
+    )]
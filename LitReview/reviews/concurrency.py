@@ -0,0 +1,38 @@
+"""
+Blocking work of the async views: ORM queries and template rendering.
+
+`in_thread` runs a function in the thread pool of the event loop, each call
+in its own thread with its own database connection, so that independent
+queries of a request run at the same time (the async methods of the ORM
+run the queries of a request one after the other, in a single thread) and
+the event loop serves other requests while they wait.
+
+The context of the request (metrics, replica pinning) follows the calls
+into the threads. The connection of a thread is closed after each call
+when the connection settings (CONN_MAX_AGE) close it after a request.
+"""
+import asyncio
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def call_and_close(function, *args, **kwargs):
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def in_thread(function, *args, **kwargs):
+    """
+    Returns an awaitable running `function(*args, **kwargs)` in a thread of the pool.
+    """
+    return sync_to_async(call_and_close, thread_sensitive=False)(function, *args, **kwargs)
+
+
+async def gather(*calls):
+    """
+    Runs the (function, *args) calls concurrently, each in a thread, and
+    returns their results in order.
+    """
+    return await asyncio.gather(*(in_thread(*call) for call in calls))
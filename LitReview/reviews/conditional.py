@@ -0,0 +1,189 @@
+"""
+Validators for conditional GET (ETag / Last-Modified) on the feed pages.
+
+Each validator is computed from a few aggregate queries (count and newest
+`time_created` of the visible content, follow and block state) and from the
+feed cache version of the user, which changes on every edit or deletion
+affecting the user's feeds. A matching `If-None-Match` / `If-Modified-Since`
+then returns a 304 before the feed query runs and the templates render.
+
+The state of a page is described by independent queries (`home_state`...),
+run one after the other by the sync views and concurrently by the async ones.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import partial, wraps
+from asgiref.sync import iscoroutinefunction
+from django.contrib import messages
+from django.db.models import Count, Max, Q, Sum
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from social.models import UserFollows
+from . import cache
+from .concurrency import gather, in_thread
+from .models import Review, Ticket
+
+# Parts of the states holding the (count, newest creation time) of posts
+CONTENT_STATES = ('tickets', 'reviews')
+
+
+def content_state(posts):
+    """
+    Returns the count and the newest creation time of tickets or reviews.
+    """
+    aggregate = posts.order_by().aggregate(count=Count('pk'), newest=Max('time_created'))
+    return aggregate['count'], aggregate['newest']
+
+
+def follow_state(user):
+    """
+    Returns a summary of the follow relationships of `user` in both directions:
+    counts, number of blocks and highest relationship ID.
+    """
+    return (UserFollows.objects
+            .filter(Q(user=user) | Q(followed_user=user))
+            .aggregate(following=Count('pk', filter=Q(user=user)),
+                       followers=Count('pk', filter=Q(followed_user=user)),
+                       blocked=Sum('blocked'),
+                       last=Max('pk')))
+
+
+def home_state(request):
+    """
+    Returns the queries of the state of the home page, by name.
+    """
+    return {
+        'tickets': partial(content_state, Ticket.objects.visible_to(request.user)),
+        'reviews': partial(content_state, Review.objects.visible_to(request.user)),
+        'follows': partial(follow_state, request.user),
+    }
+
+
+def posts_state(request):
+    return {
+        'tickets': partial(content_state, Ticket.objects.filter(user=request.user)),
+        'reviews': partial(content_state, Review.objects.filter(user=request.user)),
+    }
+
+
+def follows_state(request):
+    return {
+        'follows': partial(follow_state, request.user),
+    }
+
+
+def has_messages(request):
+    """
+    Returns True if flash messages are pending: they are displayed only
+    once, so the page must be rendered again.
+    """
+    return bool(len(messages.get_messages(request)))
+
+
+def complete_state(request, state, version):
+    """
+    Adds the user, the feed cache version and the CSRF secret to the results
+    of the state queries.
+    """
+    state.update(
+        user=request.user.pk,
+        version=version,
+        # The forms of the page embed a token derived from the CSRF secret
+        # of the browser, set in the CSRF cookie of the response if needed
+        csrf=get_token(request) and request.META['CSRF_COOKIE'],
+    )
+    return state
+
+
+def page_state(request, compute_state):
+    """
+    Returns the validator state of the page, computed once per request, or None
+    when the page must not be validated.
+    """
+    if not hasattr(request, '_conditional_state'):
+        state = None
+        if request.user.is_authenticated and not has_messages(request):
+            version = cache.get_version(request.user.pk)
+            state = {name: query() for name, query in compute_state(request).items()}
+            state = complete_state(request, state, version)
+        request._conditional_state = state
+    return request._conditional_state
+
+
+async def apage_state(request, compute_state):
+    """
+    Async version of `page_state`: the state queries and the loading of the
+    flash messages (session) run concurrently, each in a thread.
+    """
+    if not hasattr(request, '_conditional_state'):
+        state = None
+        if request.user.is_authenticated:
+            # Read in a thread too (the feed cache may be a table of the
+            # database), before the queries: a change committed meanwhile
+            # then gives the next request another version
+            version = await in_thread(cache.get_version, request.user.pk)
+            queries = compute_state(request)
+            pending, *results = await gather((has_messages, request),
+                                             *((query,) for query in queries.values()))
+            if not pending:
+                state = complete_state(request, dict(zip(queries, results)), version)
+        request._conditional_state = state
+    return request._conditional_state
+
+
+def conditional_page(compute_state):
+    """
+    Decorator adding ETag / Last-Modified validators to a page of the feeds.
+
+    The response is marked `private, no-cache`: browsers and proxies keep it but
+    revalidate it on every use, which costs a 304 while nothing has changed.
+
+    Args:
+        compute_state (callable): Returns the state of the content shown to
+            the user of the request (see `home_state`).
+    """
+    def etag(request, *args, **kwargs):
+        state = page_state(request, compute_state)
+        # Without the cache version, an edit or a deletion keeping the counts
+        # and the newest date would keep the ETag
+        if state is None or state['version'] is None:
+            return None
+        return hashlib.sha256(repr(sorted(state.items())).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        state = page_state(request, compute_state)
+        # Without the cache version, edits and deletions would not move the date
+        if state is None or state['version'] is None:
+            return None
+        dates = [state[name][1] for name in CONTENT_STATES if state.get(name, (0, None))[1]]
+        # The cache version is the time of the last change of the feeds
+        dates.append(datetime.fromtimestamp(int(state['version']) / 1e9, tz=timezone.utc))
+        return max(dates)
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # The user is loaded once, for this thread and the threads of
+                # the queries (`request.user` would load it again)
+                request.user = await request.auser()
+                # Computed beforehand: the validators of `condition` then read
+                # the state without querying the database from the event loop
+                await apage_state(request, compute_state)
+                response = await conditional_view(request, *args, **kwargs)
+                if request.method in ('GET', 'HEAD'):
+                    patch_cache_control(response, private=True, no_cache=True)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
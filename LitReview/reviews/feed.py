@@ -0,0 +1,420 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import (CharField, Exists, F, OuterRef, Q, Value,
+                              prefetch_related_objects)
+from .concurrency import gather, in_thread
+from .models import FeedEntry, Ticket, Review
+
+FEED_PAGE_SIZE = 6
+
+TICKET = 'ticket'
+REVIEW = 'review'
+
+
+def feed_index(queryset, kind):
+    """
+    Reduces a ticket or review queryset to the columns needed to order the feed.
+
+    Args:
+        queryset (QuerySet): Tickets or reviews visible in the feed.
+        kind (str): TICKET or REVIEW, stored as a constant column.
+
+    Returns:
+        QuerySet: Rows of (time_created, kind, post_id) without model ordering,
+        ready to be combined with UNION ALL.
+    """
+    return (queryset.order_by()
+            .annotate(kind=Value(kind, output_field=CharField()), post_id=F('pk'))
+            .values('time_created', 'kind', 'post_id'))
+
+
+def encode_cursor(row):
+    """
+    Encodes the position of a feed row as an opaque, URL-safe cursor.
+
+    Args:
+        row (dict): Index row with `time_created`, `kind` and `post_id` keys.
+
+    Returns:
+        str: The cursor token.
+    """
+    position = [row['time_created'].isoformat(), row['kind'], row['post_id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decodes a cursor produced by `encode_cursor`.
+
+    Args:
+        token (str): The cursor token received in the query string.
+
+    Returns:
+        tuple: (time_created, kind, post_id), or None if the token is invalid.
+    """
+    if not token:
+        return None
+    try:
+        padding = '=' * (-len(token) % 4)
+        time_created, kind, post_id = json.loads(base64.urlsafe_b64decode(token + padding))
+        return datetime.fromisoformat(time_created), str(kind), int(post_id)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+
+def keyset_filter(queryset, kind, cursor, older=True):
+    """
+    Restricts a ticket or review queryset to the rows located after a cursor.
+
+    Feed rows are ordered on (time_created, kind, post_id). As `kind` is
+    constant for the queryset, its comparison with the cursor is resolved here
+    and only `time_created` and the primary key are compared by the database.
+
+    Args:
+        queryset (QuerySet): Tickets or reviews of the feed.
+        kind (str): TICKET or REVIEW.
+        cursor (tuple): (time_created, kind, post_id) position to start from.
+        older (bool): True to keep older rows, False to keep newer rows.
+
+    Returns:
+        QuerySet: The filtered queryset.
+    """
+    time_created, cursor_kind, post_id = cursor
+    lookup = 'lt' if older else 'gt'
+    condition = Q(**{f'time_created__{lookup}': time_created})
+    if kind == cursor_kind:
+        condition |= Q(time_created=time_created, **{f'pk__{lookup}': post_id})
+    elif (kind < cursor_kind) == older:
+        condition |= Q(time_created=time_created)
+    return queryset.filter(condition)
+
+
+class Feed:
+    """
+    Lazy sequence of tickets and reviews sorted by creation date (newest first).
+
+    The merge of both querysets is done by the database with a UNION ALL, so
+    slicing the feed only loads the rows of the requested slice. The class
+    implements `count()` and slicing, which is all `Paginator` needs.
+
+    Attributes:
+        - tickets (QuerySet): Tickets to include in the feed.
+        - reviews (QuerySet): Reviews to include in the feed.
+        - viewer (User): User reading the feed, used to flag reviewed tickets.
+    """
+
+    def __init__(self, tickets, reviews, viewer=None):
+        self.tickets = tickets
+        self.reviews = reviews
+        self.viewer = viewer
+
+    def index(self, cursor=None, older=True):
+        """
+        Returns the merged (time_created, kind, post_id) rows.
+
+        Args:
+            cursor (tuple): Optional position; only rows after it are returned.
+            older (bool): Walk towards older rows (newest first) when True,
+                towards newer rows (oldest first) when False.
+        """
+        tickets, reviews = self.tickets, self.reviews
+        if cursor is not None:
+            tickets = keyset_filter(tickets, TICKET, cursor, older)
+            reviews = keyset_filter(reviews, REVIEW, cursor, older)
+        ordering = ('time_created', 'kind', 'post_id')
+        if older:
+            ordering = tuple(f'-{field}' for field in ordering)
+        return (feed_index(tickets, TICKET)
+                .union(feed_index(reviews, REVIEW), all=True)
+                .order_by(*ordering))
+
+    def count(self):
+        """
+        Returns the number of posts in the feed without loading them.
+        """
+        return self.tickets.count() + self.reviews.count()
+
+    def rows(self, start, stop, cursor=None, older=True):
+        """
+        Returns a slice of the index rows as a list.
+
+        Args:
+            start (int): Index of the first row of the slice.
+            stop (int): Index after the last row of the slice.
+            cursor (tuple): Optional position, see `index`.
+            older (bool): Direction of the walk, see `index`.
+        """
+        return list(self.index(cursor, older)[start:stop])
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        return self.hydrate(self.rows(item.start or 0, item.stop))
+
+    def ticket_queryset(self):
+        """
+        Returns the queryset used to load the tickets of a page.
+
+        Authors and photos are joined, and tickets already reviewed by the
+        viewer are flagged with `user_has_reviewed` (to deactivate review button).
+        """
+        tickets = Ticket.objects.select_related('user', 'photo')
+        if self.viewer is not None:
+            tickets = tickets.annotate(user_has_reviewed=Exists(
+                Review.objects.filter(ticket=OuterRef('pk'), user=self.viewer)))
+        return tickets
+
+    def review_queryset(self):
+        """
+        Returns the queryset used to load the reviews of a page, joined with
+        their author and with the ticket summary (ticket, ticket author, photo).
+        """
+        return Review.objects.select_related('user', 'ticket__user', 'ticket__photo')
+
+    def hydrate(self, rows):
+        """
+        Loads the tickets and reviews referenced by index rows, keeping their order.
+
+        Each kind of post is loaded with a single query, whatever the content
+        of the page, and the renditions of all the photos of the page with one
+        more query, so rendering the page does not trigger any lazy loading.
+
+        Args:
+            rows (iterable): Rows of (time_created, kind, post_id) dictionaries.
+
+        Returns:
+            list: Ticket and Review instances in feed order.
+        """
+        rows = list(rows)
+        ticket_ids, review_ids = self.post_ids(rows)
+        posts = {
+            TICKET: self.ticket_queryset().in_bulk(ticket_ids) if ticket_ids else {},
+            REVIEW: self.review_queryset().in_bulk(review_ids) if review_ids else {},
+        }
+        return self.assemble(rows, posts)
+
+    async def ahydrate(self, rows):
+        """
+        Async version of `hydrate`: the tickets and the reviews are loaded
+        concurrently, in two threads.
+        """
+        rows = list(rows)
+        ticket_ids, review_ids = self.post_ids(rows)
+        tickets, reviews = await gather((self.ticket_queryset().in_bulk, ticket_ids),
+                                        (self.review_queryset().in_bulk, review_ids))
+        return await in_thread(self.assemble, rows, {TICKET: tickets, REVIEW: reviews})
+
+    def post_ids(self, rows):
+        """
+        Returns the IDs of the tickets and of the reviews of index rows.
+        """
+        return ([row['post_id'] for row in rows if row['kind'] == TICKET],
+                [row['post_id'] for row in rows if row['kind'] == REVIEW])
+
+    def assemble(self, rows, posts):
+        """
+        Loads the renditions of the photos of the posts, and returns the posts
+        in the order of the rows.
+
+        Args:
+            rows (list): Index rows of the posts.
+            posts (dict): Loaded tickets and reviews, by kind and ID.
+        """
+        tickets = [*posts[TICKET].values(), *(review.ticket for review in posts[REVIEW].values())]
+        prefetch_related_objects([ticket.photo for ticket in tickets
+                                  if ticket.photo and ticket.photo.image], 'renditions')
+        return [posts[row['kind']][row['post_id']] for row in rows
+                if row['post_id'] in posts[row['kind']]]
+
+
+class TimelineFeed(Feed):
+    """
+    Home feed read from the materialized `FeedEntry` table.
+
+    The index of the feed is a single range of the owner's entries instead of
+    the UNION of the ticket and review queries; pages are loaded like a `Feed`.
+
+    Attributes:
+        - owner (User): The user whose feed is read.
+    """
+
+    def __init__(self, owner):
+        super().__init__(tickets=None, reviews=None, viewer=owner)
+        self.owner = owner
+
+    def index(self, cursor=None, older=True):
+        entries = FeedEntry.objects.filter(owner=self.owner)
+        if cursor is not None:
+            time_created, kind, post_id = cursor
+            lookup = 'lt' if older else 'gt'
+            entries = entries.filter(
+                Q(**{f'time_created__{lookup}': time_created})
+                | Q(time_created=time_created, **{f'kind__{lookup}': kind})
+                | Q(time_created=time_created, kind=kind, **{f'object_id__{lookup}': post_id}))
+        ordering = ('time_created', 'kind', 'post_id')
+        if older:
+            ordering = tuple(f'-{field}' for field in ordering)
+        return (entries.annotate(post_id=F('object_id'))
+                .values('time_created', 'kind', 'post_id')
+                .order_by(*ordering))
+
+    def count(self):
+        return FeedEntry.objects.filter(owner=self.owner).count()
+
+
+def home_feed(user):
+    """
+    Returns the home feed of `user`.
+
+    The feed is read from the materialized `FeedEntry` table when the
+    FEED_MATERIALIZED setting is enabled, and computed from the tickets and
+    reviews otherwise.
+    """
+    if getattr(settings, 'FEED_MATERIALIZED', False):
+        return TimelineFeed(user)
+    return Feed(Ticket.objects.visible_to(user), Review.objects.visible_to(user), viewer=user)
+
+
+class CursorPage:
+    """
+    Page of a feed located by a cursor instead of a page number.
+
+    Exposes the parts of the `Page` interface used by the templates
+    (iteration, `has_next`, `has_previous`...) plus the cursors of the
+    neighbouring pages, so `display_user_feed.html` can render either kind of page.
+
+    Attributes:
+        - object_list (list): Tickets and reviews of the page.
+        - next_cursor (str): Cursor of the next (older) page, if any.
+        - previous_cursor (str): Cursor of the previous (newer) page, if any.
+        - paginator (CursorPaginator): The paginator which built the page.
+    """
+    is_cursor_page = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor, paginator):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.paginator = paginator
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset paginator for a `Feed`.
+
+    Pages are located by the (time_created, kind, post_id) position of their
+    boundary rows, so fetching a page costs the same whatever its depth, needs
+    no COUNT query, and posts published meanwhile do not shift the pages.
+
+    Attributes:
+        - feed (Feed): The feed to paginate.
+        - per_page (int): Number of posts per page.
+    """
+
+    def __init__(self, feed, per_page):
+        self.feed = feed
+        self.per_page = per_page
+
+    def get_page(self, after=None, before=None):
+        """
+        Returns the page following `after` (older posts) or preceding `before`
+        (newer posts). Without a valid cursor, the first page is returned.
+
+        Args:
+            after (str): Cursor of the last post of the previous page.
+            before (str): Cursor of the first post of the next page.
+
+        Returns:
+            CursorPage: The requested page.
+        """
+        rows, has_newer, has_older = self.locate(after, before)
+        return self.make_page(rows, self.feed.hydrate(rows), has_newer, has_older)
+
+    async def aget_page(self, after=None, before=None):
+        """
+        Async version of `get_page`.
+        """
+        rows, has_newer, has_older = await in_thread(self.locate, after, before)
+        return self.make_page(rows, await self.feed.ahydrate(rows), has_newer, has_older)
+
+    def locate(self, after=None, before=None):
+        """
+        Returns the index rows of the page, and whether newer and older posts exist.
+        """
+        before = decode_cursor(before)
+        after = None if before else decode_cursor(after)
+
+        if before:
+            # Walk backwards from the cursor, then restore the feed order
+            rows = self.feed.rows(0, self.per_page + 1, before, older=False)
+            if len(rows) <= self.per_page:
+                # Reached the newest posts: show a full first page instead
+                return self.locate()
+            return rows[:self.per_page][::-1], True, True
+        rows = self.feed.rows(0, self.per_page + 1, after)
+        return rows[:self.per_page], after is not None, len(rows) > self.per_page
+
+    def make_page(self, rows, posts, has_newer, has_older):
+        return CursorPage(
+            posts,
+            next_cursor=encode_cursor(rows[-1]) if rows and has_older else None,
+            previous_cursor=encode_cursor(rows[0]) if rows and has_newer else None,
+            paginator=self,
+        )
+
+
+def paginate_feed(request, feed):
+    """
+    Returns the page of the feed requested in the query string.
+
+    Cursor pagination (`?after=` / `?before=`) is used unless the
+    FEED_PAGINATION setting is 'offset' or a page number (`?page=`) is given.
+
+    Args:
+        request (HttpRequest): The incoming HTTP request.
+        feed (Feed): The feed to paginate.
+
+    Returns:
+        Page or CursorPage: The page to render as `page_obj`.
+    """
+    mode = getattr(settings, 'FEED_PAGINATION', 'cursor')
+    if mode == 'offset' or 'page' in request.GET:
+        return Paginator(feed, FEED_PAGE_SIZE).get_page(request.GET.get('page'))
+    return CursorPaginator(feed, FEED_PAGE_SIZE).get_page(
+        after=request.GET.get('after'), before=request.GET.get('before'))
+
+
+async def apaginate_feed(request, feed):
+    """
+    Async version of `paginate_feed`.
+
+    The pages located by number need the count of the feed before loading
+    the page: they are built in a single thread.
+    """
+    mode = getattr(settings, 'FEED_PAGINATION', 'cursor')
+    if mode == 'offset' or 'page' in request.GET:
+        return await in_thread(paginate_feed, request, feed)
+    return await CursorPaginator(feed, FEED_PAGE_SIZE).aget_page(
+        after=request.GET.get('after'), before=request.GET.get('before'))
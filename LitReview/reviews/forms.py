@@ -1,4 +1,6 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from . import images
 from .models import Ticket, Photo, Review
 
 
@@ -26,10 +28,35 @@ class TicketForm(forms.ModelForm):
         }
 
 
+class BoundedImageField(forms.ImageField):
+    """
+    Image field checking the size and pixel limits of `reviews.images` on the
+    image header, before Django verifies the image.
+    """
+
+    def to_python(self, data):
+        if data and hasattr(data, 'size'):
+            try:
+                with images.open_image(data) as image:
+                    images.check_limits(image, data.size, max(Photo.RENDITION_WIDTHS))
+            except images.ImageTooLarge:
+                raise ValidationError("Cette image est trop volumineuse.", code='too_large')
+            except (OSError, SyntaxError):
+                # Unreadable images are reported by ImageField: Pillow raises
+                # OSError (UnidentifiedImageError, truncated files) or
+                # SyntaxError (malformed headers)
+                pass
+            data.seek(0)
+        return super().to_python(data)
+
+
 class PhotoForm(forms.ModelForm):
     class Meta:
         model = Photo
         fields = ['image']
+        field_classes = {
+            'image': BoundedImageField,
+        }
         labels = {
             'image': '',
         }
@@ -0,0 +1,108 @@
+"""
+Memory-bounded decoding of the uploaded images.
+
+The limits are checked on the image header, before any pixel is decoded:
+
+    - MAX_FILE_SIZE: size of the uploaded file, in bytes;
+    - MAX_SOURCE_PIXELS: pixels of the image described by the header, which
+      rejects decompression bombs (a few KB of PNG can describe gigapixels);
+    - MAX_DECODED_PIXELS: pixels actually decoded. JPEG images are decoded
+      straight at the scale of the largest rendition (draft mode: 1/2, 1/4 or
+      1/8 of the size), other formats at full size.
+
+This module only depends on Pillow, so that the benchmark of the decoding
+(`bench_photo_decoding`) can run it in bare subprocesses.
+"""
+import math
+import os
+from contextlib import contextmanager
+from PIL import ExifTags, Image
+
+MAX_FILE_SIZE = 25 * 1024 * 1024
+MAX_SOURCE_PIXELS = 100_000_000
+MAX_DECODED_PIXELS = 25_000_000
+
+# EXIF orientations rotating the image by 90 degrees (width and height swapped)
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class ImageTooLarge(ValueError):
+    """
+    Raised when an image exceeds the size, pixel or decoding limits.
+    """
+
+
+def open_image(file):
+    """
+    Reads the header of an image, turning Pillow's decompression bomb error
+    into `ImageTooLarge`.
+    """
+    try:
+        return Image.open(file)
+    except Image.DecompressionBombError as error:
+        raise ImageTooLarge(str(error)) from error
+
+
+def oriented_size(image):
+    """
+    Returns the (width, height) of an image once its EXIF orientation is applied.
+    """
+    orientation = image.getexif().get(ExifTags.Base.Orientation)
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        return image.height, image.width
+    return image.size
+
+
+def decoded_pixels(image, max_width=None):
+    """
+    Returns the number of pixels decoded to produce renditions at most
+    `max_width` wide: JPEG images can be decoded at 1/2, 1/4 or 1/8 of their size.
+    """
+    width, height = image.size
+    if image.format == 'JPEG' and max_width:
+        scale = max(1, min(8, oriented_size(image)[0] // max_width))
+        # Largest power of two not above the scale
+        scale = 2 ** int(math.log2(scale))
+        width, height = math.ceil(width / scale), math.ceil(height / scale)
+    return width * height
+
+
+def check_limits(image, file_size=None, max_width=None):
+    """
+    Checks an opened (not yet decoded) image against the limits.
+
+    Args:
+        image (Image): The image, as returned by `open_image`.
+        file_size (int): Size of the file in bytes, if known.
+        max_width (int): Width of the largest rendition, if known.
+
+    Raises:
+        ImageTooLarge: If a limit is exceeded.
+    """
+    if file_size is not None and file_size > MAX_FILE_SIZE:
+        raise ImageTooLarge(f"File of {file_size} bytes (limit: {MAX_FILE_SIZE}).")
+    if image.width * image.height > MAX_SOURCE_PIXELS:
+        raise ImageTooLarge(f"Image of {image.width}x{image.height} pixels "
+                            f"(limit: {MAX_SOURCE_PIXELS} pixels).")
+    pixels = decoded_pixels(image, max_width)
+    if pixels > MAX_DECODED_PIXELS:
+        raise ImageTooLarge(f"Decoding {pixels} pixels (limit: {MAX_DECODED_PIXELS}).")
+
+
+@contextmanager
+def open_reduced(path, max_width):
+    """
+    Opens an image to generate renditions at most `max_width` wide, after
+    checking the limits. JPEG images are set to decode at the smallest scale
+    still at least `max_width` wide.
+
+    Yields:
+        tuple: The image (not decoded yet) and its full size once oriented.
+    """
+    with open_image(path) as image:
+        check_limits(image, os.path.getsize(path), max_width)
+        size = oriented_size(image)
+        if image.format == 'JPEG' and size[0] > max_width:
+            scale = max_width / size[0]
+            image.draft('RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        yield image, size
@@ -0,0 +1,413 @@
+"""
+Concurrent load generator for the LitReview application.
+
+Virtual users, each logged in with its own session, send a weighted mix of
+requests (feed reads, ticket and review writes, follow toggles) for a given
+duration. Requests go through a transport:
+
+    - `WSGITransport`: calls `LitReview.wsgi.application` in-process, one
+      thread per virtual user;
+    - `ASGITransport`: calls `LitReview.asgi.application` in-process, on a
+      single event loop (as a single ASGI worker process would);
+    - `HTTPTransport`: sends HTTP requests to a server (`runserver`, gunicorn,
+      uvicorn...) or to a local threaded WSGI server started by the tool.
+
+Errors raised by the views are recorded through `got_request_exception`, so
+that SQLite lock timeouts ("database is locked") are told apart from the
+other server errors.
+"""
+import asyncio
+import contextvars
+import http.client
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+from django.conf import settings
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.signals import got_request_exception
+from django.db import connections
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from social.models import UserFollows
+from .models import Ticket
+
+LOCKED_MESSAGE = 'database is locked'
+
+ACTIONS = ['home', 'home-page-2', 'posts', 'follow-page', 'create-ticket', 'create-review',
+           'toggle-follow']
+
+# Exceptions raised by the views of the current request, see `record_exception`
+request_errors = contextvars.ContextVar('loadtest_request_errors', default=None)
+
+
+def record_exception(sender, request=None, **kwargs):
+    errors = request_errors.get()
+    if errors is not None:
+        errors.append(sys.exc_info()[1])
+
+
+got_request_exception.connect(record_exception, dispatch_uid='loadtest_record_exception')
+
+
+class Response:
+
+    def __init__(self, status, body, errors=()):
+        self.status = status
+        self.body = body
+        self.errors = list(errors)
+
+    @property
+    def locked(self):
+        return (any(LOCKED_MESSAGE in str(error) for error in self.errors)
+                or LOCKED_MESSAGE.encode() in self.body)
+
+
+def encode_request(method, path, data, cookies, csrf_token):
+    """
+    Returns the path, the body and the headers of a request.
+    """
+    headers = {
+        'Cookie': '; '.join(f'{name}={value}' for name, value in cookies.items()),
+        'X-CSRFToken': csrf_token,
+    }
+    body = b''
+    if method == 'GET' and data:
+        path = f'{path}?{urlencode(data)}'
+    elif method == 'POST':
+        body = urlencode(data or {}).encode()
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    headers['Content-Length'] = str(len(body))
+    return path, body, headers
+
+
+class WSGITransport:
+    """
+    Calls a WSGI application in the thread of the virtual user.
+    """
+
+    def __init__(self, application, host='localhost'):
+        self.application = application
+        self.host = host
+
+    def request(self, method, path, data, cookies, csrf_token):
+        path, body, headers = encode_request(method, path, data, cookies, csrf_token)
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': BytesIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = f'HTTP_{key}'
+            environ[key] = value
+        status = []
+        errors = []
+        token = request_errors.set(errors)
+        try:
+            result = self.application(environ, lambda code, headers, *args: status.append(code))
+            try:
+                content = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        finally:
+            request_errors.reset(token)
+        return Response(int(status[0].split()[0]), content, errors)
+
+    def close(self):
+        pass
+
+
+class ASGITransport:
+    """
+    Calls an ASGI application on an event loop shared by all the virtual users.
+    """
+
+    def __init__(self, application, host='localhost'):
+        self.application = application
+        self.host = host
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def call(self, method, path, body, headers):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [(b'host', self.host.encode())]
+            + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            'client': ('127.0.0.1', 0),
+            'server': (self.host, 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status, chunks, errors = [], [], []
+        request_errors.set(errors)
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The request is complete: wait until the response is sent
+            await asyncio.Future()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        await self.application(scope, receive, send)
+        return Response(status[0], b''.join(chunks), errors)
+
+    def request(self, method, path, data, cookies, csrf_token):
+        path, body, headers = encode_request(method, path, data, cookies, csrf_token)
+        # The coroutine runs in a copy of the current context
+        future = asyncio.run_coroutine_threadsafe(self.call(method, path, body, headers),
+                                                  self.loop)
+        return future.result()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPTransport:
+    """
+    Sends HTTP requests to a server, with one persistent connection per thread.
+
+    Without a URL, a threaded WSGI server (the server of `runserver`) serving
+    `application` is started on a free local port, and requested with `host`
+    as Host header.
+    """
+
+    def __init__(self, url=None, application=None, host='localhost'):
+        self.server = None
+        self.host_header = None
+        if url is None:
+            self.host_header = host
+            self.server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+            self.server.set_app(application)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        return self.local.connection
+
+    def request(self, method, path, data, cookies, csrf_token):
+        path, body, headers = encode_request(method, path, data, cookies, csrf_token)
+        if self.host_header:
+            headers['Host'] = self.host_header
+        connection = self.connection()
+        try:
+            connection.request(method, self.prefix + path, body, headers)
+            response = connection.getresponse()
+            return Response(response.status, response.read())
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            raise
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class VirtualUser:
+    """
+    A logged in user sending the requests of the mix.
+
+    Attributes:
+        - user (User): The user.
+        - cookies (dict): Session and CSRF cookies.
+        - review_candidates (list): IDs of visible tickets the user can review.
+        - follow_candidates (list): Usernames of users the user does not follow.
+        - followed (list): Usernames followed during the test, unfollowed next.
+    """
+
+    def __init__(self, user, rng):
+        self.user = user
+        self.rng = rng
+        client = Client()
+        client.force_login(user)
+        self.csrf_token = get_random_string(CSRF_SECRET_LENGTH, CSRF_ALLOWED_CHARS)
+        self.cookies = {
+            settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value,
+            settings.CSRF_COOKIE_NAME: self.csrf_token,
+        }
+        self.review_candidates = list(
+            Ticket.objects.visible_to(user)
+            .exclude(review__user=user)
+            .order_by('-time_created').values_list('pk', flat=True)[:200])
+        followed = UserFollows.objects.filter(user=user).values('followed_user')
+        self.follow_candidates = list(
+            type(user).objects.exclude(pk=user.pk).exclude(pk__in=followed)
+            .order_by('?').values_list('username', flat=True)[:50])
+        self.followed = []
+        self.sequence = 0
+
+    def next_request(self, action):
+        """
+        Returns the (method, path, data) of an action, or None if the user
+        cannot perform it anymore.
+        """
+        self.sequence += 1
+        if action == 'home':
+            return 'GET', reverse('home'), None
+        if action == 'home-page-2':
+            return 'GET', reverse('home'), {'page': 2}
+        if action == 'posts':
+            return 'GET', reverse('posts'), None
+        if action == 'follow-page':
+            return 'GET', reverse('follow-users-form'), None
+        if action == 'create-ticket':
+            return 'POST', reverse('create-ticket'), {
+                'title': f'Billet de charge {self.sequence}', 'description': 'Test de charge.'}
+        if action == 'create-review':
+            if not self.review_candidates:
+                return None
+            ticket_id = self.review_candidates.pop()
+            return 'POST', reverse('create-review', args=[ticket_id]), {
+                'rating': self.rng.randint(0, 5), 'headline': 'Critique de charge',
+                'body': 'Test de charge.'}
+        if action == 'toggle-follow':
+            if self.followed:
+                username = self.followed.pop()
+                follow = UserFollows.objects.filter(user=self.user,
+                                                    followed_user__username=username).first()
+                if follow is not None:
+                    return 'POST', reverse('follow-users-form'), {'unfollow_user': follow.pk}
+            if not self.follow_candidates:
+                return None
+            username = self.follow_candidates.pop()
+            self.followed.append(username)
+            return 'POST', reverse('follow-users-form'), {'follow_user': '',
+                                                          'followed_username': username}
+        raise ValueError(f"Unknown action: {action}")
+
+
+class Results:
+    """
+    Latencies and outcomes of the requests, per action.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.locked = defaultdict(int)
+
+    def record(self, action, latency, response=None):
+        with self.lock:
+            self.latencies[action].append(latency)
+            if response is None or response.status >= 400:
+                self.errors[action] += 1
+            if response is not None and response.locked:
+                self.locked[action] += 1
+
+    def summary(self, elapsed):
+        summary = {}
+        for action, latencies in sorted(self.latencies.items()):
+            cuts = (statistics.quantiles(latencies, n=100, method='inclusive')
+                    if len(latencies) > 1 else latencies * 99)
+            summary[action] = {
+                'requests': len(latencies),
+                'throughput': len(latencies) / elapsed,
+                'p50_ms': statistics.median(latencies) * 1000,
+                'p95_ms': cuts[94] * 1000,
+                'p99_ms': cuts[98] * 1000,
+                'error_rate': self.errors[action] / len(latencies),
+                'lock_rate': self.locked[action] / len(latencies),
+            }
+        return summary
+
+
+def run(transport, users, mix, duration, seed=0):
+    """
+    Runs the virtual users concurrently for `duration` seconds.
+
+    Args:
+        transport: The transport of the requests.
+        users (list): The users to log in, one virtual user each.
+        mix (dict): Weight of each action.
+        duration (float): Duration of the test, in seconds.
+        seed (int): Seed of the random choices of the actions.
+
+    Returns:
+        tuple: The `Results` and the elapsed time in seconds.
+    """
+    master = random.Random(seed)
+    virtual_users = [VirtualUser(user, random.Random(master.random())) for user in users]
+    actions, weights = list(mix), list(mix.values())
+    results = Results()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def loop(virtual_user):
+        try:
+            while time.perf_counter() < deadline:
+                action = virtual_user.rng.choices(actions, weights)[0]
+                request = virtual_user.next_request(action)
+                if request is None:
+                    continue
+                method, path, data = request
+                request_start = time.perf_counter()
+                try:
+                    response = transport.request(method, path, data, virtual_user.cookies,
+                                                 virtual_user.csrf_token)
+                except Exception:
+                    results.record(action, time.perf_counter() - request_start)
+                else:
+                    results.record(action, time.perf_counter() - request_start, response)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=loop, args=[virtual_user])
+               for virtual_user in virtual_users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
@@ -0,0 +1,82 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_MIX = 'home=70,home-page-2=15,posts=15'
+
+# Compared stacks: (name, loadtest transport, FEED_ASYNC_VIEWS)
+STACKS = [
+    ('wsgi', 'wsgi', '0'),
+    ('asgi', 'asgi', '1'),
+]
+
+
+class Command(BaseCommand):
+    help = ("Compares the throughput and the latencies of the feed pages served by the "
+            "WSGI application with the sync views and by the ASGI application with the "
+            "async views, at the same concurrency. Each stack is measured by `loadtest` "
+            "in a process of its own (FEED_ASYNC_VIEWS is read at startup).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=16,
+                            help="Number of concurrent virtual users.")
+        parser.add_argument('--duration', type=float, default=20,
+                            help="Duration of each run, in seconds.")
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f"Weights of the actions (default: {DEFAULT_MIX}).")
+        parser.add_argument('--output', help="JSON file receiving the results.")
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, transport, async_views in STACKS:
+            self.stdout.write(f"Mesure de {name}…")
+            results[name] = self.measure(transport, async_views, options)
+        self.report(results)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+        failing = sorted(f"{action} ({name})" for name in results
+                         for action, result in results[name]['results'].items()
+                         if result['error_rate'] > 0)
+        if failing:
+            raise CommandError(f"Requêtes en erreur : {', '.join(failing)}.")
+
+    def measure(self, transport, async_views, options):
+        """
+        Runs `loadtest` in a new process and returns its results.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'loadtest',
+                       '--transport', transport, '--users', str(options['users']),
+                       '--duration', str(options['duration']), '--mix', options['mix'],
+                       '--output', output]
+            environment = {**os.environ, 'LITREVIEW_ASYNC_VIEWS': async_views}
+            process = subprocess.run(command, env=environment, capture_output=True, text=True)
+            if process.returncode:
+                raise CommandError(f"Échec de loadtest ({transport}) :\n{process.stderr}")
+            return json.loads(Path(output).read_text())
+
+    def report(self, results):
+        names = list(results)
+        header = f"{'action':<15}{'pile':<6}{'req/s':>9}{'p50 (ms)':>10}{'p95 (ms)':>10}" \
+                 f"{'p99 (ms)':>10}{'erreurs':>9}"
+        self.stdout.write(header)
+        actions = sorted({action for name in names for action in results[name]['results']})
+        for action in actions:
+            for name in names:
+                result = results[name]['results'].get(action)
+                if result is None:
+                    continue
+                self.stdout.write(
+                    f"{action:<15}{name:<6}{result['throughput']:>9.1f}{result['p50_ms']:>10.1f}"
+                    f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+                    f"{result['error_rate']:>9.1%}")
+        for name in names:
+            total = sum(result['requests'] for result in results[name]['results'].values())
+            self.stdout.write(f"{name} : {total / results[name]['duration']:.1f} req/s "
+                              f"avec {results[name]['users']} utilisateurs.")
@@ -0,0 +1,114 @@
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from reviews.models import Photo
+
+# Peak memory of the interpreter: VmHWM is reset by exec, unlike ru_maxrss,
+# which keeps the peak of the forked parent process
+PEAK_MEMORY = """
+import resource
+
+
+def peak_memory_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+# Run in a bare interpreter per measure, so that the peak memory of a
+# decoding is not hidden by the memory of Django or of a previous decoding
+MEASURE = PEAK_MEMORY + """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+from PIL import Image
+from reviews import images
+
+path, implementation, max_width = sys.argv[2], sys.argv[3], int(sys.argv[4])
+start = time.perf_counter()
+if implementation == 'full':
+    # Former decoding: the whole image is decoded, then resized
+    with Image.open(path) as image:
+        image.load()
+        size = (max_width, round(image.height * max_width / image.width))
+        image.resize(size, Image.LANCZOS)
+else:
+    with images.open_reduced(path, max_width) as (image, full_size):
+        image.load()
+        size = (max_width, round(full_size[1] * max_width / full_size[0]))
+        image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+print(json.dumps({'seconds': time.perf_counter() - start, 'peak_kb': peak_memory_kb()}))
+"""
+
+# Idle interpreter with Pillow imported: subtracted from the peaks
+IDLE = PEAK_MEMORY + """
+import json
+from PIL import Image
+print(json.dumps({'seconds': 0, 'peak_kb': peak_memory_kb()}))
+"""
+
+
+class Command(BaseCommand):
+    help = ("Measures the peak memory and the time needed to decode large uploads, "
+            "with the former full decoding and with the bounded, reduced decoding.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jpeg', type=int, nargs='*', default=[12, 24, 50],
+                            help="Sizes of the sample JPEG images, in megapixels.")
+        parser.add_argument('--png', type=int, nargs='*', default=[16],
+                            help="Sizes of the sample PNG images, in megapixels.")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Number of measures per image and implementation.")
+
+    def handle(self, *args, **options):
+        max_width = max(Photo.RENDITION_WIDTHS)
+        idle = self.run(IDLE)['peak_kb']
+        self.stdout.write(f"{'image':<16} {'Mo':>6} {'implémentation':<15}"
+                          f"{'pic mémoire (Mo)':>17} {'temps (ms)':>11}")
+        with tempfile.TemporaryDirectory() as directory:
+            for path in self.samples(Path(directory), options['jpeg'], options['png']):
+                for implementation in ('full', 'reduced'):
+                    results = [self.run(MEASURE, path, implementation, max_width)
+                               for _ in range(max(options['repeat'], 1))]
+                    peak = max(result['peak_kb'] for result in results) - idle
+                    seconds = min(result['seconds'] for result in results)
+                    self.stdout.write(
+                        f"{path.name:<16} {path.stat().st_size / 2**20:>6.1f} "
+                        f"{implementation:<15}{peak / 1024:>17.1f} {seconds * 1000:>11.0f}")
+
+    def samples(self, directory, jpeg_sizes, png_sizes):
+        """
+        Writes the sample images (4:3 gradients with some texture) and yields their paths.
+        """
+        for image_format, sizes in (('JPEG', jpeg_sizes), ('PNG', png_sizes)):
+            for megapixels in sizes:
+                width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+                height = width * 3 // 4
+                texture = Image.effect_noise((256, 192), 48)
+                image = Image.merge('RGB', [
+                    Image.linear_gradient('L').resize((width, height)),
+                    texture.resize((width, height)),
+                    Image.linear_gradient('L').rotate(90).resize((width, height)),
+                ])
+                path = directory / f'{megapixels}mp.{image_format.lower()}'
+                image.save(path, image_format, **({'quality': 90} if image_format == 'JPEG'
+                                                  else {'compress_level': 1}))
+                del image
+                yield path
+
+    def run(self, code, *args):
+        process = subprocess.run(
+            [sys.executable, '-c', code, str(settings.BASE_DIR), *map(str, args)],
+            capture_output=True, text=True)
+        if process.returncode:
+            raise CommandError(process.stderr.strip().splitlines()[-1])
+        return json.loads(process.stdout)
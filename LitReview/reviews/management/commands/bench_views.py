@@ -0,0 +1,301 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef
+from django.test import Client, override_settings
+from django.urls import reverse
+from reviews.models import Photo, Review, Ticket
+from social.models import UserFollows
+
+# Metrics compared between two runs: (name, path in the results, unit)
+COMPARED_METRICS = [
+    ('wall p50', ('wall_ms', 'p50'), 'ms'),
+    ('wall p95', ('wall_ms', 'p95'), 'ms'),
+    ('requêtes SQL', ('queries',), ''),
+    ('temps SQL', ('sql_ms',), 'ms'),
+    ('pic mémoire', ('peak_kib',), 'Kio'),
+]
+
+
+class Scenario:
+    """
+    A request measured by the benchmark.
+
+    Attributes:
+        - name (str): Name of the scenario in the results.
+        - method (str): 'get' or 'post'.
+        - url (callable): Returns the URL, given the benchmarked user.
+        - data (dict): Data of the POST requests.
+        - writes (bool): The request changes the database: it runs in a
+          transaction which is rolled back, so the dataset stays the same.
+    """
+
+    def __init__(self, name, method, url, data=None, writes=False):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.data = data or {}
+        self.writes = writes
+
+
+def own_ticket(user):
+    ticket = Ticket.objects.filter(user=user).order_by('-time_created').first()
+    if ticket is None:
+        raise LookupError("aucun billet")
+    return ticket
+
+
+def own_review(user):
+    review = Review.objects.filter(user=user).order_by('-time_created').first()
+    if review is None:
+        raise LookupError("aucune critique")
+    return review
+
+
+REVIEW_DATA = {'rating': '4', 'headline': 'Critique de test', 'body': 'Texte.'}
+
+SCENARIOS = [
+    Scenario('home', 'get', lambda user: reverse('home')),
+    Scenario('posts', 'get', lambda user: reverse('posts')),
+    Scenario('follow-users', 'get', lambda user: reverse('follow-users-form')),
+    Scenario('create-ticket-review', 'post', lambda user: reverse('create-ticket-and-review'),
+             data={'title': 'Billet de test', 'description': 'Description.', **REVIEW_DATA},
+             writes=True),
+    Scenario('edit-ticket', 'post',
+             lambda user: reverse('edit-ticket', args=[own_ticket(user).pk]),
+             data={'title': 'Billet modifié', 'description': 'Description.'}, writes=True),
+    Scenario('edit-review', 'post',
+             lambda user: reverse('edit-review', args=[own_review(user).pk]),
+             data=REVIEW_DATA, writes=True),
+    Scenario('delete-ticket', 'post',
+             lambda user: reverse('delete-ticket', args=[own_ticket(user).pk]), writes=True),
+    Scenario('delete-review', 'post',
+             lambda user: reverse('delete-review', args=[own_review(user).pk]), writes=True),
+]
+
+
+class QueryTimer:
+    """
+    Database execute wrapper counting the queries and timing them with a
+    monotonic clock (the debug cursor only keeps milliseconds).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def percentiles(values):
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {
+        'p50': statistics.median(values),
+        'p90': cuts[89],
+        'p95': cuts[94],
+        'p99': cuts[98],
+        'mean': statistics.fmean(values),
+    }
+
+
+def metric(result, path):
+    for key in path:
+        result = result[key]
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the main views through the test client on the current database "
+            "(see seed_dataset): wall time percentiles, SQL queries and time, peak "
+            "allocations. Results are saved as JSON and compared with a previous run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user',
+                            help="User making the requests. Defaults to the user "
+                                 "following the most users.")
+        parser.add_argument('--scenario', action='append', dest='scenarios', default=[],
+                            choices=[scenario.name for scenario in SCENARIOS],
+                            help="Only run this scenario (can be repeated).")
+        parser.add_argument('--iterations', type=int, default=30,
+                            help="Number of measured requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=3,
+                            help="Number of requests before the measures.")
+        parser.add_argument('--cold-cache', action='store_true',
+                            help="Clear the feed cache before each request.")
+        parser.add_argument('--output', help="JSON file receiving the results.")
+        parser.add_argument('--baseline',
+                            help="JSON results of a previous run to compare with.")
+        parser.add_argument('--against',
+                            help="With --baseline: compare with these JSON results "
+                                 "instead of running the benchmark.")
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help="Relative increase reported as a regression (0.10 = 10%%).")
+
+    def handle(self, *args, **options):
+        if options['against']:
+            if not options['baseline']:
+                raise CommandError("--against requiert --baseline.")
+            run = json.loads(Path(options['against']).read_text())
+        else:
+            run = self.run(options)
+            if options['output']:
+                Path(options['output']).write_text(json.dumps(run, indent=2))
+                self.stdout.write(f"Résultats enregistrés dans {options['output']}.")
+        if options['baseline']:
+            baseline = json.loads(Path(options['baseline']).read_text())
+            regressions = self.compare(baseline, run, options['threshold'])
+            if regressions:
+                raise CommandError(f"{regressions} régression(s) au-delà de "
+                                   f"{options['threshold']:.0%}.")
+            self.stdout.write(self.style.SUCCESS("Aucune régression."))
+
+    def get_user(self, username):
+        User = get_user_model()
+        users = User.objects.annotate(following_count=Count('following'))
+        if username:
+            users = users.filter(username=username)
+        else:
+            # The edit and delete scenarios need a ticket and a review of the user
+            users = users.filter(Exists(Ticket.objects.filter(user=OuterRef('pk'))),
+                                 Exists(Review.objects.filter(user=OuterRef('pk'))))
+        user = users.order_by('-following_count', 'pk').first()
+        if user is None:
+            raise CommandError("Aucun utilisateur à utiliser.")
+        return user
+
+    def run(self, options):
+        user = self.get_user(options['user'])
+        scenarios = [scenario for scenario in SCENARIOS
+                     if not options['scenarios'] or scenario.name in options['scenarios']]
+        client = Client()
+        client.force_login(user)
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for scenario in scenarios:
+                try:
+                    url = scenario.url(user)
+                except LookupError as error:
+                    self.stdout.write(self.style.WARNING(f"{scenario.name} ignoré : {error}."))
+                    continue
+                results[scenario.name] = self.measure(client, scenario, url, options)
+                self.report(scenario.name, results[scenario.name])
+        return {
+            'meta': {
+                'date': datetime.now(timezone.utc).isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'user': user.username,
+                'iterations': options['iterations'],
+                'cold_cache': options['cold_cache'],
+                'dataset': {
+                    'users': get_user_model().objects.count(),
+                    'follows': UserFollows.objects.count(),
+                    'tickets': Ticket.objects.count(),
+                    'reviews': Review.objects.count(),
+                    'photos': Photo.objects.count(),
+                },
+            },
+            'results': results,
+        }
+
+    def request(self, client, scenario, url, cold_cache):
+        """
+        Sends the request of a scenario.
+
+        Returns:
+            tuple: The wall time in milliseconds and the `QueryTimer` of the request.
+        """
+        if cold_cache:
+            caches[getattr(settings, 'FEED_CACHE_ALIAS', 'feed')].clear()
+        queries = QueryTimer()
+        with transaction.atomic():
+            with connection.execute_wrapper(queries):
+                start = time.perf_counter()
+                response = getattr(client, scenario.method)(url, scenario.data)
+                wall = (time.perf_counter() - start) * 1000
+            if scenario.writes:
+                transaction.set_rollback(True)
+        if response.status_code >= 400:
+            raise CommandError(f"{scenario.name} : réponse {response.status_code} pour {url}.")
+        return wall, queries
+
+    def measure(self, client, scenario, url, options):
+        for _ in range(options['warmup']):
+            self.request(client, scenario, url, options['cold_cache'])
+        walls, query_counts, sql_times = [], [], []
+        for _ in range(max(options['iterations'], 2)):
+            wall, queries = self.request(client, scenario, url, options['cold_cache'])
+            walls.append(wall)
+            query_counts.append(queries.count)
+            sql_times.append(queries.seconds * 1000)
+        # Allocations are traced in a separate request: tracing slows the code down
+        tracemalloc.start()
+        try:
+            self.request(client, scenario, url, options['cold_cache'])
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'url': url,
+            'wall_ms': percentiles(walls),
+            'queries': statistics.median(query_counts),
+            'sql_ms': statistics.median(sql_times),
+            'peak_kib': peak / 1024,
+        }
+
+    def report(self, name, result):
+        wall = result['wall_ms']
+        self.stdout.write(
+            f"{name:<22} p50 {wall['p50']:>8.2f} ms  p95 {wall['p95']:>8.2f} ms  "
+            f"{result['queries']:>4g} requêtes ({result['sql_ms']:.2f} ms)  "
+            f"pic {result['peak_kib']:>8.0f} Kio")
+
+    def compare(self, baseline, run, threshold):
+        """
+        Prints the metrics of both runs side by side.
+
+        Returns:
+            int: The number of metrics increased by more than `threshold`.
+        """
+        regressions = 0
+        for name, result in run['results'].items():
+            previous = baseline['results'].get(name)
+            if previous is None:
+                continue
+            for label, path, unit in COMPARED_METRICS:
+                old, new = metric(previous, path), metric(result, path)
+                change = (new - old) / old if old else (1 if new else 0)
+                flag = ''
+                if change > threshold:
+                    regressions += 1
+                    flag = self.style.ERROR('  RÉGRESSION')
+                self.stdout.write(f"{name:<22} {label:<14} {old:>10.2f} -> {new:>10.2f} {unit:<4}"
+                                  f"{change:>+8.1%}{flag}")
+        return regressions
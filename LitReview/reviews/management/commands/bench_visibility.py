@@ -0,0 +1,101 @@
+import statistics
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from reviews.feed import FEED_PAGE_SIZE, Feed
+from reviews.models import Review, Ticket
+from social.models import UserFollows
+
+
+def legacy_querysets(user):
+    """
+    Previous implementation of the home feed filters: the blocked users are
+    loaded in Python sets and sent back to the database as an IN list.
+    """
+    blocked_users = (UserFollows.objects.filter(user=user, blocked=True)
+                     .values_list('followed_user', flat=True))
+    blocked_by_users = (UserFollows.objects.filter(followed_user=user, blocked=True)
+                        .values_list('user', flat=True))
+    blocked_combined = set(blocked_users).union(set(blocked_by_users))
+    followed_users = user.following.values_list('followed_user', flat=True)
+    tickets = Ticket.objects.filter(
+        (Q(user__in=followed_users) | Q(user=user))
+        & ~Q(user__in=blocked_combined)
+    )
+    reviews = Review.objects.filter(
+        (Q(user__in=followed_users) | Q(user=user) | Q(ticket__user=user))
+        & ~Q(user__in=blocked_combined)
+    )
+    return tickets, reviews
+
+
+def subquery_querysets(user):
+    """
+    Current implementation: follow and block rules evaluated as subqueries.
+    """
+    return Ticket.objects.visible_to(user), Review.objects.visible_to(user)
+
+
+class Command(BaseCommand):
+    help = ("Compares the time needed to build the first page of the home feed with "
+            "the former Python-set block filtering and with the subquery filtering.")
+
+    implementations = {
+        'legacy': legacy_querysets,
+        'subquery': subquery_querysets,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', default=[],
+                            help="User whose feed is measured (can be repeated). Defaults "
+                                 "to the users with the most block relationships.")
+        parser.add_argument('--users', type=int, default=3,
+                            help="Number of users picked when --user is not given.")
+        parser.add_argument('--repeat', type=int, default=20,
+                            help="Number of measures per user and implementation.")
+
+    def handle(self, *args, **options):
+        users = self.get_users(options['usernames'], options['users'])
+        self.stdout.write(f"{'utilisateur':<20} {'blocages':>9} {'implémentation':<15}"
+                          f"{'médiane (ms)':>13} {'p95 (ms)':>10}")
+        for user in users:
+            expected = None
+            for name, implementation in self.implementations.items():
+                timings, page = self.measure(user, implementation, options['repeat'])
+                if expected is not None and page != expected:
+                    raise CommandError(f"Les implémentations diffèrent pour {user.username}.")
+                expected = page
+                self.stdout.write(
+                    f"{user.username:<20} {user.blocks:>9} {name:<15}"
+                    f"{statistics.median(timings):>13.2f} "
+                    f"{statistics.quantiles(timings, n=20)[-1]:>10.2f}")
+
+    def get_users(self, usernames, count):
+        users = get_user_model().objects.annotate(
+            blocks=Count('following', filter=Q(following__blocked=True), distinct=True)
+            + Count('followed_by', filter=Q(followed_by__blocked=True), distinct=True))
+        if usernames:
+            users = users.filter(username__in=usernames)
+        else:
+            users = users.order_by('-blocks')[:count]
+        users = list(users)
+        if not users:
+            raise CommandError("Aucun utilisateur à mesurer.")
+        return users
+
+    def measure(self, user, implementation, repeat):
+        """
+        Builds the first page of the feed `repeat` times (index, count and posts).
+
+        Returns:
+            tuple: The timings in milliseconds and the (kind, id) of the page posts.
+        """
+        timings = []
+        for _ in range(max(repeat, 2)):
+            start = time.perf_counter()
+            feed = Feed(*implementation(user), viewer=user)
+            feed.count()
+            page = feed[:FEED_PAGE_SIZE]
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings, [(type(post).__name__, post.pk) for post in page]
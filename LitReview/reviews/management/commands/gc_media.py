@@ -0,0 +1,144 @@
+import json
+import os
+import time
+from datetime import timedelta
+from pathlib import Path, PurePosixPath
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from reviews.models import Photo, PhotoRendition, Ticket
+from reviews.utils import batched
+
+
+def walk_directories(root, relative=PurePosixPath()):
+    """
+    Yields the paths of `root` (as '.') and of its subdirectories, relative
+    to `root`. Directories are streamed by os.scandir, in no particular order.
+    """
+    yield relative
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_directories(entry.path, relative / entry.name)
+
+
+def scan_files(directory):
+    """
+    Yields the names of the files of a directory, streamed by os.scandir:
+    flat directories such as `renditions/` are never loaded whole in memory.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                yield entry.name
+
+
+class Command(BaseCommand):
+    help = ("Deletes the Photo rows without image or used by no ticket, and the files "
+            "of MEDIA_ROOT referenced by no photo or rendition. Rows and files are "
+            "streamed in batches; use --dry-run to only report them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would be deleted without deleting anything.")
+        parser.add_argument('--batch', type=int, default=500,
+                            help="Number of rows or files handled per query.")
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help="Seconds during which new photos and files are kept "
+                                 "(uploads not yet attached to their ticket).")
+        parser.add_argument('--checkpoint',
+                            help="JSON file recording the progress (last photo, collected "
+                                 "directories): an interrupted run resumes from it, and it is "
+                                 "deleted at the end.")
+        parser.add_argument('--skip-photos', action='store_true',
+                            help="Do not collect the Photo rows.")
+        parser.add_argument('--skip-files', action='store_true',
+                            help="Do not collect the files of MEDIA_ROOT.")
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.batch = options['batch']
+        self.min_age = options['min_age']
+        self.checkpoint_path = options['checkpoint'] and Path(options['checkpoint'])
+        self.checkpoint = self.load_checkpoint()
+        if not options['skip_photos']:
+            self.collect_photos()
+        if not options['skip_files']:
+            self.collect_files()
+        if self.checkpoint_path and not self.dry_run:
+            self.checkpoint_path.unlink(missing_ok=True)
+
+    def load_checkpoint(self):
+        if self.checkpoint_path and self.checkpoint_path.exists():
+            checkpoint = {'photo': 0, 'directories': [],
+                          **json.loads(self.checkpoint_path.read_text())}
+            self.stdout.write(f"Reprise : photo {checkpoint['photo']}, "
+                              f"{len(checkpoint['directories'])} dossier(s) traité(s).")
+            return checkpoint
+        return {'photo': 0, 'directories': []}
+
+    def save_checkpoint(self, **progress):
+        self.checkpoint.update(progress)
+        if self.checkpoint_path and not self.dry_run:
+            self.checkpoint_path.write_text(json.dumps(self.checkpoint))
+
+    def collect_photos(self):
+        """
+        Deletes the photos without image, and the photos used by no ticket,
+        scanning the table in primary key order.
+        """
+        garbage = (Q(image='') | Q(image__isnull=True)
+                   | ~Exists(Ticket.objects.filter(photo=OuterRef('pk'))))
+        old_enough = Q(date_created__lt=timezone.now() - timedelta(seconds=self.min_age))
+        found = 0
+        while True:
+            photo_ids = list(Photo.objects
+                             .filter(garbage, old_enough, pk__gt=self.checkpoint['photo'])
+                             .order_by('pk').values_list('pk', flat=True)[:self.batch])
+            if not photo_ids:
+                break
+            found += len(photo_ids)
+            if not self.dry_run:
+                # The conditions are checked again: a ticket may have been attached
+                # since; the files are deleted by the post_delete signal handlers
+                Photo.objects.filter(garbage, pk__in=photo_ids).delete()
+            self.save_checkpoint(photo=photo_ids[-1])
+        verb = "à supprimer" if self.dry_run else "supprimée(s)"
+        self.stdout.write(self.style.SUCCESS(f"{found} photo(s) orpheline(s) {verb}."))
+
+    def collect_files(self):
+        """
+        Deletes the files of MEDIA_ROOT referenced by no photo and no rendition.
+
+        The directories are collected one after the other; the checkpoint
+        records the collected ones, and an interrupted run scans the
+        directory it was collecting again.
+        """
+        root = Path(settings.MEDIA_ROOT)
+        if not root.is_dir():
+            return
+        limit = time.time() - self.min_age
+        found = size = 0
+        for directory in walk_directories(root):
+            if str(directory) in self.checkpoint['directories']:
+                continue
+            for batch in batched(scan_files(root / directory), self.batch):
+                names = [str(directory / name) for name in batch]
+                referenced = {
+                    *Photo.objects.filter(image__in=names).values_list('image', flat=True),
+                    *PhotoRendition.objects.filter(file__in=names).values_list('file', flat=True)}
+                for name in names:
+                    path = root / name
+                    if name in referenced or path.stat().st_mtime > limit:
+                        continue
+                    found += 1
+                    size += path.stat().st_size
+                    if self.dry_run:
+                        self.stdout.write(f"  {name}")
+                    else:
+                        path.unlink(missing_ok=True)
+            self.save_checkpoint(directories=[*self.checkpoint['directories'], str(directory)])
+        verb = "à supprimer" if self.dry_run else "supprimé(s)"
+        self.stdout.write(self.style.SUCCESS(
+            f"{found} fichier(s) orphelin(s) {verb} ({size / 2**20:.1f} Mo)."))
@@ -0,0 +1,97 @@
+import json
+from pathlib import Path
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from reviews import loadtest
+
+DEFAULT_MIX = ('home=45,home-page-2=10,posts=10,follow-page=5,create-ticket=10,'
+               'create-review=10,toggle-follow=10')
+
+
+def parse_mix(value):
+    """
+    Parses a mix of actions such as "home=80,create-ticket=20".
+    """
+    mix = {}
+    for item in value.split(','):
+        action, _, weight = item.partition('=')
+        mix[action.strip()] = float(weight or 1)
+    return mix
+
+
+class Command(BaseCommand):
+    help = ("Sends concurrent requests of logged in users (feed reads, writes, follow "
+            "toggles) to the application, in-process (WSGI or ASGI) or over HTTP, and "
+            "reports the throughput, the latencies and the error and lock rates. "
+            "The writes are kept: run it on a seeded copy of the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transport', choices=['wsgi', 'asgi', 'http'], default='wsgi',
+                            help="wsgi / asgi: the application is called in-process; "
+                                 "http: requests are sent to --url.")
+        parser.add_argument('--url',
+                            help="Base URL of the server for the http transport. Without "
+                                 "it, a local threaded WSGI server is started.")
+        parser.add_argument('--host', default='localhost',
+                            help="Host of the in-process requests (must be in ALLOWED_HOSTS).")
+        parser.add_argument('--users', type=int, default=10,
+                            help="Number of concurrent virtual users.")
+        parser.add_argument('--prefix', default='seed',
+                            help="Prefix of the usernames of the virtual users.")
+        parser.add_argument('--duration', type=float, default=30,
+                            help="Duration of the test, in seconds.")
+        parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                            help=f"Weights of the actions (default: {DEFAULT_MIX}).")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Seed of the choice of the actions.")
+        parser.add_argument('--output', help="JSON file receiving the results.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['mix']) - set(loadtest.ACTIONS)
+        if unknown:
+            raise CommandError(f"Actions inconnues : {', '.join(sorted(unknown))}.")
+        users = list(get_user_model().objects.filter(username__startswith=options['prefix'])
+                     .order_by('pk')[:options['users']])
+        if not users:
+            raise CommandError(f"Aucun utilisateur « {options['prefix']}… » : "
+                               "lancez d'abord seed_dataset.")
+
+        transport = self.get_transport(options['transport'], options['url'], options['host'])
+        try:
+            results, elapsed = loadtest.run(transport, users, options['mix'],
+                                            options['duration'], options['seed'])
+        finally:
+            transport.close()
+
+        summary = results.summary(elapsed)
+        self.report(summary, elapsed)
+        if options['output']:
+            Path(options['output']).write_text(json.dumps({
+                'transport': options['transport'],
+                'users': len(users),
+                'duration': elapsed,
+                'mix': options['mix'],
+                'results': summary,
+            }, indent=2))
+
+    def get_transport(self, name, url, host):
+        if name == 'asgi':
+            from LitReview.asgi import application
+            return loadtest.ASGITransport(application, host)
+        if name == 'http' and url:
+            return loadtest.HTTPTransport(url)
+        from LitReview.wsgi import application
+        if name == 'http':
+            return loadtest.HTTPTransport(application=application, host=host)
+        return loadtest.WSGITransport(application, host)
+
+    def report(self, summary, elapsed):
+        self.stdout.write(f"{'action':<15}{'requêtes':>9}{'req/s':>9}{'p50 (ms)':>10}"
+                          f"{'p95 (ms)':>10}{'p99 (ms)':>10}{'erreurs':>9}{'verrous':>9}")
+        for action, result in summary.items():
+            self.stdout.write(
+                f"{action:<15}{result['requests']:>9}{result['throughput']:>9.1f}"
+                f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+                f"{result['error_rate']:>9.1%}{result['lock_rate']:>9.1%}")
+        total = sum(result['requests'] for result in summary.values())
+        self.stdout.write(f"{total} requêtes en {elapsed:.1f} s ({total / elapsed:.1f} req/s).")
@@ -0,0 +1,66 @@
+import time
+from django.core.management.base import BaseCommand
+from reviews import tasks
+from reviews.models import Photo
+
+
+class Command(BaseCommand):
+    help = ("Processes the pending photos (worker of the 'worker' PHOTO_PROCESSING backend), "
+            "or reports the photos whose processing failed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Process the pending photos, then exit.")
+        parser.add_argument('--batch', type=int, default=20,
+                            help="Number of photos fetched from the queue at once.")
+        parser.add_argument('--interval', type=float, default=2,
+                            help="Seconds between two polls of an empty queue.")
+        parser.add_argument('--retry-delay', type=int, default=30,
+                            help="Seconds before retrying a failed attempt.")
+        parser.add_argument('--report', action='store_true',
+                            help="List the failed photos and exit.")
+        parser.add_argument('--retry-failed', action='store_true',
+                            help="Put the failed photos back in the queue and exit.")
+        parser.add_argument('--backfill', action='store_true',
+                            help="Put the ready photos without renditions back in the queue "
+                                 "and exit.")
+
+    def handle(self, *args, **options):
+        if options['report']:
+            return self.report()
+        if options['retry_failed']:
+            count = (Photo.objects.filter(status=Photo.FAILED)
+                     .update(status=Photo.PENDING, attempts=0, processing_started_at=None))
+            self.stdout.write(f"{count} photo(s) remise(s) en file.")
+            return
+        if options['backfill']:
+            count = (Photo.objects.filter(status=Photo.READY, renditions__isnull=True)
+                     .exclude(image='').exclude(image__isnull=True)
+                     .update(status=Photo.PENDING, attempts=0, processing_started_at=None))
+            self.stdout.write(f"{count} photo(s) sans déclinaisons remise(s) en file.")
+            return
+
+        processed = 0
+        while True:
+            requeued = tasks.requeue_stalled()
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"{requeued} photo(s) bloquée(s) remise(s)"
+                                                     " en file."))
+            photo_ids = tasks.pending_photo_ids(options['batch'], options['retry_delay'])
+            for photo_id in photo_ids:
+                status = tasks.process_photo(photo_id)
+                if status is not None:
+                    processed += 1
+                    self.stdout.write(f"Photo {photo_id} : {status}")
+            if not photo_ids:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"{processed} traitement(s) effectué(s)."))
+
+    def report(self):
+        failed = Photo.objects.filter(status=Photo.FAILED).order_by('pk')
+        for photo in failed.iterator():
+            self.stdout.write(f"Photo {photo.pk} ({photo.image.name}), "
+                              f"{photo.attempts} tentative(s) : {photo.last_error}")
+        self.stdout.write(f"{failed.count()} photo(s) en échec.")
@@ -0,0 +1,18 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from reviews import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of the tickets and reviews."
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError("L'index de recherche n'existe pas (SQLite avec FTS5 requis).")
+        started = time.perf_counter()
+        # Searches see the old index until the new one is committed
+        with transaction.atomic():
+            search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Index de recherche reconstruit en {time.perf_counter() - started:.1f} s."))
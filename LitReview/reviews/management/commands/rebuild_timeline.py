@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from reviews import timeline
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the materialized home feeds (FeedEntry) from the tickets and reviews, "
+            "or checks them against the live feed query with --check.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', default=[],
+                            help="Only process this user (can be repeated).")
+        parser.add_argument('--check', action='store_true',
+                            help="Compare the materialized feeds with the live query "
+                                 "instead of rebuilding them.")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        if options['check']:
+            self.check_feeds(users)
+        else:
+            self.rebuild_feeds(users)
+
+    def rebuild_feeds(self, users):
+        count = 0
+        for user in users.iterator():
+            # Each feed is swapped atomically: readers see the old or the new feed
+            with transaction.atomic():
+                timeline.rebuild(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"{count} fil(s) reconstruit(s)."))
+
+    def check_feeds(self, users):
+        invalid = 0
+        for user in users.iterator():
+            missing, extra = timeline.differences(user)
+            if missing or extra:
+                invalid += 1
+                self.stdout.write(self.style.WARNING(
+                    f"{user.username} : {len(missing)} post(s) manquant(s), "
+                    f"{len(extra)} post(s) en trop."))
+        if invalid:
+            raise CommandError(f"{invalid} fil(s) différent(s) du flux calculé.")
+        self.stdout.write(self.style.SUCCESS("Les fils matérialisés sont à jour."))
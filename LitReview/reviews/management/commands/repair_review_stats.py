@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from reviews.models import Ticket
+
+
+class Command(BaseCommand):
+    help = ("Recomputes the review aggregates of the tickets (review count, rating sum, "
+            "newest review time) from their reviews, or checks them with --check.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="List the tickets whose aggregates are wrong, without "
+                                 "repairing them.")
+        parser.add_argument('--batch', type=int, default=5000,
+                            help="Number of tickets (by ID range) updated per transaction.")
+
+    def handle(self, *args, **options):
+        if options['check']:
+            return self.check_stats()
+
+        last_id = Ticket.objects.aggregate(last=Max('pk'))['last'] or 0
+        updated = 0
+        for start in range(0, last_id, options['batch']):
+            with transaction.atomic():
+                updated += (Ticket.objects
+                            .filter(pk__gt=start, pk__lte=start + options['batch'])
+                            .update_review_stats())
+        self.stdout.write(self.style.SUCCESS(f"{updated} billet(s) recalculé(s)."))
+
+    def check_stats(self):
+        stale = Ticket.objects.with_stale_review_stats().order_by('pk')
+        count = 0
+        for ticket in stale.iterator():
+            count += 1
+            self.stdout.write(self.style.WARNING(
+                f"Billet {ticket.pk} : {ticket.review_count} critique(s), "
+                f"somme {ticket.rating_sum} enregistrées."))
+        if count:
+            raise CommandError(f"{count} billet(s) avec des agrégats faux.")
+        self.stdout.write(self.style.SUCCESS("Les agrégats des billets sont à jour."))
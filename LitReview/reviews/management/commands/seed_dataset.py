@@ -0,0 +1,255 @@
+import hashlib
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from reviews import timeline
+from reviews.models import Photo, Review, Ticket, photo_upload_to
+from reviews.utils import batched
+from social.models import UserFollows
+
+
+@contextmanager
+def explicit_dates(*models):
+    """
+    Lets `bulk_create` keep the given `time_created` of the models, which are
+    otherwise replaced by the current time (`auto_now_add`).
+    """
+    fields = [model._meta.get_field('time_created') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = ("Generates a synthetic, reproducible dataset: users, follows with a "
+            "power-law popularity, blocks, tickets, reviews and optional photos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help="Number of users.")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Seed of the generator: the same seed gives the same dataset.")
+        parser.add_argument('--prefix', default='seed',
+                            help="Prefix of the usernames.")
+        parser.add_argument('--password', default='password',
+                            help="Password of every generated user.")
+        parser.add_argument('--follows-per-user', type=float, default=20,
+                            help="Mean number of users followed by a user.")
+        parser.add_argument('--popularity-exponent', type=float, default=1.1,
+                            help="Exponent of the Zipf law of the popularity: the user of "
+                                 "rank r is followed with a weight of 1/r^exponent.")
+        parser.add_argument('--block-ratio', type=float, default=0.02,
+                            help="Share of the relationships which are blocks.")
+        parser.add_argument('--tickets-per-user', type=float, default=5,
+                            help="Mean number of tickets per user.")
+        parser.add_argument('--reviews-per-user', type=float, default=5,
+                            help="Mean number of reviews per user.")
+        parser.add_argument('--days', type=int, default=365,
+                            help="Time range of the posts, in days before --end.")
+        parser.add_argument('--end', type=datetime.fromisoformat,
+                            help="Date of the most recent posts (ISO 8601). Defaults to "
+                                 "today at midnight, so that runs of the same day match.")
+        parser.add_argument('--photo-ratio', type=float, default=0,
+                            help="Share of the tickets with a photo.")
+        parser.add_argument('--photo-variants', type=int, default=50,
+                            help="Number of distinct generated images, shared by the tickets.")
+        parser.add_argument('--batch', type=int, default=5000,
+                            help="Number of rows per bulk insert.")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch = options['batch']
+        User = get_user_model()
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f"Des utilisateurs « {options['prefix']}… » existent déjà : "
+                               "choisissez un autre préfixe.")
+        end = options['end'] or timezone.now().replace(hour=0, minute=0, second=0,
+                                                       microsecond=0)
+        if timezone.is_naive(end):
+            end = timezone.make_aware(end)
+        self.end = end
+        self.start = end - timedelta(days=options['days'])
+        started = time.perf_counter()
+
+        user_ids = self.step("utilisateurs", self.create_users,
+                             options['users'], options['prefix'], options['password'])
+        followees = self.step("relations", self.create_follows, user_ids,
+                              options['follows_per_user'], options['popularity_exponent'],
+                              options['block_ratio'])
+        photo_ids = []
+        if options['photo_ratio'] > 0:
+            photo_ids = self.step("photos", self.create_photos, user_ids,
+                                  options['photo_variants'])
+        tickets = self.step("billets", self.create_tickets, user_ids,
+                            options['tickets_per_user'], photo_ids, options['photo_ratio'])
+        self.step("critiques", self.create_reviews, user_ids, followees, tickets,
+                  options['reviews_per_user'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Jeu de données généré en {time.perf_counter() - started:.1f} s."))
+        if timeline.is_enabled():
+            self.stdout.write(self.style.WARNING(
+                "FEED_MATERIALIZED est activé : lancez `rebuild_timeline` pour "
+                "alimenter les fils des nouveaux utilisateurs."))
+
+    def step(self, name, function, *args):
+        started = time.perf_counter()
+        with transaction.atomic():
+            result, count = function(*args)
+        self.stdout.write(f"{count} {name} en {time.perf_counter() - started:.1f} s.")
+        return result
+
+    def insert(self, model, rows):
+        """
+        Inserts the rows yielded by `rows` in batches, and yields the inserted
+        objects, with their primary keys: only the current batch is kept in
+        memory, the callers keep the IDs the next steps need.
+        """
+        for batch in batched(rows, self.batch):
+            yield from model.objects.bulk_create(batch)
+
+    def random_time(self, after=None):
+        start = max(after, self.start) if after else self.start
+        return start + (self.end - start) * self.rng.random()
+
+    def create_users(self, count, prefix, password):
+        User = get_user_model()
+        # Hashing the password is slow: all the users share the hash
+        password = make_password(password)
+        user_ids = [user.pk for user in self.insert(
+            User, (User(username=f'{prefix}{index}', password=password, date_joined=self.start)
+                   for index in range(count)))]
+        return user_ids, len(user_ids)
+
+    def create_follows(self, user_ids, mean, exponent, block_ratio):
+        """
+        Each user follows a number of users drawn from a Pareto distribution of
+        mean `mean`, picked according to a Zipf popularity of the users.
+
+        Returns:
+            dict: The IDs of the users followed (not blocked) by each user.
+        """
+        by_rank = user_ids[:]
+        self.rng.shuffle(by_rank)
+        cum_weights = list(itertools.accumulate(1 / rank ** exponent
+                                                for rank in range(1, len(by_rank) + 1)))
+        followees = {}
+
+        def rows():
+            for user_id in user_ids:
+                # Pareto of shape 2: mean of 2 * scale
+                count = min(len(user_ids) - 1, round(mean / 2 * self.rng.paretovariate(2)))
+                followed = set()
+                for _ in range(3):
+                    if len(followed) >= count:
+                        break
+                    followed.update(self.rng.choices(by_rank, cum_weights=cum_weights,
+                                                     k=count - len(followed)))
+                    followed.discard(user_id)
+                followees[user_id] = []
+                for followed_id in sorted(followed)[:count]:
+                    blocked = self.rng.random() < block_ratio
+                    if not blocked:
+                        followees[user_id].append(followed_id)
+                    yield UserFollows(user_id=user_id, followed_user_id=followed_id,
+                                      blocked=blocked)
+
+        return followees, sum(1 for _ in self.insert(UserFollows, rows()))
+
+    def create_photos(self, user_ids, variants):
+        """
+        Generates `variants` small images, stored and processed like uploads.
+        """
+        photos = []
+        for index in range(variants):
+            buffer = BytesIO()
+            color = tuple(self.rng.randrange(256) for _ in range(3))
+            Image.new('RGB', (320, 240), color).save(buffer, 'PNG')
+            data = buffer.getvalue()
+            photo = Photo.objects.filter(content_hash=hashlib.sha256(data).hexdigest()).first()
+            if photo is None:
+                photo = Photo(uploader_id=self.rng.choice(user_ids),
+                              content_hash=hashlib.sha256(data).hexdigest())
+                name = default_storage.save(photo_upload_to(photo, 'seed.png'), ContentFile(data))
+                # The image is stored already: save() does not queue its processing
+                photo.image.name = name
+                photo.save()
+                photo.create_renditions()
+                photo.save(update_fields=['width', 'height'])
+            photos.append(photo.pk)
+        return photos, len(photos)
+
+    def create_tickets(self, user_ids, mean, photo_ids, photo_ratio):
+        """
+        Returns:
+            dict: The (ID, creation time) of the tickets of each user.
+        """
+        tickets = {}
+
+        def rows():
+            for user_id in user_ids:
+                for _ in range(int(self.rng.expovariate(1 / mean)) if mean else 0):
+                    photo_id = None
+                    if photo_ids and self.rng.random() < photo_ratio:
+                        photo_id = self.rng.choice(photo_ids)
+                    yield Ticket(user_id=user_id, photo_id=photo_id,
+                                 title=f'Livre {self.rng.randrange(10 ** 6)}',
+                                 description='Quelqu’un a-t-il lu ce livre ?',
+                                 time_created=self.random_time())
+
+        count = 0
+        with explicit_dates(Ticket):
+            for ticket in self.insert(Ticket, rows()):
+                tickets.setdefault(ticket.user_id, []).append((ticket.pk, ticket.time_created))
+                count += 1
+        return tickets, count
+
+    def create_reviews(self, user_ids, followees, tickets, mean):
+        """
+        Reviews are mostly written on the tickets of the followed users, and
+        sometimes on the ticket of any user; a user reviews a ticket once.
+        """
+        authors = list(tickets)
+
+        def rows():
+            for user_id in user_ids:
+                reviewed = set()
+                for _ in range(int(self.rng.expovariate(1 / mean)) if mean else 0):
+                    candidates = followees[user_id] if self.rng.random() < 0.8 else authors
+                    if not candidates:
+                        continue
+                    author_tickets = tickets.get(self.rng.choice(candidates))
+                    if not author_tickets:
+                        continue
+                    ticket_id, ticket_time = self.rng.choice(author_tickets)
+                    if ticket_id in reviewed:
+                        continue
+                    reviewed.add(ticket_id)
+                    yield Review(ticket_id=ticket_id, user_id=user_id,
+                                 rating=self.rng.randint(0, 5),
+                                 headline=f'Critique {self.rng.randrange(10 ** 6)}',
+                                 body='Une lecture recommandée.',
+                                 time_created=self.random_time(after=ticket_time))
+
+        with explicit_dates(Review):
+            count = sum(1 for _ in self.insert(Review, rows()))
+        # bulk_create does not send the signals maintaining the ticket aggregates
+        ticket_ids = (ticket_id for rows in tickets.values() for ticket_id, _ in rows)
+        for batch in batched(ticket_ids, self.batch):
+            Ticket.objects.filter(pk__in=batch).update_review_stats()
+        return None, count
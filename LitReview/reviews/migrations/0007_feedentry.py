@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0006_delete_userfollows'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('ticket', 'Ticket'), ('review', 'Critique')], max_length=6)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('time_created', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-time_created', '-kind', '-object_id'),
+                'indexes': [models.Index(fields=['owner', '-time_created', '-kind', '-object_id'], name='feedentry_owner_timeline'), models.Index(fields=['owner', 'author'], name='feedentry_owner_author'), models.Index(fields=['kind', 'object_id'], name='feedentry_post')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'kind', 'object_id'), name='unique_feedentry_owner_post')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Q
+
+
+def delete_duplicate_reviews(apps, schema_editor):
+    """
+    Keeps the newest review of each (ticket, user) pair: the former views let
+    a user review a ticket several times, which the constraint forbids.
+    """
+    Review = apps.get_model('reviews', 'Review')
+    FeedEntry = apps.get_model('reviews', 'FeedEntry')
+    newer = Review.objects.filter(
+        Q(time_created__gt=OuterRef('time_created'))
+        | Q(time_created=OuterRef('time_created'), pk__gt=OuterRef('pk')),
+        ticket=OuterRef('ticket'), user=OuterRef('user'))
+    duplicates = Review.objects.filter(Exists(newer)).order_by().values('pk')
+    FeedEntry.objects.filter(kind='review', object_id__in=duplicates).delete()
+    Review.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0007_feedentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', '-time_created'], name='review_user_time'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['user', '-time_created'], name='ticket_user_time'),
+        ),
+        migrations.RunPython(delete_duplicate_reviews, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='review',
+            constraint=models.UniqueConstraint(fields=('ticket', 'user'), name='unique_review_ticket_user'),
+        ),
+    ]
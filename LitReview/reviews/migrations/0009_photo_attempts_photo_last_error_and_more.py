@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0008_review_review_user_time_ticket_ticket_user_time_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='status',
+            field=models.CharField(choices=[('pending', 'En attente'), ('processing', 'En cours de traitement'), ('ready', 'Prête'), ('failed', 'En échec')], default='ready', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['status', 'id'], name='photo_status'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:48
+
+import django.db.models.deletion
+import reviews.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0010_photo_height_photo_width_photorendition'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=reviews.models.photo_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='uploader',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
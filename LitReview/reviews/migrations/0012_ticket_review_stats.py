@@ -0,0 +1,44 @@
+# Generated by Django 5.1.3 on 2026-10-18 07:09
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def compute_review_stats(apps, schema_editor):
+    Ticket = apps.get_model('reviews', 'Ticket')
+    Review = apps.get_model('reviews', 'Review')
+    reviews = Review.objects.filter(ticket=OuterRef('pk')).order_by().values('ticket')
+    Ticket.objects.update(
+        review_count=Coalesce(Subquery(reviews.annotate(count=Count('pk')).values('count')),
+                              Value(0)),
+        rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')),
+                            Value(0)),
+        last_review_at=Subquery(reviews.annotate(last=Max('time_created')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0011_photo_content_hash_alter_photo_image_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='last_review_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_review_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# Full-text index of the tickets and reviews, see reviews/search.py
+CREATE_SQL = [
+    """CREATE VIRTUAL TABLE reviews_search USING fts5(
+        kind UNINDEXED, post_id UNINDEXED, title, body,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""",
+    """CREATE TRIGGER reviews_search_ticket_insert AFTER INSERT ON reviews_ticket BEGIN
+        INSERT INTO reviews_search (rowid, kind, post_id, title, body)
+        VALUES (new.id * 2, 'ticket', new.id, new.title, COALESCE(new.description, ''));
+    END""",
+    """CREATE TRIGGER reviews_search_ticket_update
+    AFTER UPDATE OF title, description ON reviews_ticket BEGIN
+        UPDATE reviews_search SET title = new.title, body = COALESCE(new.description, '')
+        WHERE rowid = new.id * 2;
+    END""",
+    """CREATE TRIGGER reviews_search_ticket_delete AFTER DELETE ON reviews_ticket BEGIN
+        DELETE FROM reviews_search WHERE rowid = old.id * 2;
+    END""",
+    """CREATE TRIGGER reviews_search_review_insert AFTER INSERT ON reviews_review BEGIN
+        INSERT INTO reviews_search (rowid, kind, post_id, title, body)
+        VALUES (new.id * 2 + 1, 'review', new.id, new.headline, COALESCE(new.body, ''));
+    END""",
+    """CREATE TRIGGER reviews_search_review_update
+    AFTER UPDATE OF headline, body ON reviews_review BEGIN
+        UPDATE reviews_search SET title = new.headline, body = COALESCE(new.body, '')
+        WHERE rowid = new.id * 2 + 1;
+    END""",
+    """CREATE TRIGGER reviews_search_review_delete AFTER DELETE ON reviews_review BEGIN
+        DELETE FROM reviews_search WHERE rowid = old.id * 2 + 1;
+    END""",
+    """INSERT INTO reviews_search (rowid, kind, post_id, title, body)
+        SELECT id * 2, 'ticket', id, title, COALESCE(description, '') FROM reviews_ticket""",
+    """INSERT INTO reviews_search (rowid, kind, post_id, title, body)
+        SELECT id * 2 + 1, 'review', id, headline, COALESCE(body, '') FROM reviews_review""",
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER reviews_search_{model}_{event}"
+    for model in ('ticket', 'review') for event in ('insert', 'update', 'delete')
+] + ["DROP TABLE reviews_search"]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # FTS5 is specific to SQLite: search is unavailable on other databases
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0012_ticket_review_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_SQL), run(DROP_SQL)),
+    ]
@@ -1,53 +1,390 @@
+from io import BytesIO
+from pathlib import PurePath
+from django.core.files.base import ContentFile
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
-from django.db import models
-from PIL import Image
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from PIL import Image, ImageOps
+from social.models import UserFollows
+from . import images
+from .uploads import content_hash
+
+
+def photo_upload_to(photo, filename):
+    """
+    Returns the storage path of an uploaded image, derived from its content
+    hash: identical images are stored once.
+    """
+    if not photo.content_hash:
+        return filename
+    extension = PurePath(filename).suffix.lower()
+    return f'photos/{photo.content_hash[:2]}/{photo.content_hash}{extension}'
+
+
+def store_upload(storage, name, upload):
+    """
+    Writes an uploaded image in the storage, under its content-addressed name.
+    """
+    # Same name, same bytes: a file left by a deleted photo is reused as is
+    if not storage.exists(name):
+        upload.seek(0)
+        storage.save(name, upload)
+
+
+class PhotoManager(models.Manager):
+
+    def for_upload(self, image, uploader):
+        """
+        Returns the photo of an uploaded image, creating it unless a photo with
+        identical bytes exists: its file and renditions are then reused. An
+        existing photo is locked until the end of the transaction, on the
+        databases supporting row locks (select_for_update).
+
+        Args:
+            image (UploadedFile): The uploaded image.
+            uploader (User): The user uploading the image.
+
+        Returns:
+            tuple: The new or existing photo, and True if it was created.
+        """
+        return self.select_for_update().get_or_create(
+            content_hash=content_hash(image), defaults={'image': image, 'uploader': uploader})
+
+    def attach_upload(self, ticket, image, uploader, **kwargs):
+        """
+        Saves `ticket` with the photo of an uploaded image, in one transaction.
+
+        A reused photo may be deleted by a concurrent `release()` or `gc_media`
+        between its lookup and the ticket insert (SQLite has no row locks):
+        its row is checked again once the ticket is saved, and the photo is
+        created again from the upload if it is gone.
+
+        Args:
+            ticket (Ticket): The ticket to save.
+            image (UploadedFile): The uploaded image.
+            uploader (User): The user uploading the image.
+            **kwargs: Arguments of `ticket.save()`.
+        """
+        with transaction.atomic(savepoint=False):
+            ticket.photo, created = self.for_upload(image, uploader)
+            ticket.save(**kwargs)
+            if not created and not self.filter(pk=ticket.photo_id).exists():
+                ticket.photo, created = self.for_upload(image, uploader)
+                ticket.save(update_fields=['photo'])
+
+    def release(self, photo_ids):
+        """
+        Deletes the given photos once no ticket uses them anymore; their files
+        are deleted when the transaction is committed (see `reviews.signals`).
+        """
+        photo_ids = [photo_id for photo_id in photo_ids if photo_id is not None]
+        if photo_ids:
+            (self.filter(pk__in=photo_ids)
+             .exclude(Exists(Ticket.objects.filter(photo=OuterRef('pk'))))
+             .delete())
 
 
 class Photo(models.Model):
     """
     Represents an image uploaded by a user.
 
+    The uploaded image is processed in the background once the request has
+    been committed (see `reviews.tasks`): renditions of several widths and
+    formats are generated for `srcset`, and the tickets display a placeholder
+    until the photo is ready. The uploaded file is kept as the source.
+
+    Photos are content-addressed: an upload of the same bytes reuses the
+    existing photo (`Photo.objects.attach_upload`), which is shared by the tickets
+    and deleted with its files along with the last of them.
+
     Fields:
         - image (ImageField): The image file uploaded by the user.
-        - uploader (ForeignKey): The user who uploaded the image.
+        - uploader (ForeignKey): The user who first uploaded the image.
+        - content_hash (CharField): SHA-256 of the uploaded file.
         - date_created (DateTimeField): The timestamp when the image was uploaded.
+        - width (PositiveIntegerField): Width of the uploaded image, in pixels.
+        - height (PositiveIntegerField): Height of the uploaded image, in pixels.
+        - status (CharField): Processing state of the image (pending, processing,
+          ready or failed).
+        - attempts (PositiveSmallIntegerField): Number of processing attempts.
+        - processing_started_at (DateTimeField): Start of the current attempt,
+          used to requeue the attempts of crashed workers.
+        - last_error (TextField): Error of the last failed attempt.
 
     Constants:
-        - IMAGE_MAX_SIZE (tuple): Maximum size for image resizing (width, height).
+        - RENDITION_WIDTHS (tuple): Widths of the generated renditions, in pixels.
+        - RENDITION_FORMATS (tuple): Formats of the generated renditions.
 
     Methods:
-        - resize_image(): Resizes the uploaded image to fit within IMAGE_MAX_SIZE.
-        - save(): Overrides the default save method to resize the image after saving.
+        - create_renditions(): Generates the renditions of the uploaded image.
+        - save(): Overrides the default save method to store a newly uploaded
+          image and queue its processing once the transaction is committed.
     """
-    image = models.ImageField(blank=True, null=True)
-    uploader = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'En attente'),
+        (PROCESSING, 'En cours de traitement'),
+        (READY, 'Prête'),
+        (FAILED, 'En échec'),
+    ]
+
+    image = models.ImageField(upload_to=photo_upload_to, blank=True, null=True)
+    # The photo may be shared with the tickets of other users
+    uploader = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True)
     date_created = models.DateTimeField(auto_now_add=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    processing_started_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    RENDITION_WIDTHS = (96, 200, 400, 800)
+    RENDITION_FORMATS = ('webp', 'jpeg')
+
+    objects = PhotoManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='photo_status'),
+        ]
 
-    IMAGE_MAX_SIZE = (400, 400)
+    @property
+    def is_ready(self):
+        return self.status == self.READY
 
-    def resize_image(self):
+    def rendition_widths(self):
         """
-        Resizes the uploaded image to fit within the dimensions specified in IMAGE_MAX_SIZE.
+        Returns the widths of the renditions of the image, never upscaled: widths
+        larger than the image are replaced by the width of the image itself.
+        """
+        widths = {min(width, self.width) for width in self.RENDITION_WIDTHS}
+        return sorted(widths, reverse=True)
+
+    def create_renditions(self):
+        """
+        Generates the renditions of the uploaded image and replaces the previous ones.
 
-        Uses the Python Imaging Library (PIL) to resize the image while maintaining aspect ratio.
-        The image is resized **in place** and saved at its original path.
+        Each width of `rendition_widths()` is encoded in every format of
+        RENDITION_FORMATS; the aspect ratio is kept. The image is decoded within
+        the limits of `reviews.images`, at a reduced scale if possible, and the
+        renditions are resized from the next larger one.
+
+        Raises:
+            ImageTooLarge: If the image exceeds the limits.
         """
-        image = Image.open(self.image)
-        image.thumbnail(self.IMAGE_MAX_SIZE)
-        image.save(self.image.path)
+        with images.open_reduced(self.image.path, max(self.RENDITION_WIDTHS)) as (source, size):
+            self.width, self.height = size
+            image = ImageOps.exif_transpose(source)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info
+                                      or image.mode in ('LA', 'PA') else 'RGB')
+            renditions = []
+            for width in self.rendition_widths():
+                height = max(1, round(self.height * width / self.width))
+                # reducing_gap: integer reduction first, then resampling of the rest
+                image = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+                for image_format in self.RENDITION_FORMATS:
+                    rendition = PhotoRendition(photo=self, format=image_format,
+                                               width=width, height=height)
+                    rendition.store(image)
+                    renditions.append(rendition)
+        # The files of the previous renditions are deleted by `reviews.signals`
+        self.renditions.all().delete()
+        PhotoRendition.objects.bulk_create(renditions)
 
     def save(self, *args, **kwargs):
         """
-        Overrides the default save method to ensure the image is resized after being saved.
+        Overrides the default save method to store a newly uploaded image and
+        queue its processing, once the transaction is committed: a rolled back
+        upload leaves no file behind.
 
         Args:
             *args: Positional arguments for the parent save method.
             **kwargs: Keyword arguments for the parent save method.
         """
+        new_upload = bool(self.image) and not self.image._committed
+        if new_upload:
+            if not self.content_hash:
+                self.content_hash = content_hash(self.image.file)
+            self.status = self.PENDING
+            self.attempts = 0
+            self.last_error = ''
+            # The name is derived from the content hash: the row can be written
+            # before the file, which is stored only if the transaction commits
+            upload = self.image.file
+            self.image.name = self.image.field.generate_filename(self, self.image.name)
+            self.image._committed = True
         super().save(*args, **kwargs)
-        if self.image:
-            self.resize_image()
+        if new_upload:
+            from .tasks import enqueue
+            photo_id, name, storage = self.pk, self.image.name, self.image.storage
+            using = kwargs.get('using')
+            # Callbacks run in order: the file is stored before its processing
+            transaction.on_commit(lambda: store_upload(storage, name, upload), using=using)
+            transaction.on_commit(lambda: enqueue(photo_id), using=using)
+
+
+class PhotoRendition(models.Model):
+    """
+    Represents a resized and re-encoded version of a photo, used in `srcset`.
+
+    Fields:
+        - photo (ForeignKey): The source photo.
+        - format (CharField): Encoding of the file (webp or jpeg).
+        - width (PositiveIntegerField): Width of the rendition, in pixels.
+        - height (PositiveIntegerField): Height of the rendition, in pixels.
+        - file (ImageField): The encoded image.
+        - size (PositiveIntegerField): Size of the file, in bytes.
+
+    Meta Options:
+        - Renditions are ordered by width.
+        - A photo has a single rendition per format and width.
+    """
+    WEBP = 'webp'
+    JPEG = 'jpeg'
+    FORMAT_CHOICES = [
+        (WEBP, 'WebP'),
+        (JPEG, 'JPEG'),
+    ]
+    # Pillow encoder options of each format
+    SAVE_OPTIONS = {
+        WEBP: {'format': 'WEBP', 'quality': 80, 'method': 4},
+        JPEG: {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    }
+
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name='renditions')
+    format = models.CharField(max_length=4, choices=FORMAT_CHOICES)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    file = models.ImageField(upload_to='renditions/')
+    size = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['width']
+        constraints = [
+            models.UniqueConstraint(fields=['photo', 'format', 'width'],
+                                    name='unique_rendition_photo_format_width'),
+        ]
+
+    def store(self, image):
+        """
+        Encodes `image` in the format of the rendition and saves the file,
+        without saving the rendition itself.
+        """
+        if self.format == self.JPEG and image.mode == 'RGBA':
+            # JPEG has no alpha channel: transparent areas are made white
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        buffer = BytesIO()
+        image.save(buffer, **self.SAVE_OPTIONS[self.format])
+        self.size = buffer.tell()
+        prefix = self.photo.content_hash or self.photo.pk
+        name = f'{prefix}-{self.width}.{self.format}'
+        self.file.save(name, ContentFile(buffer.getvalue()), save=False)
+
+
+def blocked_with(user):
+    """
+    Returns a correlated subquery which is true when the author (`user` field)
+    of the outer row blocked `user` or was blocked by `user`.
+    """
+    return Exists(UserFollows.objects.filter(
+        Q(user=user, followed_user=OuterRef('user'))
+        | Q(user=OuterRef('user'), followed_user=user),
+        blocked=True,
+    ))
+
+
+def followed_by(user):
+    """
+    Returns a subquery selecting the IDs of the users followed by `user`.
+    """
+    return UserFollows.objects.filter(user=user).values('followed_user')
+
+
+class TicketQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Restricts the tickets to those shown in the home feed of `user`: tickets
+        of followed users and of the user, excluding content from blocked users.
+
+        The follow and block rules are subqueries evaluated by the database,
+        nothing is loaded in Python.
+        """
+        return self.filter(
+            (Q(user__in=followed_by(user)) | Q(user=user))
+            & ~blocked_with(user)  # Exclure les utilisateurs bloqués
+        )
+
+    def update_review_stats(self):
+        """
+        Recomputes the review aggregates of the tickets from their reviews, in
+        a single UPDATE with correlated subqueries.
+
+        Returns:
+            int: The number of updated tickets.
+        """
+        reviews = Review.objects.filter(ticket=OuterRef('pk')).order_by().values('ticket')
+        return self.update(
+            review_count=Coalesce(Subquery(reviews.annotate(count=Count('pk')).values('count')),
+                                  Value(0)),
+            rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')),
+                                Value(0)),
+            last_review_at=Subquery(reviews.annotate(last=Max('time_created')).values('last')),
+        )
+
+    def with_stale_review_stats(self):
+        """
+        Restricts the tickets to those whose review aggregates differ from their reviews.
+        """
+        return self.alias(
+            actual_count=Count('review'),
+            actual_sum=Coalesce(Sum('review__rating'), Value(0)),
+            actual_last=Max('review__time_created'),
+        ).filter(
+            ~Q(review_count=F('actual_count'))
+            | ~Q(rating_sum=F('actual_sum'))
+            | Q(last_review_at__lt=F('actual_last'))
+            | Q(last_review_at__gt=F('actual_last'))
+            | Q(last_review_at__isnull=True, actual_last__isnull=False)
+            | Q(last_review_at__isnull=False, actual_last__isnull=True)
+        )
+
+    def by_rating(self):
+        """
+        Orders the tickets by average rating, best first, unreviewed tickets last.
+        """
+        return self.order_by(
+            (F('rating_sum') * 1.0 / F('review_count')).desc(nulls_last=True),
+            '-review_count', '-time_created')
+
+
+class ReviewQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Restricts the reviews to those shown in the home feed of `user`: reviews
+        of followed users, of the user, or on tickets created by the user,
+        excluding content from blocked users.
+
+        The follow and block rules are subqueries evaluated by the database,
+        nothing is loaded in Python.
+        """
+        return self.filter(
+            (Q(user__in=followed_by(user)) |  # Reviews by followed users
+             Q(user=user) |  # Reviews by the user
+             # Reviews on tickets created by the user (a subquery rather than
+             # a join keeps each branch of the OR on an index)
+             Q(ticket__in=Ticket.objects.filter(user=user).values('pk')))
+            & ~blocked_with(user)  # Exclude blocked users
+        )
 
 
 class Ticket(models.Model):
@@ -60,9 +397,23 @@ class Ticket(models.Model):
         - description (TextField): Description or details about the ticket.
         - user (ForeignKey): The user who created the ticket.
         - time_created (DateTimeField): Timestamp when the ticket was created.
+        - review_count (PositiveIntegerField): Number of reviews of the ticket.
+        - rating_sum (PositiveIntegerField): Sum of the ratings of the reviews.
+        - last_review_at (DateTimeField): Creation time of the newest review.
+
+        The review aggregates are maintained by the signal handlers of
+        `Review` (`reviews.signals`) with F() expressions, and repaired by
+        `python manage.py repair_review_stats`.
+
+    Managers:
+        - objects: `Ticket.objects.visible_to(user)` returns the tickets of the
+          home feed of a user; `update_review_stats()` recomputes the review
+          aggregates and `by_rating()` orders by average rating.
 
     Meta Options:
         - ordering: Orders tickets by `time_created` in descending order (newest first).
+        - indexes: (user, -time_created) serves the feeds, which filter on the
+          author and sort by creation time.
     """
     photo = models.ForeignKey(Photo, null=True, on_delete=models.SET_NULL, blank=True)
     title = models.CharField(max_length=128)
@@ -72,9 +423,26 @@ class Ticket(models.Model):
         on_delete=models.CASCADE
     )
     time_created = models.DateTimeField(auto_now_add=True)
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    last_review_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = TicketQuerySet.as_manager()
 
     class Meta:
         ordering = ('-time_created',)
+        indexes = [
+            models.Index(fields=['user', '-time_created'], name='ticket_user_time'),
+        ]
+
+    @property
+    def average_rating(self):
+        """
+        Returns the average rating of the reviews of the ticket, or None.
+        """
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
 
 
 class Review(models.Model):
@@ -89,8 +457,16 @@ class Review(models.Model):
         - user (ForeignKey): The user who wrote the review.
         - time_created (DateTimeField): Timestamp when the review was created.
 
+    Managers:
+        - objects: `Review.objects.visible_to(user)` returns the reviews of the
+          home feed of a user.
+
     Meta Options:
         - ordering: Orders reviews by `time_created` in descending order (newest first).
+        - indexes: (user, -time_created) serves the feeds, which filter on the
+          author and sort by creation time.
+        - constraints: A user can publish only one review per ticket; the unique
+          (ticket, user) index also answers the "already reviewed" check.
 
     Methods:
         - star_rating(): Returns a visual representation of the rating in the form of stars.
@@ -115,8 +491,16 @@ class Review(models.Model):
     )
     time_created = models.DateTimeField(auto_now_add=True)
 
+    objects = ReviewQuerySet.as_manager()
+
     class Meta:
         ordering = ['-time_created']
+        indexes = [
+            models.Index(fields=['user', '-time_created'], name='review_user_time'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['ticket', 'user'], name='unique_review_ticket_user'),
+        ]
 
     def star_rating(self):
         """
@@ -129,3 +513,56 @@ class Review(models.Model):
             str: A visual representation of the rating in the form of stars (e.g., ★★★☆☆).
         """
         return "★" * self.rating + "☆" * (5 - self.rating)
+
+
+class FeedEntry(models.Model):
+    """
+    Materialized row of a user's home feed (fan-out on write).
+
+    One entry is written for each user allowed to see a ticket or a review
+    when the post is created, and entries are backfilled or trimmed when
+    follow or block relationships change (see `reviews.timeline`).
+
+    Fields:
+        - owner (ForeignKey): The user whose feed contains the entry.
+        - author (ForeignKey): The author of the post, used to trim the feed
+          when a follow or block relationship changes.
+        - kind (CharField): 'ticket' or 'review'.
+        - object_id (PositiveBigIntegerField): ID of the ticket or the review.
+        - time_created (DateTimeField): Creation time of the post.
+
+    Meta Options:
+        - ordering: Orders entries like the feed (newest first).
+        - indexes: The feed of an owner is read as a single index range.
+    """
+    KIND_CHOICES = [
+        ('ticket', 'Ticket'),
+        ('review', 'Critique'),
+    ]
+
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    author = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    kind = models.CharField(max_length=6, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    time_created = models.DateTimeField()
+
+    class Meta:
+        ordering = ('-time_created', '-kind', '-object_id')
+        indexes = [
+            models.Index(fields=['owner', '-time_created', '-kind', '-object_id'],
+                         name='feedentry_owner_timeline'),
+            models.Index(fields=['owner', 'author'], name='feedentry_owner_author'),
+            models.Index(fields=['kind', 'object_id'], name='feedentry_post'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'kind', 'object_id'],
+                                    name='unique_feedentry_owner_post'),
+        ]
@@ -0,0 +1,122 @@
+"""
+Full-text search over the tickets and the reviews.
+
+The posts are indexed in the `reviews_search` SQLite FTS5 table (migration
+0013): one row per post, with the title (ticket title or review headline)
+and the body (ticket description or review body). Triggers on the ticket
+and review tables keep the index in sync on every insert, update and
+delete, including bulk inserts and queryset updates which send no signals;
+`python manage.py rebuild_search_index` rebuilds it from scratch.
+
+The row ID of a post is derived from its kind and primary key (2 * id for
+a ticket, 2 * id + 1 for a review), so the triggers update a post in place.
+
+Results are ranked with bm25, titles weighing more than bodies, and
+restricted to the posts of the home feed of the user (`visible_to`).
+"""
+import re
+from django.db import connection, connections, router
+from .feed import REVIEW, TICKET, Feed
+from .models import Review, Ticket
+
+TABLE = 'reviews_search'
+
+# bm25 weights of the columns (kind, post_id, title, body)
+RANK = f'bm25({TABLE}, 0, 0, 10.0, 1.0)'
+
+MAX_TERMS = 10
+
+REBUILD_SQL = [
+    f"DELETE FROM {TABLE}",
+    f"""INSERT INTO {TABLE} (rowid, kind, post_id, title, body)
+        SELECT id * 2, '{TICKET}', id, title, COALESCE(description, '') FROM reviews_ticket""",
+    f"""INSERT INTO {TABLE} (rowid, kind, post_id, title, body)
+        SELECT id * 2 + 1, '{REVIEW}', id, headline, COALESCE(body, '') FROM reviews_review""",
+    f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')",
+]
+
+
+def is_available():
+    """
+    Returns True if the database has the search index (SQLite with FTS5).
+    """
+    return connection.vendor == 'sqlite' and TABLE in connection.introspection.table_names()
+
+
+def match_expression(query):
+    """
+    Converts the text typed by a user into an FTS5 query.
+
+    Each word becomes a quoted term, so the FTS5 operators and punctuation of
+    the text cannot cause syntax errors; all the terms must match, and the
+    last one is a prefix (search as you type).
+
+    Returns:
+        str: The FTS5 query, or '' if the text has no word.
+    """
+    terms = re.findall(r'\w+', query)[:MAX_TERMS]
+    if not terms:
+        return ''
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+
+class SearchFeed(Feed):
+    """
+    Posts matching a search, visible to the user, ranked by relevance.
+
+    Implements the `Feed` interface used by `Paginator` (`count`, slicing);
+    the pages are loaded like the pages of the feeds (`Feed.hydrate`).
+
+    Attributes:
+        - query (str): The FTS5 query (see `match_expression`).
+        - db (str): Alias of the database searched.
+    """
+
+    def __init__(self, user, text):
+        super().__init__(Ticket.objects.visible_to(user), Review.objects.visible_to(user),
+                         viewer=user)
+        self.query = match_expression(text)
+        # Read-only: the search may run on a replica (see performance.routers)
+        self.db = router.db_for_read(Ticket)
+
+    def where(self):
+        """
+        Returns the WHERE clause of the search and its parameters.
+        """
+        tickets, ticket_params = self.tickets.order_by().values('pk').query.sql_with_params()
+        reviews, review_params = self.reviews.order_by().values('pk').query.sql_with_params()
+        sql = (f"{TABLE} MATCH %s AND ("
+               f"(kind = '{TICKET}' AND post_id IN ({tickets})) "
+               f"OR (kind = '{REVIEW}' AND post_id IN ({reviews})))")
+        return sql, [self.query, *ticket_params, *review_params]
+
+    def count(self):
+        if not self.query:
+            return 0
+        where, params = self.where()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {TABLE} WHERE {where}", params)
+            return cursor.fetchone()[0]
+
+    def rows(self, start, stop, cursor=None, older=True):
+        """
+        Returns the (kind, post_id) rows of a slice of the results, best first.
+        """
+        if not self.query:
+            return []
+        where, params = self.where()
+        with connections[self.db].cursor() as db_cursor:
+            db_cursor.execute(
+                f"SELECT kind, post_id FROM {TABLE} WHERE {where} "
+                f"ORDER BY {RANK}, rowid DESC LIMIT %s OFFSET %s",
+                [*params, stop - start, start])
+            return [{'kind': kind, 'post_id': post_id} for kind, post_id in db_cursor]
+
+
+def rebuild():
+    """
+    Rebuilds the search index from the tickets and reviews.
+    """
+    with connection.cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
@@ -0,0 +1,240 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import DateTimeField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from social.models import UserFollows
+from . import cache, timeline
+from .feed import REVIEW, TICKET
+from .models import Photo, PhotoRendition, Review, Ticket
+
+
+def followers_of(user_id):
+    """
+    Returns the IDs of the users following `user_id`.
+    """
+    return UserFollows.objects.filter(followed_user_id=user_id).values_list('user_id', flat=True)
+
+
+def audience_of(author_ids):
+    """
+    Returns the IDs of the given authors and of their followers, whose feeds
+    show the posts of the authors.
+    """
+    authors = set(author_ids)
+    authors.discard(None)
+    followers = (UserFollows.objects.filter(followed_user_id__in=authors)
+                 .values_list('user_id', flat=True))
+    return [*authors, *followers]
+
+
+def bump_on_commit(user_ids, using=None):
+    """
+    Invalidates the cached feeds of the given users once the transaction is
+    committed. Bumped before, the version could be read by a concurrent
+    request still seeing the rows of before the commit, which would cache
+    them under the new version.
+    """
+    # Resolved now: the relationships may change or disappear with the commit
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: cache.bump_versions(user_ids), using=using)
+
+
+@receiver(post_save, sender=Ticket)
+def fan_out_ticket(sender, instance, created, **kwargs):
+    """
+    Writes a new ticket in the materialized feeds of its audience.
+    """
+    if created and timeline.is_enabled():
+        timeline.add_ticket(instance)
+
+
+@receiver(post_save, sender=Review)
+def fan_out_review(sender, instance, created, **kwargs):
+    """
+    Writes a new review in the materialized feeds of its audience.
+    """
+    if created and timeline.is_enabled():
+        timeline.add_review(instance)
+
+
+@receiver(post_delete, sender=Ticket)
+def remove_ticket(sender, instance, **kwargs):
+    """
+    Removes a deleted ticket from the materialized feeds.
+    """
+    if timeline.is_enabled():
+        timeline.remove_post(TICKET, instance.pk)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review(sender, instance, **kwargs):
+    """
+    Removes a deleted review from the materialized feeds.
+    """
+    if timeline.is_enabled():
+        timeline.remove_post(REVIEW, instance.pk)
+
+
+def latest_review_time():
+    """
+    Returns a subquery of the creation time of the newest review of a ticket.
+    """
+    return Subquery(Review.objects.filter(ticket=OuterRef('pk'))
+                    .order_by('-time_created').values('time_created')[:1])
+
+
+def add_review_stats(ticket_id, rating, time_created):
+    time_created = Value(time_created, output_field=DateTimeField())
+    Ticket.objects.filter(pk=ticket_id).update(
+        review_count=F('review_count') + 1,
+        rating_sum=F('rating_sum') + rating,
+        last_review_at=Greatest(Coalesce('last_review_at', time_created), time_created),
+    )
+
+
+def remove_review_stats(ticket_id, rating):
+    Ticket.objects.filter(pk=ticket_id).update(
+        review_count=F('review_count') - 1,
+        rating_sum=F('rating_sum') - rating,
+        last_review_at=latest_review_time(),
+    )
+
+
+@receiver(post_init, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    """
+    Keeps the loaded ticket and rating of a review, to update the aggregates
+    of the ticket by difference when the review is saved.
+    """
+    # Deferred fields are not in __dict__: reading them would run a query
+    instance._stats_state = (instance.__dict__.get('ticket_id'), instance.__dict__.get('rating'))
+
+
+@receiver(post_save, sender=Review)
+def update_ticket_review_stats(sender, instance, created, **kwargs):
+    """
+    Updates the review count, rating sum and newest review time of the ticket
+    of a created or edited review, with F() expressions: concurrent reviews
+    of a ticket cannot overwrite each other's update.
+    """
+    ticket_id, rating = instance._stats_state
+    if created:
+        add_review_stats(instance.ticket_id, instance.rating, instance.time_created)
+    elif ticket_id is None or rating is None:
+        # Review loaded without its rating: recompute from the reviews
+        Ticket.objects.filter(pk=instance.ticket_id).update_review_stats()
+    elif ticket_id != instance.ticket_id:
+        remove_review_stats(ticket_id, rating)
+        add_review_stats(instance.ticket_id, instance.rating, instance.time_created)
+    elif rating != instance.rating:
+        Ticket.objects.filter(pk=ticket_id).update(
+            rating_sum=F('rating_sum') + (instance.rating - rating))
+    instance._stats_state = (instance.ticket_id, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_stats(sender, instance, **kwargs):
+    """
+    Removes a deleted review from the aggregates of its ticket.
+    """
+    # Reviews deleted along with their ticket: nothing to update
+    origin = kwargs.get('origin')
+    if getattr(origin, 'model', type(origin)) is Ticket:
+        return
+    remove_review_stats(instance.ticket_id, instance.rating)
+
+
+@receiver(post_save, sender=UserFollows)
+@receiver(post_delete, sender=UserFollows)
+def sync_follow(sender, instance, **kwargs):
+    """
+    Backfills or trims the materialized feeds of both users when a follow
+    relationship is created, deleted, blocked or unblocked.
+    """
+    # Relationships deleted along with a user: the feed entries of the
+    # user are deleted by cascade, nothing to resynchronise
+    origin = kwargs.get('origin')
+    if getattr(origin, 'model', type(origin)) is get_user_model():
+        return
+    if timeline.is_enabled():
+        timeline.sync_relationship(instance.user, instance.followed_user)
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def invalidate_ticket_feeds(sender, instance, **kwargs):
+    """
+    Invalidates the cached feeds of the author of a ticket, of the authors of
+    its reviews (which show the ticket) and of their followers.
+    """
+    if kwargs.get('created'):
+        bump_on_commit([instance.user_id, *followers_of(instance.user_id)], kwargs.get('using'))
+        return
+    reviewers = (Review.objects.filter(ticket_id=instance.pk).order_by()
+                 .values_list('user_id', flat=True))
+    bump_on_commit(audience_of([instance.user_id, *reviewers]), kwargs.get('using'))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_feeds(sender, instance, **kwargs):
+    """
+    Invalidates the cached feeds of the author of a review, of the owner of
+    the ticket, whose review aggregates change (updated without signal), and
+    of their followers.
+    """
+    if Review.ticket.is_cached(instance):
+        ticket_owner = [instance.ticket.user_id]
+    else:
+        ticket_owner = (Ticket.objects.filter(pk=instance.ticket_id)
+                        .values_list('user_id', flat=True))
+    bump_on_commit(audience_of([instance.user_id, *ticket_owner]), kwargs.get('using'))
+
+
+@receiver(post_save, sender=Photo)
+@receiver(post_delete, sender=Photo)
+def invalidate_photo_feeds(sender, instance, **kwargs):
+    """
+    Invalidates the cached feeds showing the tickets of a photo: feeds of the
+    uploader, of the authors of the tickets sharing the photo and of their
+    reviews, and of their followers.
+    """
+    # No ticket shows a new photo yet
+    if kwargs.get('created'):
+        return
+    authors = [instance.uploader_id,
+               *Ticket.objects.filter(photo=instance).values_list('user_id', flat=True),
+               *(Review.objects.filter(ticket__photo=instance).order_by()
+                 .values_list('user_id', flat=True))]
+    bump_on_commit(audience_of(authors), kwargs.get('using'))
+
+
+@receiver(post_delete, sender=Ticket)
+def release_photo(sender, instance, **kwargs):
+    """
+    Deletes the photo of a deleted ticket if no other ticket uses it.
+    """
+    Photo.objects.release([instance.photo_id])
+
+
+@receiver(post_delete, sender=Photo)
+@receiver(post_delete, sender=PhotoRendition)
+def delete_photo_file(sender, instance, **kwargs):
+    """
+    Deletes the file of a deleted photo or rendition, once the deletion is committed.
+    """
+    file = instance.image if sender is Photo else instance.file
+    if file:
+        name, storage = file.name, file.storage
+        transaction.on_commit(lambda: storage.delete(name), using=kwargs.get('using'))
+
+
+@receiver(post_save, sender=UserFollows)
+@receiver(post_delete, sender=UserFollows)
+def invalidate_follow_feeds(sender, instance, **kwargs):
+    """
+    Invalidates the cached feeds of both users of a follow relationship.
+    """
+    bump_on_commit([instance.user_id, instance.followed_user_id], kwargs.get('using'))
@@ -0,0 +1,219 @@
+"""
+Background processing of the uploaded photos.
+
+`Photo.save()` queues the processing of a new image once the transaction is
+committed. The PHOTO_PROCESSING setting selects where it runs:
+
+    - 'thread': in a thread pool of the web process (PHOTO_PROCESSING_WORKERS threads);
+    - 'worker': in a separate process, `python manage.py process_photos`, which
+      polls the pending photos of the database;
+    - 'sync': immediately after the commit, in the request (tests, debugging).
+
+The `Photo.status` column is the job queue: a photo is claimed by switching
+it from pending to processing, and failed attempts are retried until
+PHOTO_PROCESSING_MAX_ATTEMPTS is reached; the photo is then marked as failed.
+
+The 'thread' backend has no worker polling the queue: when its pool starts,
+and then at most every PHOTO_PROCESSING_TIMEOUT seconds on new uploads, it
+requeues the photos left processing by a crashed process and processes the
+pending ones (`recover`).
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from . import images
+from .models import Photo
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+# time.monotonic() of the last recovery started by the thread pool
+_last_recovery = None
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def max_attempts():
+    return get_setting('PHOTO_PROCESSING_MAX_ATTEMPTS', 3)
+
+
+def processing_timeout():
+    return get_setting('PHOTO_PROCESSING_TIMEOUT', 300)
+
+
+def get_executor():
+    """
+    Returns the thread pool of the 'thread' backend, created on first use.
+
+    A recovery of the stalled and pending photos is queued when the pool
+    starts, then at most every PHOTO_PROCESSING_TIMEOUT seconds.
+    """
+    global _executor, _last_recovery
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_setting('PHOTO_PROCESSING_WORKERS', 2),
+                thread_name_prefix='photo-processing')
+        now = time.monotonic()
+        if _last_recovery is None or now - _last_recovery >= processing_timeout():
+            _last_recovery = now
+            _executor.submit(run_in_thread, recover)
+        return _executor
+
+
+def enqueue(photo_id):
+    """
+    Starts the processing of a photo with the configured backend.
+    """
+    backend = get_setting('PHOTO_PROCESSING', 'thread')
+    if backend == 'sync':
+        process_with_retries(photo_id)
+    elif backend == 'thread':
+        get_executor().submit(run_in_thread, process_with_retries, photo_id, delay=1)
+    # 'worker': the pending photo is picked up by `process_photos`
+
+
+def run_in_thread(function, *args, **kwargs):
+    try:
+        function(*args, **kwargs)
+    except Exception:
+        logger.exception("Photo processing crashed (%s%s)", function.__name__, args)
+    finally:
+        # Threads of the pool do not go through the request cycle
+        close_old_connections()
+
+
+def process_with_retries(photo_id, delay=0):
+    """
+    Processes a photo, retrying with an increasing delay until it is ready or failed.
+    """
+    while process_photo(photo_id) == Photo.PENDING:
+        time.sleep(delay)
+        delay *= 2
+
+
+def claim(photo_id):
+    """
+    Atomically switches a pending photo to processing.
+
+    Returns:
+        bool: True if this caller owns the processing of the photo.
+    """
+    return bool(Photo.objects.filter(pk=photo_id, status=Photo.PENDING).update(
+        status=Photo.PROCESSING,
+        attempts=F('attempts') + 1,
+        processing_started_at=timezone.now(),
+    ))
+
+
+def process_photo(photo_id):
+    """
+    Runs one processing attempt of a pending photo.
+
+    Returns:
+        str: The status of the photo after the attempt (None if the photo
+        was not pending).
+    """
+    if not claim(photo_id):
+        return None
+    photo = Photo.objects.get(pk=photo_id)
+    try:
+        photo.create_renditions()
+    except Exception as error:
+        photo.last_error = f'{type(error).__name__}: {error}'
+        # An image over the limits is rejected again on retry
+        if photo.attempts >= max_attempts() or isinstance(error, images.ImageTooLarge):
+            photo.status = Photo.FAILED
+            logger.error("Photo %s failed after %s attempts: %s",
+                         photo.pk, photo.attempts, photo.last_error)
+        else:
+            photo.status = Photo.PENDING
+            logger.warning("Photo %s processing failed (attempt %s): %s",
+                           photo.pk, photo.attempts, photo.last_error)
+    else:
+        photo.status = Photo.READY
+        photo.last_error = ''
+    # save() sends post_save: the feeds showing the photo are invalidated
+    photo.save(update_fields=['width', 'height', 'status', 'last_error'])
+    return photo.status
+
+
+def requeue_stalled(timeout=None):
+    """
+    Puts back in the queue the photos whose processing started more than
+    `timeout` seconds ago (crashed worker or process restart).
+
+    Returns:
+        int: The number of requeued photos.
+    """
+    if timeout is None:
+        timeout = processing_timeout()
+    limit = timezone.now() - timedelta(seconds=timeout)
+    stalled = Photo.objects.filter(
+        Q(processing_started_at__lt=limit) | Q(processing_started_at__isnull=True),
+        status=Photo.PROCESSING)
+    return stalled.update(status=Photo.PENDING)
+
+
+def recover(batch=20):
+    """
+    Requeues the stalled photos, then runs one attempt on each pending photo
+    whose last attempt is older than PHOTO_PROCESSING_TIMEOUT (left pending
+    by a stopped process; the photos retried by a thread are more recent).
+
+    Returns:
+        int: The number of processed photos.
+    """
+    requeued = requeue_stalled()
+    if requeued:
+        logger.warning("%s stalled photo(s) requeued", requeued)
+    processed = 0
+    while True:
+        # Each attempt moves the photo out of the selection
+        photo_ids = pending_photo_ids(batch, processing_timeout())
+        for photo_id in photo_ids:
+            if process_photo(photo_id) is not None:
+                processed += 1
+        if len(photo_ids) < batch:
+            return processed
+
+
+def is_stored(name, date_created):
+    """
+    Tells if the image of a pending photo can be processed.
+
+    The row of an upload is committed just before its file is stored (see
+    `Photo.save`): a recent photo whose file is missing is left for a later
+    poll. Past PHOTO_PROCESSING_TIMEOUT, the file is not expected anymore and
+    the attempts fail.
+    """
+    if not name or date_created < timezone.now() - timedelta(seconds=processing_timeout()):
+        return True
+    return Photo._meta.get_field('image').storage.exists(name)
+
+
+def pending_photo_ids(limit, retry_delay=0):
+    """
+    Returns the IDs of the oldest pending photos whose file is stored.
+
+    Args:
+        limit (int): Maximum number of photos read from the queue.
+        retry_delay (int): Seconds to wait before retrying a failed attempt.
+    """
+    last_attempt = timezone.now() - timedelta(seconds=retry_delay)
+    pending = (Photo.objects
+               .filter(Q(processing_started_at__isnull=True)
+                       | Q(processing_started_at__lt=last_attempt),
+                       status=Photo.PENDING)
+               .order_by('pk').values_list('pk', 'image', 'date_created')[:limit])
+    return [photo_id for photo_id, name, date_created in pending
+            if is_stored(name, date_created)]
@@ -13,3 +13,34 @@ def get_poster_display(context, user):
     if context['user'] == user:
         return 'Vous avez'
     return f'{user.username} a '
+
+
+@register.inclusion_tag('reviews/photo_image.html')
+def photo_image(photo, display_width, css_class='ticket-item__image'):
+    """
+    Renders a ready photo with the `srcset` of its renditions.
+
+    Args:
+        photo (Photo): The photo, with its renditions prefetched if possible.
+        display_width (int): Maximum width of the image on the page, in CSS pixels.
+        css_class (str): Class of the `img` element.
+    """
+    renditions = {}
+    for rendition in photo.renditions.all():
+        renditions.setdefault(rendition.format, []).append(rendition)
+    jpeg = renditions.get('jpeg', [])
+    # Fallback of the browsers ignoring srcset: the smallest rendition filling the width
+    fallback = next((rendition for rendition in jpeg if rendition.width >= display_width),
+                    jpeg[-1] if jpeg else None)
+    return {
+        'photo': photo,
+        'css_class': css_class,
+        'fallback': fallback,
+        'webp_srcset': srcset(renditions.get('webp', [])),
+        'jpeg_srcset': srcset(jpeg),
+        'sizes': f'(max-width: {display_width}px) 100vw, {display_width}px',
+    }
+
+
+def srcset(renditions):
+    return ', '.join(f'{rendition.file.url} {rendition.width}w' for rendition in renditions)
@@ -0,0 +1,1523 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from io import BytesIO, StringIO
+from itertools import chain
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Max, Min, Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from PIL import Image
+import LitReview.urls
+from social.models import UserFollows
+from . import cache, checks, images, tasks, timeline, views
+from .cache import stats as cache_stats
+from .feed import FEED_PAGE_SIZE, REVIEW, TICKET, CursorPaginator, Feed, home_feed
+from .forms import PhotoForm
+from .models import FeedEntry, Photo, PhotoManager, Ticket, Review
+
+User = get_user_model()
+
+
+class FeedTestCase(TestCase):
+    """
+    Base class of the feed tests: the cached feed pages are cleared before each
+    test, as user IDs are reused from one test to another.
+    """
+
+    def setUp(self):
+        caches['feed'].clear()
+
+
+def set_time_created(post, time_created):
+    """
+    Moves the creation time of a ticket or a review (auto_now_add) in the database.
+    """
+    type(post).objects.filter(pk=post.pk).update(time_created=time_created)
+    post.time_created = time_created
+
+
+class FeedMergeTests(TestCase):
+    """
+    Checks that the SQL merge of the feed returns the posts in the order of
+    the Python merge it replaced (tickets and reviews sorted together, newest first).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='writer', password='password')
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        # Tickets and reviews interleaved, with runs of each kind
+        kinds = 'TTRTRRRTTRTRTTTRR'
+        tickets = []
+        for index, kind in enumerate(kinds):
+            if kind == 'T' or not tickets:
+                post = Ticket.objects.create(title=f'Ticket {index}', user=cls.user)
+                tickets.append(post)
+            else:
+                reviewer = User.objects.create_user(username=f'reviewer{index}')
+                post = Review.objects.create(ticket=tickets[index % len(tickets)],
+                                             user=reviewer, rating=index % 6,
+                                             headline=f'Critique {index}')
+            set_time_created(post, start + timedelta(hours=(index * 7) % len(kinds)))
+
+    def python_merge(self):
+        # Implementation of the feed before the SQL merge
+        return sorted(chain(Ticket.objects.all(), Review.objects.all()),
+                      key=lambda instance: instance.time_created,
+                      reverse=True)
+
+    def test_merged_order(self):
+        feed = Feed(Ticket.objects.all(), Review.objects.all())
+        expected = self.python_merge()
+        self.assertEqual(feed.count(), len(expected))
+        self.assertEqual(feed[0:feed.count()], expected)
+        self.assertEqual([row['post_id'] for row in feed.rows(0, 3)],
+                         [post.pk for post in expected[:3]])
+
+    def test_pages_match_python_merge(self):
+        paginator = Paginator(Feed(Ticket.objects.all(), Review.objects.all()), 6)
+        expected = Paginator(self.python_merge(), 6)
+        self.assertEqual(paginator.count, expected.count)
+        self.assertEqual(paginator.num_pages, expected.num_pages)
+        for number in expected.page_range:
+            with self.subTest(page=number):
+                self.assertEqual(list(paginator.page(number)), list(expected.page(number)))
+
+
+class CursorPaginationTests(FeedTestCase):
+    """
+    Checks the keyset pagination of the feeds: walking the pages in both
+    directions, ties on the creation time and malformed cursors.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='password')
+        cls.start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        cls.posts = []
+        for index in range(4):
+            ticket = Ticket.objects.create(title=f'Ticket {index}', user=cls.user)
+            review = Review.objects.create(ticket=ticket, user=cls.user, rating=3,
+                                           headline=f'Critique {index}')
+            cls.posts += [ticket, review]
+        # Ties on the creation time across the page boundaries: the pages are
+        # then ordered on the kind and the ID of the posts
+        for index, post in enumerate(cls.posts):
+            set_time_created(post, cls.start + timedelta(hours=index // 3))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def paginator(self, per_page=3):
+        return CursorPaginator(Feed(Ticket.objects.all(), Review.objects.all()), per_page)
+
+    def expected(self):
+        kind = {Ticket: TICKET, Review: REVIEW}
+        return sorted([*Ticket.objects.all(), *Review.objects.all()],
+                      key=lambda post: (post.time_created, kind[type(post)], post.pk),
+                      reverse=True)
+
+    def walk(self, paginator):
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(after=pages[-1].next_cursor))
+        return pages
+
+    def test_forward_and_backward(self):
+        paginator = self.paginator()
+        pages = self.walk(paginator)
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual([post for page in pages for post in page], self.expected())
+        self.assertFalse(pages[0].has_previous())
+
+        # Back from the last page, through the `before` cursors
+        backward = [pages[-1]]
+        while backward[-1].has_previous():
+            backward.append(paginator.get_page(before=backward[-1].previous_cursor))
+        self.assertEqual([list(page) for page in backward[::-1]],
+                         [list(page) for page in pages])
+
+    def test_ties_across_page_boundaries(self):
+        for post in self.posts:
+            set_time_created(post, self.start)
+        for per_page in (1, 2, 3, 5):
+            with self.subTest(per_page=per_page):
+                pages = self.walk(self.paginator(per_page))
+                self.assertEqual([post for page in pages for post in page], self.expected())
+
+    def test_post_inserted_between_page_loads(self):
+        paginator = self.paginator()
+        first = paginator.get_page()
+        newer = Ticket.objects.create(title='Nouveau', user=self.user)
+        set_time_created(newer, self.start + timedelta(days=1))
+        # Same creation time as the last post of the page, ordered after it
+        # on the kind: the post belongs to the next page
+        other = User.objects.create_user(username='other', password='password')
+        tied = Review.objects.create(ticket=self.posts[0], user=other, rating=1,
+                                     headline='Ex aequo')
+        set_time_created(tied, first.object_list[-1].time_created)
+
+        second = paginator.get_page(after=first.next_cursor)
+        seen = [*first, *second]
+        self.assertEqual(len(set(seen)), len(seen))
+        expected = [post for post in self.expected() if post != newer]
+        self.assertEqual(seen, expected[:len(seen)])
+        self.assertIn(tied, second)
+
+        # Going back returns the posts of the first page, the new post stays before them
+        previous = paginator.get_page(before=second.previous_cursor)
+        self.assertEqual(list(previous), list(first))
+        self.assertTrue(previous.has_previous())
+
+    def test_malformed_cursor_returns_first_page(self):
+        paginator = self.paginator()
+        first = list(paginator.get_page())
+        # Not base64, not JSON, null, wrong types, invalid date, not ASCII
+        cursors = ['???', 'bm90IGpzb24', 'bnVsbA', 'WzEsIDIsIDNd',
+                   'WyJoaWVyIiwgInRpY2tldCIsIDFd', 'é']
+        for cursor in cursors:
+            for direction in ('after', 'before'):
+                with self.subTest(cursor=cursor, direction=direction):
+                    self.assertEqual(list(paginator.get_page(**{direction: cursor})), first)
+                    response = self.client.get(reverse('home'), {direction: cursor})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(list(response.context['page_obj'])[:3], first)
+
+
+def legacy_visible_posts(user):
+    """
+    Returns the (tickets, reviews) of the home feed of `user` computed with the
+    predicates of the home view before `visible_to`: block and follow IDs
+    loaded in Python, then used in `__in` filters.
+    """
+    blocked_users = (UserFollows.objects.filter(user=user, blocked=True)
+                     .values_list('followed_user', flat=True))
+    blocked_by_users = (UserFollows.objects.filter(followed_user=user, blocked=True)
+                        .values_list('user', flat=True))
+    blocked_combined = set(blocked_users).union(set(blocked_by_users))
+    followed_users = user.following.values_list('followed_user', flat=True)
+    tickets = Ticket.objects.filter(
+        (Q(user__in=followed_users) | Q(user=user))
+        & ~Q(user__in=blocked_combined))
+    reviews = Review.objects.filter(
+        (Q(user__in=followed_users) | Q(user=user) | Q(ticket__user=user))
+        & ~Q(user__in=blocked_combined))
+    return tickets, reviews
+
+
+class VisibilityTests(TestCase):
+    """
+    Checks that `visible_to` selects the posts of the former predicates of the
+    home feed, on relationships covering each rule.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        names = ['viewer', 'followed', 'blocked', 'blocker', 'mutual', 'follower', 'stranger']
+        users = {name: User.objects.create_user(username=name, password='password')
+                 for name in names}
+        cls.users = users
+        follows = [
+            ('viewer', 'followed', False),
+            # Followed then blocked by the viewer
+            ('viewer', 'blocked', True),
+            # Blocks the viewer, without being followed
+            ('blocker', 'viewer', True),
+            # Followed by the viewer, and blocks the viewer
+            ('viewer', 'mutual', False),
+            ('mutual', 'viewer', True),
+            ('follower', 'viewer', False),
+        ]
+        for user, followed_user, blocked in follows:
+            UserFollows.objects.create(user=users[user], followed_user=users[followed_user],
+                                       blocked=blocked)
+        cls.tickets = {name: Ticket.objects.create(title=f'Ticket de {name}', user=user)
+                       for name, user in users.items()}
+        reviews = [
+            # Replies to the viewer's ticket, by users in every relationship
+            *((name, 'viewer') for name in names),
+            ('viewer', 'followed'),
+            ('viewer', 'stranger'),
+            ('followed', 'stranger'),
+            ('stranger', 'followed'),
+            ('blocked', 'followed'),
+            ('follower', 'mutual'),
+        ]
+        cls.reviews = {}
+        for author, ticket in reviews:
+            cls.reviews[author, ticket] = Review.objects.create(
+                ticket=cls.tickets[ticket], user=users[author], rating=3,
+                headline=f'{author} sur {ticket}')
+
+    def assertSamePosts(self, user):
+        tickets, reviews = legacy_visible_posts(user)
+        self.assertQuerySetEqual(Ticket.objects.visible_to(user), tickets, ordered=False)
+        self.assertQuerySetEqual(Review.objects.visible_to(user), reviews, ordered=False)
+
+    def test_matches_former_predicates(self):
+        for name, user in self.users.items():
+            with self.subTest(user=name):
+                self.assertSamePosts(user)
+
+    def test_rules(self):
+        viewer = self.users['viewer']
+        self.assertQuerySetEqual(
+            Ticket.objects.visible_to(viewer),
+            [self.tickets['viewer'], self.tickets['followed']], ordered=False)
+        self.assertQuerySetEqual(
+            Review.objects.visible_to(viewer),
+            [self.reviews[key] for key in [
+                # Own reviews and reviews of followed users
+                ('viewer', 'viewer'), ('viewer', 'followed'), ('viewer', 'stranger'),
+                ('followed', 'viewer'), ('followed', 'stranger'),
+                # Replies of non-followed users to the viewer's ticket
+                ('follower', 'viewer'), ('stranger', 'viewer'),
+            ]], ordered=False)
+
+    def test_rules_after_changes(self):
+        viewer = self.users['viewer']
+        UserFollows.objects.filter(user=viewer, followed_user=self.users['blocked']).update(
+            blocked=False)
+        UserFollows.objects.filter(user=self.users['blocker']).delete()
+        UserFollows.objects.create(user=self.users['stranger'], followed_user=viewer,
+                                   blocked=True)
+        for name, user in self.users.items():
+            with self.subTest(user=name):
+                self.assertSamePosts(user)
+        self.assertIn(self.tickets['blocked'], Ticket.objects.visible_to(viewer))
+        self.assertNotIn(self.reviews['stranger', 'viewer'], Review.objects.visible_to(viewer))
+
+
+class FeedQueryCountTests(FeedTestCase):
+    """
+    Checks that the feeds render in a fixed number of queries, whatever the
+    number of posts. A page holding a single kind of post skips one query.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='password')
+        cls.followed = User.objects.create_user(username='writer', password='password')
+        UserFollows.objects.create(user=cls.user, followed_user=cls.followed)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def create_posts(self, author, count):
+        """
+        Creates `count` tickets (with a photo) by `author`, each answered by a review
+        of the other user.
+        """
+        other = self.followed if author == self.user else self.user
+        for index in range(count):
+            photo = Photo.objects.create(uploader=author)
+            ticket = Ticket.objects.create(title=f'Ticket {index}', user=author, photo=photo)
+            Review.objects.create(ticket=ticket, user=other, rating=3,
+                                  headline=f'Critique {index}')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_home_query_count(self):
+        self.create_posts(self.followed, 1)
+        # session, user, validators (x3), feed index, tickets, reviews
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(len(response.context['page_obj']), 2)
+
+    def test_home_query_count_does_not_depend_on_content(self):
+        self.create_posts(self.followed, 1)
+        small_page = self.count_queries(reverse('home'))
+        self.create_posts(self.followed, 10)
+        self.create_posts(self.user, 10)
+        self.assertLessEqual(self.count_queries(reverse('home')), small_page)
+        # Numbered pages also count the tickets and the reviews
+        self.assertLessEqual(self.count_queries(reverse('home') + '?page=3'), small_page + 2)
+
+    def test_user_posts_query_count(self):
+        self.create_posts(self.user, 1)
+        self.create_posts(self.followed, 1)
+        # session, user, validators (x2), feed index, tickets, reviews
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('posts'))
+        self.assertEqual(len(response.context['page_obj']), 2)
+
+    def test_user_posts_query_count_does_not_depend_on_content(self):
+        self.create_posts(self.user, 1)
+        self.create_posts(self.followed, 1)
+        small_page = self.count_queries(reverse('posts'))
+        self.create_posts(self.user, 10)
+        self.create_posts(self.followed, 10)
+        self.assertLessEqual(self.count_queries(reverse('posts')), small_page)
+
+    def test_user_has_reviewed_flag(self):
+        self.create_posts(self.followed, 1)
+        Ticket.objects.create(title='Sans critique', user=self.followed)
+        response = self.client.get(reverse('home'))
+        flags = {post.title: post.user_has_reviewed
+                 for post in response.context['page_obj'] if isinstance(post, Ticket)}
+        self.assertEqual(flags, {'Ticket 0': True, 'Sans critique': False})
+
+
+@override_settings(FEED_MATERIALIZED=True)
+class TimelineTests(FeedTestCase):
+    """
+    Checks that the materialized feeds follow the posts and relationships.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.carol = User.objects.create_user(username='carol', password='password')
+
+    def assertFeedsUpToDate(self):
+        for user in (self.alice, self.bob, self.carol):
+            self.assertEqual(timeline.differences(user), (set(), set()), user.username)
+
+    def feed(self, user):
+        return set(FeedEntry.objects.filter(owner=user).values_list('kind', 'object_id'))
+
+    def test_posts_are_fanned_out(self):
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        ticket = Ticket.objects.create(title='Ticket', user=self.bob)
+        review = Review.objects.create(ticket=ticket, user=self.carol, rating=4, headline='Bien')
+        self.assertEqual(self.feed(self.alice), {(TICKET, ticket.pk)})
+        self.assertEqual(self.feed(self.bob), {(TICKET, ticket.pk), (REVIEW, review.pk)})
+        self.assertEqual(self.feed(self.carol), {(REVIEW, review.pk)})
+        self.assertFeedsUpToDate()
+
+        ticket.delete()
+        self.assertFalse(FeedEntry.objects.exists())
+
+    def test_follow_unfollow_and_block(self):
+        ticket = Ticket.objects.create(title='Ticket', user=self.bob)
+        follow = UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        self.assertIn((TICKET, ticket.pk), self.feed(self.alice))
+
+        follow.blocked = True
+        follow.save()
+        self.assertNotIn((TICKET, ticket.pk), self.feed(self.alice))
+        self.assertFeedsUpToDate()
+
+        follow.blocked = False
+        follow.save()
+        self.assertIn((TICKET, ticket.pk), self.feed(self.alice))
+
+        UserFollows.objects.filter(pk=follow.pk).delete()
+        self.assertNotIn((TICKET, ticket.pk), self.feed(self.alice))
+        self.assertFeedsUpToDate()
+
+    def test_home_reads_materialized_feed(self):
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        ticket = Ticket.objects.create(title='Ticket', user=self.bob)
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('home'))
+        self.assertEqual(list(response.context['page_obj']), [ticket])
+
+    def test_rebuild_command(self):
+        UserFollows.objects.create(user=self.alice, followed_user=self.bob)
+        Ticket.objects.create(title='Ticket', user=self.bob)
+        FeedEntry.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_timeline', '--check', stdout=StringIO())
+        call_command('rebuild_timeline', stdout=StringIO())
+        call_command('rebuild_timeline', '--check', stdout=StringIO())
+        self.assertFeedsUpToDate()
+
+
+class QueryPlanTests(FeedTestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query of the hot views and fails if
+    one of them reads a whole table (or a whole index) instead of searching it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='password')
+        cls.followed = User.objects.create_user(username='writer', password='password')
+        cls.follower = User.objects.create_user(username='follower', password='password')
+        UserFollows.objects.create(user=cls.user, followed_user=cls.followed)
+        UserFollows.objects.create(user=cls.follower, followed_user=cls.user, blocked=True)
+        for author, other in ((cls.user, cls.followed), (cls.followed, cls.user)):
+            for index in range(8):
+                ticket = Ticket.objects.create(title=f'Ticket {index}', user=author,
+                                               photo=Photo.objects.create(uploader=author))
+                Review.objects.create(ticket=ticket, user=other, rating=2, headline='Critique')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            details = [row[-1] for row in cursor.fetchall()]
+        return [detail for detail in details
+                if detail.startswith('SCAN ')
+                and not detail.startswith(('SCAN CONSTANT ROW', 'SCAN (subquery'))]
+
+    def assertNoFullScan(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            if query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT')):
+                continue
+            self.assertEqual(self.full_scans(query['sql']), [], query['sql'])
+
+    def test_home(self):
+        self.assertNoFullScan(reverse('home'))
+        self.assertNoFullScan(reverse('home') + '?page=2')
+        with override_settings(FEED_MATERIALIZED=True):
+            call_command('rebuild_timeline', stdout=StringIO())
+            self.assertNoFullScan(reverse('home'))
+
+    def test_home_next_page(self):
+        page = self.client.get(reverse('home')).context['page_obj']
+        self.assertNoFullScan(reverse('home') + f'?after={page.next_cursor}')
+
+    def test_user_posts(self):
+        self.assertNoFullScan(reverse('posts'))
+        self.assertNoFullScan(reverse('posts') + '?page=2')
+
+    def test_follow_users_page(self):
+        self.assertNoFullScan(reverse('follow-users-form'))
+
+    def test_create_review_page(self):
+        ticket = Ticket.objects.create(title='Sans critique', user=self.followed)
+        self.assertNoFullScan(reverse('create-review', args=[ticket.pk]))
+
+
+class FeedCacheTests(FeedTestCase):
+    """
+    Checks that feed pages are served from the cache until a change affects them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='password')
+        cls.followed = User.objects.create_user(username='writer', password='password')
+        UserFollows.objects.create(user=cls.user, followed_user=cls.followed)
+        Ticket.objects.create(title='Premier', user=cls.followed)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def titles(self, url):
+        return [post.title for post in self.client.get(url).context['page_obj']]
+
+    def test_second_request_is_served_from_cache(self):
+        self.client.get(reverse('home'))
+        # session, user, validators (x3), tickets (the feed index comes from the cache)
+        with self.assertNumQueries(6):
+            self.client.get(reverse('home'))
+
+    def test_new_post_of_followed_user_invalidates_cache(self):
+        self.assertEqual(self.titles(reverse('home')), ['Premier'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.create(title='Second', user=self.followed)
+        self.assertEqual(self.titles(reverse('home')), ['Second', 'Premier'])
+
+    def test_unfollow_invalidates_cache(self):
+        self.assertEqual(self.titles(reverse('home')), ['Premier'])
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFollows.objects.filter(user=self.user).delete()
+        self.assertEqual(self.titles(reverse('home')), [])
+
+    def test_own_posts_page_invalidated(self):
+        self.assertEqual(self.titles(reverse('posts')), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.create(title='Mien', user=self.user)
+        self.assertEqual(self.titles(reverse('posts')), ['Mien'])
+
+    def test_metrics(self):
+        before = cache_stats.snapshot()
+        self.client.get(reverse('home'))
+        self.client.get(reverse('home'))
+        after = cache_stats.snapshot()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+        # Local requests (such as those of a reverse proxy) are not trusted
+        response = self.client.get(reverse('feed-cache-metrics'))
+        self.assertEqual(response.status_code, 403)
+        with override_settings(FEED_CACHE_METRICS_IPS=['10.0.0.1']):
+            response = self.client.get(reverse('feed-cache-metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertContains(response, f"litreview_feed_cache_hits_total {after['hits']}")
+        self.client.force_login(User.objects.create_user(username='admin', password='password',
+                                                         is_staff=True))
+        self.assertEqual(self.client.get(reverse('feed-cache-metrics')).status_code, 200)
+
+
+class FeedCacheCommitTests(TransactionTestCase):
+    """
+    Checks that the feed versions are bumped once the writes are committed:
+    a page cached by a request running during the transaction, which reads
+    the rows of before the commit, is not served afterwards.
+    """
+
+    def setUp(self):
+        caches['feed'].clear()
+        self.user = User.objects.create_user(username='reader', password='password')
+        self.followed = User.objects.create_user(username='writer', password='password')
+        UserFollows.objects.create(user=self.user, followed_user=self.followed)
+        Ticket.objects.create(title='Premier', user=self.followed)
+        self.client.force_login(self.user)
+
+    def titles(self):
+        return [post.title for post in self.client.get(reverse('home')).context['page_obj']]
+
+    def read_feed_concurrently(self, rows):
+        """
+        Caches the first page of the home feed from another thread, as a
+        concurrent request would: with the current version of the user, and
+        the rows its connection sees (the rows of before the commit).
+        """
+        def read():
+            feed = cache.CachedFeed(mock.Mock(rows=lambda *args: rows), self.user, 'home')
+            feed.rows(0, FEED_PAGE_SIZE + 1, None, True)
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+
+    def test_page_read_before_commit_is_invalidated(self):
+        self.assertEqual(self.titles(), ['Premier'])
+        committed_rows = home_feed(self.user).rows(0, FEED_PAGE_SIZE + 1)
+        version = cache.get_version(self.user.pk)
+        with transaction.atomic():
+            Ticket.objects.create(title='Second', user=self.followed)
+            self.assertEqual(cache.get_version(self.user.pk), version)
+            self.read_feed_concurrently(committed_rows)
+        self.assertNotEqual(cache.get_version(self.user.pk), version)
+        self.assertEqual(self.titles(), ['Second', 'Premier'])
+
+    def test_rolled_back_write_keeps_cache(self):
+        self.titles()
+        version = cache.get_version(self.user.pk)
+        with self.assertRaises(DatabaseError):
+            with transaction.atomic():
+                Ticket.objects.create(title='Annulé', user=self.followed)
+                raise DatabaseError
+        self.assertEqual(cache.get_version(self.user.pk), version)
+
+
+@override_settings(CACHES={**settings.CACHES, 'feed': {
+    'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+    'LOCATION': 'feed_cache',
+}})
+class SharedFeedCacheTests(TestCase):
+    """
+    Checks the feed cache shared by the worker processes (production profile)
+    and the warning about process-local feed caches.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Dropped with the transaction of the test class
+        call_command('createcachetable', 'feed_cache', verbosity=0)
+        cls.user = User.objects.create_user(username='reader', password='password')
+        cls.followed = User.objects.create_user(username='writer', password='password')
+        UserFollows.objects.create(user=cls.user, followed_user=cls.followed)
+        Ticket.objects.create(title='Premier', user=cls.followed)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def titles(self):
+        return [post.title for post in self.client.get(reverse('home')).context['page_obj']]
+
+    def test_invalidation_reaches_other_processes(self):
+        # Backend of another worker process, with its own connection state
+        other_process = caches.create_connection('feed')
+        self.assertEqual(self.titles(), ['Premier'])
+        version = other_process.get(f'feed-version:{self.user.pk}')
+        self.assertIsNotNone(version)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.create(title='Second', user=self.followed)
+        self.assertNotEqual(other_process.get(f'feed-version:{self.user.pk}'), version)
+        self.assertEqual(self.titles(), ['Second', 'Premier'])
+
+    def test_process_local_cache_warning(self):
+        locmem = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        with override_settings(CACHES={**settings.CACHES, 'feed': locmem}):
+            with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+                self.assertEqual(checks.check_feed_cache(None), [])
+            with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+                self.assertEqual([error.id for error in checks.check_feed_cache(None)],
+                                 ['reviews.W001'])
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+            self.assertEqual(checks.check_feed_cache(None), [])
+
+
+class ConditionalGetTests(FeedTestCase):
+    """
+    Checks that unchanged feed pages are answered with a 304 without running
+    the feed queries.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='password')
+        cls.followed = User.objects.create_user(username='writer', password='password')
+        cls.follow = UserFollows.objects.create(user=cls.user, followed_user=cls.followed)
+        cls.ticket = Ticket.objects.create(title='Premier', user=cls.followed)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def revalidate(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in (reverse('home'), reverse('posts'), reverse('follow-users-form')):
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url).status_code, 304)
+
+    def test_not_modified_skips_feed_queries(self):
+        response = self.client.get(reverse('home'))
+        # session, user, validators (x3)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since(self):
+        response = self.client.get(reverse('home'))
+        response = self.client.get(reverse('home'),
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def edit_ticket(self):
+        self.ticket.title = 'Modifié'
+        self.ticket.save()
+
+    def test_changes_invalidate_validators(self):
+        changes = [
+            lambda: Ticket.objects.create(title='Second', user=self.followed),
+            self.edit_ticket,
+            lambda: UserFollows.objects.filter(pk=self.follow.pk).update(blocked=True),
+        ]
+        for change in changes:
+            response = self.client.get(reverse('home'))
+            # The feed versions are bumped once the change is committed
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 200)
+
+    def test_edited_ticket_of_followed_review(self):
+        # The ticket of a stranger, shown in the feed by the review of a followed user
+        stranger = User.objects.create_user(username='stranger', password='password')
+        ticket = Ticket.objects.create(title='Original', user=stranger)
+        Review.objects.create(ticket=ticket, user=self.followed, rating=3, headline='Avis')
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Original')
+        ticket.title = 'Renommé'
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.save(update_fields=['title'])
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Renommé')
+
+    def test_review_stats_of_followed_ticket(self):
+        # The review count and the average rating of the ticket are shown
+        response = self.client.get(reverse('home'))
+        stranger = User.objects.create_user(username='stranger', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(ticket=self.ticket, user=stranger, rating=4, headline='Avis')
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '1 critique – note moyenne 4,0/5')
+
+    @override_settings(FEED_CACHE_ALIAS=None)
+    def test_no_validators_without_cache_version(self):
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        # Same count and newest date: only the cache version would change
+        self.edit_ticket()
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Modifié')
+
+    def test_pending_messages_disable_validation(self):
+        response = self.client.get(reverse('follow-users-form'))
+        self.client.post(reverse('follow-users-form'), {'follow_user': '',
+                                                        'followed_username': 'inconnu'})
+        response = self.client.get(reverse('follow-users-form'),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Cet utilisateur n&#x27;existe pas.")
+
+
+class AsyncFeedUrls:
+    """
+    URL configuration serving the feed pages with their async views, as an
+    ASGI deployment with FEED_ASYNC_VIEWS enabled does.
+    """
+    urlpatterns = [
+        path('home/', views.ahome, name='home'),
+        path('reviews/my-posts.html/', views.adisplay_user_posts, name='posts'),
+        *(pattern for pattern in LitReview.urls.urlpatterns
+          if getattr(pattern, 'name', None) not in ('home', 'posts')),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncFeedUrls)
+class AsyncFeedViewTests(TransactionTestCase):
+    """
+    The async feed views, served through the ASGI handler, render the same
+    pages as the sync views; their queries run in other threads (hence a
+    TransactionTestCase: the data must be committed to be seen there).
+    """
+
+    def setUp(self):
+        caches['feed'].clear()
+        self.user = User.objects.create_user(username='reader', password='password')
+        followed = User.objects.create_user(username='writer', password='password')
+        UserFollows.objects.create(user=self.user, followed_user=followed)
+        for index in range(8):
+            Ticket.objects.create(title=f'Billet {index}', user=followed)
+        Review.objects.create(ticket=Ticket.objects.first(), user=self.user, rating=4,
+                              headline='Ma critique')
+        Ticket.objects.create(title='Le mien', user=self.user)
+
+    def posts(self, response):
+        return [str(post) for post in response.context['page_obj']]
+
+    def sql_count(self, response):
+        timings = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        return timings['sql'].split('desc=')[1]
+
+    async def get(self, name, urlconf=AsyncFeedUrls, **params):
+        # Same cache state for the compared views
+        await caches['feed'].aclear()
+        with override_settings(ROOT_URLCONF=urlconf):
+            return await self.async_client.get(reverse(name), params)
+
+    async def test_pages_match_sync_views(self):
+        await self.async_client.aforce_login(self.user)
+        for name in ('home', 'posts'):
+            with self.subTest(name=name):
+                response = await self.get(name)
+                expected = await self.get(name, 'LitReview.urls')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.posts(response), self.posts(expected))
+                # The queries run in the other threads are measured too
+                self.assertEqual(self.sql_count(response), self.sql_count(expected))
+
+    async def test_next_page_and_conditional_get(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('home'))
+        page = response.context['page_obj']
+        self.assertTrue(page.has_next())
+        next_page = await self.async_client.get(reverse('home'), {'after': page.next_cursor})
+        self.assertEqual(len(self.posts(next_page)), 4)
+        not_modified = await self.async_client.get(
+            reverse('home'), headers={'If-None-Match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+    async def test_login_required(self):
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(CACHES={**settings.CACHES, 'feed': settings.FEED_CACHE_BACKENDS['production']})
+class AsyncSharedFeedCacheViewTests(AsyncFeedViewTests):
+    """
+    The async feed views with the feed cache of the production profile, a
+    table of the database: the cache is never read from the event loop.
+    """
+
+    def setUp(self):
+        call_command('createcachetable', 'feed_cache', verbosity=0)
+        super().setUp()
+
+
+def image_upload(name='photo.png', size=(800, 600), color='blue'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(PHOTO_PROCESSING='sync', PHOTO_PROCESSING_MAX_ATTEMPTS=2)
+class PhotoProcessingTests(FeedTestCase):
+    """
+    Uploaded photos are processed after the commit, retried, then marked as failed.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(username='auteur', password='secret')
+
+    def test_photo_processed_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            photo = Photo.objects.create(image=image_upload(), uploader=self.user)
+        self.assertEqual(photo.status, Photo.PENDING)
+        for callback in callbacks:
+            callback()
+        photo.refresh_from_db()
+        self.assertEqual((photo.status, photo.attempts), (Photo.READY, 1))
+        self.assertEqual((photo.width, photo.height), (800, 600))
+
+    def test_renditions(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            photo = Photo.objects.create(image=image_upload(size=(300, 150)), uploader=self.user)
+        renditions = photo.renditions.values_list('format', 'width', 'height')
+        # Widths above the width of the image are not upscaled
+        self.assertEqual(sorted(renditions), [('jpeg', 96, 48), ('jpeg', 200, 100),
+                                              ('jpeg', 300, 150), ('webp', 96, 48),
+                                              ('webp', 200, 100), ('webp', 300, 150)])
+        for rendition in photo.renditions.all():
+            with Image.open(rendition.file.path) as image:
+                self.assertEqual((image.format.lower(), image.size),
+                                 (rendition.format, (rendition.width, rendition.height)))
+
+    def test_feed_serves_srcset_without_extra_queries(self):
+        self.client.force_login(self.user)
+        for index in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                photo = Photo.objects.create(image=image_upload(color=(index, 0, 0)),
+                                             uploader=self.user)
+            Ticket.objects.create(title=f'Billet {index}', user=self.user, photo=photo)
+            # session, user, validators (x3), feed index, tickets, renditions
+            with self.assertNumQueries(8):
+                response = self.client.get(reverse('home'))
+        self.assertContains(response, 'type="image/webp"', count=3)
+        self.assertContains(response, 'loading="lazy"', count=3)
+        self.assertContains(response, f'{photo.renditions.get(format="jpeg", width=400).file.url}'
+                                      ' 400w')
+
+    def test_corrupt_image_fails_after_retries(self):
+        corrupt = SimpleUploadedFile('photo.png', b'not an image', content_type='image/png')
+        with self.assertLogs('reviews.tasks', 'WARNING'):
+            with self.captureOnCommitCallbacks(execute=True):
+                photo = Photo.objects.create(image=corrupt, uploader=self.user)
+        photo.refresh_from_db()
+        self.assertEqual((photo.status, photo.attempts), (Photo.FAILED, 2))
+        self.assertIn('UnidentifiedImageError', photo.last_error)
+
+    def test_large_jpeg_decoded_at_reduced_scale(self):
+        buffer = BytesIO()
+        Image.new('RGB', (4000, 3000), 'blue').save(buffer, 'JPEG')
+        upload = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+        with self.captureOnCommitCallbacks(execute=True):
+            photo = Photo.objects.create(image=upload, uploader=self.user)
+        with images.open_reduced(photo.image.path, 800) as (image, size):
+            image.load()
+            self.assertEqual((image.size, size), ((1000, 750), (4000, 3000)))
+        photo.refresh_from_db()
+        self.assertEqual((photo.width, photo.height), (4000, 3000))
+        self.assertEqual(photo.renditions.get(format='jpeg', width=800).height, 600)
+
+    def test_decompression_bomb_rejected(self):
+        buffer = BytesIO()
+        Image.new('1', (12000, 12000)).save(buffer, 'PNG')
+        bomb = SimpleUploadedFile('bomb.png', buffer.getvalue(), content_type='image/png')
+        form = PhotoForm(files={'image': bomb})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['image'], ["Cette image est trop volumineuse."])
+        # Already stored images are failed without retries
+        with self.assertLogs('reviews.tasks', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                photo = Photo.objects.create(image=bomb, uploader=self.user)
+        photo.refresh_from_db()
+        self.assertEqual((photo.status, photo.attempts), (Photo.FAILED, 1))
+
+    def test_unreadable_upload_reported_by_image_field(self):
+        corrupt = SimpleUploadedFile('photo.png', b'not an image', content_type='image/png')
+        form = PhotoForm(files={'image': corrupt})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors.as_data()['image'][0].code, 'invalid_image')
+        # Errors other than unreadable images are not hidden
+        with mock.patch.object(images, 'check_limits', side_effect=TypeError):
+            with self.assertRaises(TypeError):
+                PhotoForm(files={'image': image_upload()}).is_valid()
+
+    def test_pending_photo_shows_placeholder(self):
+        with self.captureOnCommitCallbacks():
+            photo = Photo.objects.create(image=image_upload(), uploader=self.user)
+        Ticket.objects.create(title='Billet', user=self.user, photo=photo)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Image en cours de traitement')
+        self.assertNotContains(response, photo.image.url)
+
+    @override_settings(PHOTO_PROCESSING='worker')
+    def test_worker_processes_pending_and_stalled_photos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pending = Photo.objects.create(image=image_upload(), uploader=self.user)
+            stalled = Photo.objects.create(image=image_upload(color='red'), uploader=self.user)
+        Photo.objects.filter(pk=stalled.pk).update(status=Photo.PROCESSING)
+        call_command('process_photos', '--once', stdout=StringIO())
+        self.assertEqual(set(Photo.objects.values_list('pk', 'status')),
+                         {(pending.pk, Photo.READY), (stalled.pk, Photo.READY)})
+
+    @override_settings(PHOTO_PROCESSING='worker', PHOTO_PROCESSING_TIMEOUT=300)
+    def test_worker_waits_for_stored_file(self):
+        # Committed row, file not stored yet (on_commit callbacks not run)
+        with self.captureOnCommitCallbacks() as callbacks:
+            photo = Photo.objects.create(image=image_upload(), uploader=self.user)
+        call_command('process_photos', '--once', stdout=StringIO())
+        photo.refresh_from_db()
+        self.assertEqual((photo.status, photo.attempts), (Photo.PENDING, 0))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(tasks.pending_photo_ids(10), [photo.pk])
+        # A file missing for longer is not expected anymore
+        os.remove(photo.image.path)
+        Photo.objects.filter(pk=photo.pk).update(
+            date_created=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(tasks.pending_photo_ids(10), [photo.pk])
+
+    @override_settings(PHOTO_PROCESSING='worker')
+    def test_recovery_processes_stalled_and_pending_photos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pending = Photo.objects.create(image=image_upload(), uploader=self.user)
+            stalled = Photo.objects.create(image=image_upload(color='red'), uploader=self.user)
+            running = Photo.objects.create(image=image_upload(color='green'), uploader=self.user)
+        # Left processing by a crashed process, and being processed by a live one
+        Photo.objects.filter(pk=stalled.pk).update(
+            status=Photo.PROCESSING,
+            processing_started_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        tasks.claim(running.pk)
+        with self.assertLogs('reviews.tasks', 'WARNING'):
+            self.assertEqual(tasks.recover(), 2)
+        self.assertEqual(set(Photo.objects.values_list('pk', 'status')),
+                         {(pending.pk, Photo.READY), (stalled.pk, Photo.READY),
+                          (running.pk, Photo.PROCESSING)})
+
+    @override_settings(PHOTO_PROCESSING='thread', PHOTO_PROCESSING_TIMEOUT=300)
+    def test_thread_pool_starts_with_recovery(self):
+        executor = mock.patch.object(tasks, 'ThreadPoolExecutor')
+        pool = executor.start().return_value
+        self.addCleanup(executor.stop)
+        for name in ('_executor', '_last_recovery'):
+            patcher = mock.patch.object(tasks, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        def submitted():
+            return [call.args[1] for call in pool.submit.call_args_list]
+
+        with mock.patch.object(tasks.time, 'monotonic', return_value=1000):
+            tasks.enqueue(1)
+            tasks.enqueue(2)
+        self.assertEqual(submitted(), [tasks.recover, tasks.process_with_retries,
+                                       tasks.process_with_retries])
+        # Periodic recovery, driven by the uploads
+        with mock.patch.object(tasks.time, 'monotonic', return_value=1300):
+            tasks.enqueue(3)
+        self.assertEqual(submitted()[3:], [tasks.recover, tasks.process_with_retries])
+
+
+@override_settings(PHOTO_PROCESSING='sync')
+class PhotoDeduplicationTests(TransactionTestCase):
+    """
+    Uploads of identical bytes share a photo, deleted with the last ticket using it.
+
+    The views commit their transaction: the image files are written on commit,
+    while the uploads of the request are still open.
+    """
+
+    def setUp(self):
+        caches['feed'].clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(username='auteur', password='secret')
+        self.other = User.objects.create_user(username='autre', password='secret')
+
+    def post_ticket(self, user, title):
+        self.client.force_login(user)
+        self.client.post(reverse('create-ticket'), {'title': title, 'image': image_upload()})
+        return Ticket.objects.select_related('photo').get(title=title)
+
+    def test_identical_uploads_share_photo(self):
+        first = self.post_ticket(self.user, 'Premier')
+        second = self.post_ticket(self.other, 'Second')
+        self.assertEqual(first.photo, second.photo)
+        photo = first.photo
+        expected_hash = hashlib.sha256(image_upload().read()).hexdigest()
+        self.assertEqual(photo.content_hash, expected_hash)
+        self.assertEqual(photo.image.name, f'photos/{expected_hash[:2]}/{expected_hash}.png')
+        self.assertEqual((Photo.objects.count(), photo.status), (1, Photo.READY))
+        # The renditions were generated once
+        self.assertEqual(photo.renditions.count(), 8)
+
+    def test_last_ticket_deletes_photo_and_files(self):
+        first = self.post_ticket(self.user, 'Premier')
+        second = self.post_ticket(self.other, 'Second')
+        photo = first.photo
+        paths = [photo.image.path, *(rendition.file.path for rendition in photo.renditions.all())]
+        first.delete()
+        self.assertTrue(Photo.objects.filter(pk=photo.pk).exists())
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        second.delete()
+        self.assertFalse(Photo.objects.filter(pk=photo.pk).exists())
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_replaced_photo_is_released(self):
+        ticket = self.post_ticket(self.user, 'Premier')
+        self.client.post(reverse('edit-ticket', args=[ticket.pk]),
+                         {'title': 'Premier', 'image': image_upload(color='red')})
+        ticket.refresh_from_db()
+        self.assertEqual(list(Photo.objects.all()), [ticket.photo])
+
+
+@override_settings(PHOTO_PROCESSING='worker')
+class WriteFlowTests(TransactionTestCase):
+    """
+    Each submission of the create and edit forms is saved in one transaction,
+    with a fixed number of statements; image files are written on commit.
+
+    The counts include the session and user queries of the request, and the
+    BEGIN and COMMIT of the transaction.
+    """
+
+    def setUp(self):
+        caches['feed'].clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(username='auteur', password='secret')
+        self.other = User.objects.create_user(username='autre', password='secret')
+        UserFollows.objects.create(user=self.other, followed_user=self.user)
+        self.client.force_login(self.user)
+
+    def post(self, queries, url, data):
+        with self.assertNumQueries(queries):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def test_ticket_flows(self):
+        # Ticket insert, followers of the author
+        self.post(6, reverse('create-ticket'), {'title': 'Billet', 'description': ''})
+        ticket = Ticket.objects.get()
+        # Photo lookup, savepoint, insert and release of get_or_create
+        self.post(10, reverse('create-ticket'), {'title': 'Avec photo', 'description': '',
+                                                 'image': image_upload()})
+        self.assertEqual(len(self.stored_files()), 1)
+        # Ticket joined with its photo, update of the edited columns, reviewers,
+        # followers
+        self.post(8, reverse('edit-ticket', args=[ticket.pk]),
+                  {'title': 'Modifié', 'description': ''})
+
+    def test_review_flows(self):
+        ticket = Ticket.objects.create(title='Billet', user=self.other)
+        # Ticket, review insert, ticket aggregates, followers
+        self.post(8, reverse('create-review', args=[ticket.pk]),
+                  {'rating': '3', 'headline': 'Avis', 'body': ''})
+        review = Review.objects.get()
+        # Review joined with its ticket, review and aggregate updates, followers
+        self.post(8, reverse('edit-review', args=[review.pk]),
+                  {'rating': '5', 'headline': 'Avis', 'body': ''})
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.review_count, ticket.rating_sum), (1, 5))
+
+        response = self.client.post(reverse('create-review', args=[ticket.pk]),
+                                    {'rating': '1', 'headline': 'Encore', 'body': ''})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Review.objects.count(), 1)
+
+    def test_ticket_and_review_flow(self):
+        data = {'title': 'Billet', 'description': '', 'rating': '4', 'headline': 'Avis',
+                'body': ''}
+        # Ticket insert, review insert, ticket aggregates, followers for each post
+        self.post(9, reverse('create-ticket-and-review'), data)
+        # Photo lookup, savepoint, insert and release of get_or_create
+        self.post(13, reverse('create-ticket-and-review'), {**data, 'image': image_upload()})
+        self.assertEqual(Ticket.objects.filter(review_count=1).count(), 2)
+
+    def test_reused_photo_deleted_concurrently(self):
+        photo = Photo.objects.create(image=image_upload(), uploader=self.other)
+        for_upload = PhotoManager.for_upload
+
+        def for_upload_then_release(manager, image, uploader):
+            result = for_upload(manager, image, uploader)
+            if result[0].pk == photo.pk:
+                # A concurrent release() deletes the unused photo meanwhile
+                Photo.objects.filter(pk=photo.pk).delete()
+            return result
+
+        with mock.patch.object(PhotoManager, 'for_upload', autospec=True,
+                               side_effect=for_upload_then_release):
+            response = self.client.post(reverse('create-ticket'), {
+                'title': 'Avec photo', 'description': '', 'image': image_upload()})
+        self.assertEqual(response.status_code, 302)
+        ticket = Ticket.objects.select_related('photo').get()
+        self.assertNotEqual(ticket.photo.pk, photo.pk)
+        self.assertEqual(ticket.photo.content_hash, photo.content_hash)
+        self.assertEqual(self.stored_files(), [os.path.basename(ticket.photo.image.name)])
+
+    def test_failure_leaves_no_partial_post(self):
+        data = {'title': 'Billet', 'description': '', 'rating': '4', 'headline': 'Avis',
+                'body': '', 'image': image_upload()}
+        with mock.patch.object(Review, 'save', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('create-ticket-and-review'), data)
+        self.assertFalse(Ticket.objects.exists())
+        self.assertFalse(Photo.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+@override_settings(PHOTO_PROCESSING='sync')
+class MediaGarbageCollectionTests(FeedTestCase):
+    """
+    `gc_media` deletes the photos without image or ticket, and the files without row.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(username='auteur', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.used = Photo.objects.create(image=image_upload(), uploader=self.user)
+            self.unused = Photo.objects.create(image=image_upload(color='red'),
+                                               uploader=self.user)
+        Ticket.objects.create(title='Billet', user=self.user, photo=self.used)
+        self.empty = Photo.objects.create(uploader=self.user)
+        self.stray = os.path.join(self.media_root, 'photos', 'stray.png')
+        with open(self.stray, 'wb') as file:
+            file.write(b'stray')
+
+    def gc_media(self, *args):
+        output = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('gc_media', '--min-age', '0', '--batch', '2', *args, stdout=output)
+        return output.getvalue()
+
+    def media_files(self):
+        return {os.path.relpath(os.path.join(directory, name), self.media_root)
+                for directory, _, names in os.walk(self.media_root) for name in names}
+
+    def test_dry_run_deletes_nothing(self):
+        files = self.media_files()
+        output = self.gc_media('--dry-run')
+        self.assertIn("2 photo(s) orpheline(s) à supprimer.", output)
+        self.assertIn("photos/stray.png", output)
+        self.assertEqual(Photo.objects.count(), 3)
+        self.assertEqual(self.media_files(), files)
+
+    def test_collects_orphans(self):
+        output = self.gc_media()
+        self.assertIn("2 photo(s) orpheline(s) supprimée(s).", output)
+        self.assertEqual(list(Photo.objects.all()), [self.used])
+        expected = {self.used.image.name, *self.used.renditions.values_list('file', flat=True)}
+        self.assertEqual(self.media_files(), expected)
+
+    def test_resumes_from_checkpoint(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        checkpoint = os.path.join(directory, 'gc.json')
+        with open(checkpoint, 'w') as file:
+            json.dump({'photo': self.unused.pk, 'directories': ['.', 'photos']}, file)
+        stray_rendition = os.path.join(self.media_root, 'renditions', 'stray.webp')
+        with open(stray_rendition, 'wb') as file:
+            file.write(b'stray')
+        self.gc_media('--checkpoint', checkpoint)
+        # Only the photos after the checkpoint and the directories not yet
+        # collected were collected
+        self.assertEqual(set(Photo.objects.all()), {self.used, self.unused})
+        self.assertTrue(os.path.exists(self.stray))
+        self.assertFalse(os.path.exists(stray_rendition))
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_files_are_streamed(self):
+        with mock.patch('reviews.management.commands.gc_media.sorted', create=True,
+                        side_effect=AssertionError("directory listing loaded")):
+            self.gc_media()
+        self.assertFalse(os.path.exists(self.stray))
+
+
+class ReviewStatsTests(FeedTestCase):
+    """
+    The review aggregates of the tickets follow the reviews and can be repaired.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user(username='auteur', password='secret')
+        self.readers = [User.objects.create_user(username=f'lecteur{index}', password='secret')
+                        for index in range(3)]
+        self.ticket = Ticket.objects.create(title='Billet', user=self.author)
+
+    def review(self, user, rating):
+        return Review.objects.create(ticket=self.ticket, user=user, rating=rating, headline='Avis')
+
+    def assertStats(self, count, total, last):
+        self.ticket.refresh_from_db()
+        self.assertEqual((self.ticket.review_count, self.ticket.rating_sum,
+                          self.ticket.last_review_at), (count, total, last))
+
+    def test_stats_follow_reviews(self):
+        self.assertIsNone(self.ticket.average_rating)
+        first = self.review(self.readers[0], 4)
+        second = self.review(self.readers[1], 1)
+        self.assertStats(2, 5, second.time_created)
+        self.assertEqual(self.ticket.average_rating, 2.5)
+
+        self.client.force_login(self.readers[0])
+        self.client.post(reverse('edit-review', args=[first.pk]),
+                         {'headline': 'Avis', 'rating': '2', 'body': ''})
+        self.assertStats(2, 3, second.time_created)
+
+        second.delete()
+        self.assertStats(1, 2, first.time_created)
+        Review.objects.get(pk=first.pk).delete()
+        self.assertStats(0, 0, None)
+
+    def test_ticket_deletion(self):
+        self.review(self.readers[0], 3)
+        self.ticket.delete()
+        self.readers[1].delete()
+        self.assertFalse(Ticket.objects.exists())
+
+    def test_shown_on_feed(self):
+        self.review(self.readers[0], 5)
+        self.review(self.readers[1], 2)
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(reverse('home')), '2 critiques – note moyenne 3,5/5')
+
+    def test_by_rating(self):
+        other = Ticket.objects.create(title='Autre', user=self.author)
+        unreviewed = Ticket.objects.create(title='Sans critique', user=self.author)
+        self.review(self.readers[0], 2)
+        Review.objects.create(ticket=other, user=self.readers[0], rating=4, headline='Avis')
+        self.assertEqual(list(Ticket.objects.by_rating()), [other, self.ticket, unreviewed])
+
+    def test_repair_command(self):
+        review = self.review(self.readers[0], 3)
+        self.review(self.readers[1], 5)
+        Ticket.objects.update(review_count=7, rating_sum=1, last_review_at=None)
+        Review.objects.filter(pk=review.pk).update(rating=1)
+        with self.assertRaises(CommandError):
+            call_command('repair_review_stats', '--check', stdout=StringIO())
+
+        call_command('repair_review_stats', '--batch', '1', stdout=StringIO())
+        self.assertStats(2, 6, Review.objects.aggregate(last=Max('time_created'))['last'])
+        call_command('repair_review_stats', '--check', stdout=StringIO())
+
+
+class SearchTests(FeedTestCase):
+    """
+    The full-text index follows the posts; results are ranked and visible only
+    to the users who can see the posts in their home feed.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.reader = User.objects.create_user(username='lecteur', password='secret')
+        self.followed = User.objects.create_user(username='suivi', password='secret')
+        self.stranger = User.objects.create_user(username='inconnu', password='secret')
+        UserFollows.objects.create(user=self.reader, followed_user=self.followed)
+        self.client.force_login(self.reader)
+
+    def search(self, query, **params):
+        return self.client.get(reverse('search'), {'q': query, **params})
+
+    def results(self, query):
+        return list(self.search(query).context['page_obj'])
+
+    def test_ranked_and_visible(self):
+        body = Ticket.objects.create(title='Roman', description='Un été à la plage.',
+                                     user=self.followed)
+        title = Ticket.objects.create(title="L'Été", user=self.reader)
+        review = Review.objects.create(ticket=title, user=self.followed, rating=4,
+                                       headline='Lu cet ete', body='Belle histoire.')
+        Ticket.objects.create(title='Été caché', user=self.stranger)
+        self.assertEqual(self.results('ete'), [title, review, body])
+
+        UserFollows.objects.filter(user=self.reader).update(blocked=True)
+        self.assertEqual(self.results('ÉTÉ'), [title])
+
+    def test_index_follows_changes(self):
+        ticket = Ticket.objects.create(title='Dune', user=self.reader)
+        Review.objects.bulk_create([Review(ticket=ticket, user=self.followed, rating=5,
+                                           headline='Épique', body='Sable et épices.')])
+        self.assertEqual(len(self.results('epices')), 1)
+        Review.objects.update(body='Désert.')
+        self.assertEqual(self.results('epices'), [])
+        ticket.title = 'Fondation'
+        ticket.save()
+        self.assertEqual(self.results('fond'), [ticket])
+        ticket.delete()
+        self.assertEqual(self.results('fondation'), [])
+        self.assertEqual(self.results('desert'), [])
+
+    def test_operators_and_empty_query(self):
+        ticket = Ticket.objects.create(title='Le Nom de la rose', user=self.reader)
+        self.assertEqual(self.results('"rose" -) nom*('), [ticket])
+        for query in ['', '  ', '*"']:
+            response = self.search(query)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.context['page_obj']), [])
+
+    def test_pagination(self):
+        Ticket.objects.bulk_create([Ticket(title=f'Policier {index}', user=self.reader)
+                                    for index in range(8)])
+        response = self.search('policier')
+        self.assertEqual(len(response.context['page_obj']), 6)
+        self.assertContains(response, '?q=policier&amp;page=2')
+        self.assertEqual(len(self.search('policier', page=2).context['page_obj']), 2)
+
+    def test_rebuild_command(self):
+        ticket = Ticket.objects.create(title='Germinal', user=self.reader)
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM reviews_search")
+        self.assertEqual(self.results('germinal'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.results('germinal'), [ticket])
+
+
+class SeedDatasetTests(TestCase):
+    """
+    `seed_dataset` generates the same dataset from the same seed.
+    """
+
+    def seed(self, *args):
+        call_command('seed_dataset', '--users', '40', '--end', '2024-06-01T00:00:00+00:00',
+                     '--block-ratio', '0.2', *args, stdout=StringIO())
+
+    def snapshot(self):
+        return {
+            'follows': sorted(UserFollows.objects.values_list(
+                'user__username', 'followed_user__username', 'blocked')),
+            'tickets': sorted(Ticket.objects.values_list(
+                'user__username', 'title', 'time_created')),
+            'reviews': sorted(Review.objects.values_list(
+                'user__username', 'ticket__title', 'rating', 'time_created')),
+        }
+
+    def test_same_seed_same_dataset(self):
+        self.seed('--seed', '7')
+        first = self.snapshot()
+        User.objects.filter(username__startswith='seed').delete()
+        self.seed('--seed', '7')
+        self.assertEqual(self.snapshot(), first)
+        self.assertTrue(any(blocked for _, _, blocked in first['follows']))
+        self.assertTrue(first['tickets'] and first['reviews'])
+
+    def test_posts_in_time_range(self):
+        self.seed('--days', '30')
+        end = datetime(2024, 6, 1, tzinfo=timezone.utc)
+        for model in (Ticket, Review):
+            dates = model.objects.aggregate(first=Min('time_created'), last=Max('time_created'))
+            self.assertGreaterEqual(dates['first'], end - timedelta(days=30))
+            self.assertLessEqual(dates['last'], end)
+        self.assertFalse(Review.objects.filter(time_created__lt=F('ticket__time_created')))
+
+    def test_review_stats_consistent(self):
+        self.seed()
+        self.assertTrue(Ticket.objects.filter(review_count__gt=0).exists())
+        self.assertFalse(Ticket.objects.with_stale_review_stats().exists())
+
+    def test_existing_prefix_refused(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class BenchViewsTests(TestCase):
+    """
+    `bench_views` measures the views, saves the results and flags regressions.
+    """
+
+    def setUp(self):
+        call_command('seed_dataset', '--users', '10', '--follows-per-user', '4',
+                     stdout=StringIO())
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.output = os.path.join(directory, 'run.json')
+
+    def test_results_and_comparison(self):
+        call_command('bench_views', '--iterations', '2', '--warmup', '0', '--scenario', 'home',
+                     '--scenario', 'delete-ticket', '--output', self.output, stdout=StringIO())
+        with open(self.output) as file:
+            run = json.load(file)
+        self.assertEqual(set(run['results']), {'home', 'delete-ticket'})
+        self.assertEqual(set(run['results']['home']['wall_ms']),
+                         {'p50', 'p90', 'p95', 'p99', 'mean'})
+        self.assertGreater(run['results']['home']['queries'], 0)
+        # The writes of the scenarios are rolled back
+        self.assertEqual(run['meta']['dataset']['tickets'], Ticket.objects.count())
+
+        output = StringIO()
+        call_command('bench_views', '--baseline', self.output, '--against', self.output,
+                     stdout=output)
+        self.assertIn("Aucune régression.", output.getvalue())
+        run['results']['home']['queries'] -= 1
+        baseline = self.output.replace('run', 'baseline')
+        with open(baseline, 'w') as file:
+            json.dump(run, file)
+        with self.assertRaisesMessage(CommandError, "1 régression(s)"):
+            call_command('bench_views', '--baseline', baseline, '--against', self.output,
+                         stdout=StringIO())
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'])
+class LoadTestTests(TransactionTestCase):
+    """
+    `loadtest` drives the in-process applications with concurrent users.
+    """
+
+    def setUp(self):
+        caches['feed'].clear()
+        call_command('seed_dataset', '--users', '6', '--follows-per-user', '3',
+                     stdout=StringIO())
+
+    def test_transports(self):
+        for transport in ('wsgi', 'asgi', 'http'):
+            with self.subTest(transport=transport):
+                output = StringIO()
+                tickets = Ticket.objects.count()
+                # A single user: the in-memory test database is locked by
+                # table (shared cache), concurrent writes fail immediately
+                call_command('loadtest', '--transport', transport, '--users', '1',
+                             '--duration', '0.5', '--mix', 'home=1,create-ticket=1',
+                             stdout=output)
+                self.assertIn('home', output.getvalue())
+                self.assertNotIn('%', output.getvalue().replace(' 0.0%', ''))
+                self.assertGreater(Ticket.objects.count(), tickets)
@@ -0,0 +1,149 @@
+"""
+Maintenance of the materialized home feeds (`FeedEntry`).
+
+Posts are fanned out to the feeds of their audience when they are created,
+and the feeds of two users are resynchronised when a follow or block
+relationship between them changes. The rules are the ones of the live home
+feed (`Ticket.objects.visible_to` / `Review.objects.visible_to`).
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef, Q
+from social.models import UserFollows
+from .feed import REVIEW, TICKET
+from .models import FeedEntry, Review, Ticket
+
+BATCH_SIZE = 1000
+
+
+def is_enabled():
+    """
+    Returns True if the home feeds are read from the materialized table.
+    """
+    return getattr(settings, 'FEED_MATERIALIZED', False)
+
+
+def audience(author, extra_user_ids=()):
+    """
+    Returns the IDs of the users whose home feed shows the posts of `author`.
+
+    The audience is the author, their followers and `extra_user_ids`,
+    excluding the users blocked by the author or who blocked the author.
+
+    Args:
+        author (User): The author of the post.
+        extra_user_ids (iterable): Other users who see the post
+            (the owner of the ticket for a review).
+
+    Returns:
+        QuerySet: The user IDs.
+    """
+    follows_author = UserFollows.objects.filter(user=OuterRef('pk'), followed_user=author)
+    blocked = UserFollows.objects.filter(
+        Q(user=OuterRef('pk'), followed_user=author)
+        | Q(user=author, followed_user=OuterRef('pk')),
+        blocked=True)
+    return (get_user_model().objects
+            .filter(Q(pk__in=[author.pk, *extra_user_ids]) | Exists(follows_author))
+            .exclude(Exists(blocked))
+            .values_list('pk', flat=True))
+
+
+def fan_out(kind, post, owner_ids):
+    """
+    Writes the entries of a post in the feeds of `owner_ids`.
+    """
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(owner_id=owner_id, author_id=post.user_id, kind=kind,
+                   object_id=post.pk, time_created=post.time_created)
+         for owner_id in owner_ids),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def add_ticket(ticket):
+    """
+    Adds a new ticket to the feeds of its audience.
+    """
+    fan_out(TICKET, ticket, audience(ticket.user))
+
+
+def add_review(review):
+    """
+    Adds a new review to the feeds of its audience, including the owner of the ticket.
+    """
+    fan_out(REVIEW, review, audience(review.user, [review.ticket.user_id]))
+
+
+def remove_post(kind, object_id):
+    """
+    Removes a deleted ticket or review from every feed.
+    """
+    FeedEntry.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def index_entries(owner, tickets, reviews):
+    """
+    Yields the `FeedEntry` rows of `owner` for the given tickets and reviews.
+    """
+    for kind, posts in ((TICKET, tickets), (REVIEW, reviews)):
+        for post_id, author_id, time_created in (posts.order_by()
+                                                 .values_list('pk', 'user', 'time_created')
+                                                 .iterator(chunk_size=BATCH_SIZE)):
+            yield FeedEntry(owner=owner, author_id=author_id, kind=kind,
+                            object_id=post_id, time_created=time_created)
+
+
+def sync_pair(owner, author):
+    """
+    Recomputes the posts of `author` shown in the feed of `owner`.
+
+    Called when a follow or block relationship between both users changes:
+    only the visibility of the posts of one user in the feed of the other
+    depends on it.
+    """
+    FeedEntry.objects.filter(owner=owner, author=author).delete()
+    FeedEntry.objects.bulk_create(
+        index_entries(owner,
+                      Ticket.objects.visible_to(owner).filter(user=author),
+                      Review.objects.visible_to(owner).filter(user=author)),
+        batch_size=BATCH_SIZE,
+    )
+
+
+def sync_relationship(user, other):
+    """
+    Resynchronises the feeds of two users after a change of their relationship.
+    """
+    sync_pair(user, other)
+    sync_pair(other, user)
+
+
+def rebuild(owner):
+    """
+    Rebuilds the whole feed of `owner` from the tickets and reviews.
+    """
+    FeedEntry.objects.filter(owner=owner).delete()
+    FeedEntry.objects.bulk_create(
+        index_entries(owner,
+                      Ticket.objects.visible_to(owner),
+                      Review.objects.visible_to(owner)),
+        batch_size=BATCH_SIZE,
+    )
+
+
+def differences(owner):
+    """
+    Compares the materialized feed of `owner` with the live feed.
+
+    Returns:
+        tuple: Sets of (kind, post ID) missing from, and in excess in,
+        the materialized feed.
+    """
+    live_entries = index_entries(owner,
+                                 Ticket.objects.visible_to(owner),
+                                 Review.objects.visible_to(owner))
+    expected = {(entry.kind, entry.object_id) for entry in live_entries}
+    actual = set(FeedEntry.objects.filter(owner=owner).values_list('kind', 'object_id'))
+    return expected - actual, actual - expected
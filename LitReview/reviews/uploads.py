@@ -0,0 +1,57 @@
+"""
+Upload handlers hashing the uploaded files while they stream in.
+
+They replace Django's default handlers (FILE_UPLOAD_HANDLERS) and set a
+`content_hash` attribute (SHA-256, hexadecimal) on the uploaded files, so
+that `Photo.objects.for_upload()` does not read the file again to find a
+photo with identical bytes.
+"""
+import hashlib
+from django.core.files.uploadhandler import (MemoryFileUploadHandler,
+                                             TemporaryFileUploadHandler)
+
+
+def content_hash(file):
+    """
+    Returns the SHA-256 of a file, computed by the upload handlers if possible.
+    """
+    digest = getattr(file, 'content_hash', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    file.content_hash = sha256.hexdigest()
+    return file.content_hash
+
+
+class HashingUploadMixin:
+    """
+    Hashes the chunks of the uploaded file before the handler stores them.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        result = super().receive_data_chunk(raw_data, start)
+        # The chunk was stored by this handler, and not passed on to the next one
+        if result is None:
+            self.sha256.update(raw_data)
+        return result
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
@@ -0,0 +1,12 @@
+def batched(iterable, size):
+    """
+    Yields lists of `size` items of `iterable` (the last one may be shorter).
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
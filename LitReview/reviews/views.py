@@ -1,70 +1,35 @@
+from urllib.parse import urlencode
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponseForbidden
-from django.db.models import Q
-from .models import Ticket, Review
-from .forms import ReviewForm, TicketForm, PhotoForm
-from social.models import UserFollows
+from django.http import HttpResponse, HttpResponseForbidden
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.core.files.uploadedfile import UploadedFile
 from django.core.paginator import Paginator
+from .models import Photo, Ticket, Review
+from .forms import ReviewForm, TicketForm, PhotoForm
+from .cache import cached_feed, stats
+from .conditional import conditional_page, home_state, posts_state
+from .concurrency import in_thread
+from .feed import FEED_PAGE_SIZE, Feed, apaginate_feed, home_feed, paginate_feed
+from .search import SearchFeed
 from . import forms
-from itertools import chain
 
 
 @login_required
+@conditional_page(home_state)
 def home(request):
     """
     View for displaying the home feed.
 
     Retrieves tickets and reviews from followed users and the current user,
-    excluding content from blocked users.
+    excluding content from blocked users (see `reviews.feed.home_feed`).
     """
-    # Retrieve users blocked by the current user
-    blocked_users = (UserFollows.objects.filter(user=request.user, blocked=True)
-                     .values_list('followed_user', flat=True))
-
-    # Retrieve users who blocked the current user
-    blocked_by_users = (UserFollows.objects.filter(followed_user=request.user, blocked=True)
-                        .values_list('user', flat=True))
-
-    # Combine all blocked users into a single set
-    blocked_combined = set(blocked_users).union(set(blocked_by_users))
-
-    # Retrieve IDs of followed users
-    followed_users = request.user.following.values_list('followed_user', flat=True)
-
-    # Fetch tickets from followed users and the current user, excluding blocked users
-    tickets = Ticket.objects.filter(
-        (Q(user__in=followed_users) | Q(user=request.user))
-        & ~Q(user__in=blocked_combined)  # Exclure les utilisateurs bloqués
-    ).prefetch_related('review_set')
-
-    # Annotate tickets with a flag to indicate if the user has reviewed them
-    # (to deactivate review button)
-    for ticket in tickets:
-        ticket.user_has_reviewed = (ticket.review_set.filter
-                                    (user=request.user).exists())
-
-    # Fetch reviews from followed users, the current user,
-    # or tickets created by the user
-    reviews = Review.objects.filter(
-        (Q(user__in=followed_users) |  # Reviews by followed users
-         Q(user=request.user) |  # Reviews by the user
-         Q(ticket__user=request.user))  # Reviews on tickets created by the user
-        & ~Q(user__in=blocked_combined)  # Exclude blocked users
-    ).select_related('ticket')
-
-    # Combine and sort tickets and reviews by creation time
-    posts = sorted(chain(tickets, reviews),
-                   key=lambda instance: instance.time_created,
-                   reverse=True)
-    print("Tickets :", list(tickets))
-    print("Reviews :", list(reviews))
-    print("Posts combinés :", posts)
-
-    # Paginate the posts (6 per page)
-    paginator = Paginator(posts, 6)
-    page = request.GET.get('page')
-    page_obj = paginator.get_page(page)
+    # Merge tickets and reviews in the database, newest first,
+    # and paginate the feed (6 per page): only the current page is loaded,
+    # and the posts of the page are cached until the feed changes
+    feed = cached_feed(home_feed(request.user), request.user, 'home')
+    page_obj = paginate_feed(request, feed)
 
     # Render the home page with paginated posts
     context = {
@@ -73,6 +38,26 @@ def home(request):
     return render(request, 'reviews/home_page.html', context=context)
 
 
+@login_required
+@conditional_page(home_state)
+async def ahome(request):
+    """
+    Async version of `home`, for the ASGI application (FEED_ASYNC_VIEWS).
+
+    The validator queries, then the tickets and the reviews of the page, run
+    concurrently in threads (see `reviews.concurrency`); the event loop
+    serves other requests while they wait.
+    """
+    # The cache version is read from the feed cache, which may be a table of
+    # the database (production profile)
+    feed = await in_thread(cached_feed, home_feed(request.user), request.user, 'home')
+    page_obj = await apaginate_feed(request, feed)
+    context = {
+        'page_obj': page_obj,
+    }
+    return await in_thread(render, request, 'reviews/home_page.html', context=context)
+
+
 @login_required
 def create_or_edit_ticket(request, ticket_id=None):
     """
@@ -86,8 +71,8 @@ def create_or_edit_ticket(request, ticket_id=None):
     """
     # Fetch the ticket if an ID is provided; otherwise, create a new ticket
     if ticket_id:
-        ticket = get_object_or_404(Ticket, id=ticket_id)
-        if ticket.user != request.user:
+        ticket = get_object_or_404(Ticket.objects.select_related('photo'), id=ticket_id)
+        if ticket.user_id != request.user.pk:
             return HttpResponseForbidden("Vous n'êtes pas autorisé"
                                          " à modifier ce billet.")
     else:
@@ -105,15 +90,24 @@ def create_or_edit_ticket(request, ticket_id=None):
         # Validate both forms
         if ticket_form.is_valid() and photo_form.is_valid():
             ticket = ticket_form.save(commit=False)
-
-            # Handle the optional photo upload
-            if photo_form.cleaned_data.get('image'):
-                photo = photo_form.save(commit=False)
-                photo.uploader = request.user
-                photo.save()
-                ticket.photo = photo
-
-            ticket.save()
+            previous_photo_id = ticket.photo_id
+            image = photo_form.cleaned_data.get('image')
+
+            # One transaction: the photo, the ticket and the release of the
+            # replaced photo are saved together (the image file is written
+            # and processed once committed)
+            with transaction.atomic():
+                # Edition saves only the edited columns: the review aggregates
+                # are updated concurrently by other requests
+                update_fields = ['title', 'description', 'photo'] if ticket_id else None
+                # Handle the optional photo upload: identical images share a photo
+                if isinstance(image, UploadedFile):
+                    Photo.objects.attach_upload(ticket, image, request.user,
+                                                update_fields=update_fields)
+                else:
+                    ticket.save(update_fields=update_fields)
+                if ticket.photo_id != previous_photo_id:
+                    Photo.objects.release([previous_photo_id])
             # Redirect to appropriate page after saving
             if ticket_id:  # Ticket modification
                 return redirect('posts')
@@ -154,6 +148,10 @@ def delete_ticket(request, ticket_id):
                   {'ticket': ticket})
 
 
+def already_reviewed():
+    return HttpResponseForbidden("Vous avez déjà publié une critique pour ce billet.")
+
+
 @login_required
 def create_or_edit_review(request, ticket_id=None, review_id=None):
     """
@@ -167,19 +165,26 @@ def create_or_edit_review(request, ticket_id=None, review_id=None):
         HttpResponse: Renders the review creation or edit page.
     """
     # Fetch the ticket if ticket_id is provided
+    # The ticket summary of the page shows the author and the photo of the ticket
     if ticket_id:
-        ticket = get_object_or_404(Ticket, id=ticket_id)
+        ticket = get_object_or_404(Ticket.objects.select_related('user', 'photo'), id=ticket_id)
     else:
         ticket = None
 
     # Fetch the review if review_id is provided; otherwise, create a new review
     if review_id:
-        review = get_object_or_404(Review, id=review_id)
-        if review.user != request.user:
+        review = get_object_or_404(
+            Review.objects.select_related('ticket__user', 'ticket__photo'), id=review_id)
+        if review.user_id != request.user.pk:
             return HttpResponseForbidden("Vous n'êtes pas autorisé"
                                          " à modifier cette critique.")
         ticket = review.ticket
     else:
+        # A single review per ticket and per user (unique constraint): a
+        # submission is checked by the constraint itself, without a query
+        if (request.method != 'POST'
+                and Review.objects.filter(ticket=ticket, user=request.user).exists()):
+            return already_reviewed()
         review = Review(ticket=ticket, user=request.user)
 
     # Initialize the review form
@@ -193,9 +198,16 @@ def create_or_edit_review(request, ticket_id=None, review_id=None):
         review_form = ReviewForm(request.POST, instance=review)
         if review_form.is_valid():
             review = review_form.save(commit=False)
-            if not review_id:
-                review.ticket = ticket  # Associate to ticket when review is created
-            review.save()
+            # One transaction for the review and the aggregates of its ticket
+            try:
+                with transaction.atomic():
+                    if review_id:
+                        review.save(update_fields=['rating', 'headline', 'body'])
+                    else:
+                        review.ticket = ticket  # Associate to ticket when review is created
+                        review.save()
+            except IntegrityError:
+                return already_reviewed()
             if review_id:  # Modification
                 return redirect('posts')
             else:  # Creation
@@ -252,7 +264,8 @@ def create_ticket_and_review(request):
     Workflow:
         - On GET request, empty forms for Ticket, Photo, and Review are displayed.
         - On POST request, form data is validated:
-            1. If valid, a new Ticket, Photo (if uploaded), and Review are saved.
+            1. If valid, a new Ticket, Photo (if uploaded), and Review are saved
+               in a single transaction.
             2. If invalid, the form is re-rendered with error messages.
     """
     # Initialize empty forms for Ticket, Photo, and Review (GET request)
@@ -267,36 +280,29 @@ def create_ticket_and_review(request):
         review_form = forms.ReviewForm(request.POST)
         # Check if all forms are valid
         if all([ticket_form.is_valid(), photo_form.is_valid(), review_form.is_valid()]):
-            # Save the photo (if uploaded) but don't commit to the database yet
-            photo = photo_form.save(commit=False)
-            photo.uploader = request.user
-            photo.save()
             # Save the ticket (assigning the user) but don't commit to the database yet
             ticket = ticket_form.save(commit=False)
             ticket.user = request.user
-            # Check if an image is uploaded and attach it to the ticket
-            if photo_form.cleaned_data.get('image'):
-                photo = photo_form.save(commit=False)
-                photo.uploader = request.user
-                photo.save()
-                ticket.photo = photo
-            else:
-                ticket.photo = None
-            # Save the ticket in the database
-            ticket.save()
-
             # Save the review (linking it to the ticket) but don't commit to the database yet
             review = review_form.save(commit=False)
             # Attach the logged-in user
             review.user = request.user
-            # Link the review to the ticket
-            review.ticket = ticket
-            review.save()
+
+            # Photo, ticket and review are saved in one transaction: a failure
+            # leaves no partial post (the image file is written once committed)
+            with transaction.atomic():
+                # Check if an image is uploaded and attach it to the ticket
+                # (identical images share a photo)
+                if photo_form.cleaned_data.get('image'):
+                    Photo.objects.attach_upload(ticket, photo_form.cleaned_data['image'],
+                                                request.user)
+                else:
+                    # Save the ticket in the database
+                    ticket.save()
+                # Link the review to the ticket
+                review.ticket = ticket
+                review.save()
             return redirect('home')
-        else:
-            # Afficher les erreurs de validation pour débogage
-            print("Erreurs dans ticket_form :", ticket_form.errors)
-            print("Erreurs dans photo_form :", photo_form.errors)
     # Render the page with empty or pre-filled forms
     context = {
         'ticket_form': ticket_form,
@@ -307,12 +313,13 @@ def create_ticket_and_review(request):
 
 
 @login_required()
+@conditional_page(posts_state)
 def display_user_posts(request):
     """
        View to display the current user's posts (both tickets and reviews).
 
-       This view retrieves all the tickets and reviews created by the current user,
-       merges them, and sorts them by creation date (newest first). The posts
+       This view retrieves the tickets and reviews created by the current user,
+       merged and sorted by creation date (newest first) by the database. The posts
        are paginated to display 6 posts per page.
 
        Args:
@@ -325,27 +332,21 @@ def display_user_posts(request):
        Workflow:
            - Retrieve all tickets created by the user.
            - Retrieve all reviews created by the user.
-           - Merge the two querysets and sort by `time_created` in descending order.
-           - Paginate the results (6 posts per page).
+           - Merge the two querysets in the database, sorted by `time_created`
+             in descending order.
+           - Paginate the results (6 posts per page), loading only the current page.
            - Render the user_posts_page.html page with the list of posts.
        """
-    # Retrieve all tickets created by the user, along with their associated reviews
-    user_tickets = Ticket.objects.filter(user=request.user).prefetch_related('review_set')
-
-    # Retrieve all reviews created by the user, along with the associated ticket
-    user_reviews = Review.objects.filter(user=request.user).select_related('ticket')
-
-    # Merge and sort tickets and reviews by time_created (newest first)
-    posts = sorted(
-        chain(user_tickets, user_reviews),
-        key=lambda instance: instance.time_created,
-        reverse=True
-    )
-
-    # Paginate the posts (6 posts per page)
-    paginator = Paginator(posts, 6)
-    page = request.GET.get('page')
-    page_obj = paginator.get_page(page)
+    # Retrieve all tickets created by the user
+    user_tickets = Ticket.objects.filter(user=request.user)
+
+    # Retrieve all reviews created by the user
+    user_reviews = Review.objects.filter(user=request.user)
+
+    # Merge tickets and reviews in the database (newest first)
+    # and paginate the posts (6 posts per page)
+    feed = cached_feed(Feed(user_tickets, user_reviews), request.user, 'posts')
+    page_obj = paginate_feed(request, feed)
     # Render the 'user_posts_page.html' page with the paginated list of posts
     context = {
         'page_obj': page_obj,
@@ -353,3 +354,65 @@ def display_user_posts(request):
     }
     return render(request, 'reviews/user_posts_page.html',
                   context=context)
+
+
+@login_required()
+@conditional_page(posts_state)
+async def adisplay_user_posts(request):
+    """
+    Async version of `display_user_posts`, for the ASGI application
+    (FEED_ASYNC_VIEWS); its queries run like those of `ahome`.
+    """
+    feed = await in_thread(cached_feed, Feed(Ticket.objects.filter(user=request.user),
+                                             Review.objects.filter(user=request.user)),
+                           request.user, 'posts')
+    page_obj = await apaginate_feed(request, feed)
+    context = {
+        'page_obj': page_obj,
+        'show_buttons': True,
+    }
+    return await in_thread(render, request, 'reviews/user_posts_page.html', context=context)
+
+
+@login_required
+def search(request):
+    """
+    View searching the tickets and reviews of the home feed of the user.
+
+    Results are ranked by relevance (see `reviews.search`) and paginated by
+    page number, 6 per page.
+    """
+    query = request.GET.get('q', '').strip()
+    feed = SearchFeed(request.user, query)
+    page_obj = Paginator(feed, FEED_PAGE_SIZE).get_page(request.GET.get('page'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        # Keeps the search in the links of the pagination
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'reviews/search_page.html', context=context)
+
+
+def feed_cache_metrics(request):
+    """
+    Exposes the hit and miss counters of the feed cache of the current process
+    in the Prometheus text format.
+
+    The counters are kept per process: behind several worker processes, each
+    scrape returns the counters of the worker that served it.
+
+    Only available to staff users and to the addresses listed in the
+    FEED_CACHE_METRICS_IPS setting (none by default).
+    """
+    if not (request.user.is_staff
+            or request.META.get('REMOTE_ADDR') in getattr(settings, 'FEED_CACHE_METRICS_IPS', [])):
+        return HttpResponseForbidden()
+    counters = stats.snapshot()
+    lines = []
+    for name, value in counters.items():
+        lines += [
+            f'# TYPE litreview_feed_cache_{name}_total counter',
+            f'litreview_feed_cache_{name}_total {value}',
+        ]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
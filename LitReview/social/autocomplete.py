@@ -0,0 +1,188 @@
+"""
+In-memory prefix index of the usernames, for the autocomplete of the follow form.
+
+The index is a sorted list of (case-folded username, username, user ID)
+tuples: the usernames starting with a prefix are a contiguous slice of the
+list, found by bisection, so a lookup costs O(log n + results) without any
+`LIKE` query. The index is loaded on first use, updated by the signal
+handlers of the user model (`social.signals`) when a user signs up, is
+renamed or deleted, and reloaded every AUTOCOMPLETE_INDEX_TTL seconds to
+pick up the users created by the other processes of the server.
+
+The list is never modified once published: updates build a new list
+(copy-on-write), so lookups iterate it without taking the lock.
+"""
+import bisect
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from performance.routers import use_primary
+from reviews import cache as feed_cache
+from .models import UserFollows
+
+DEFAULT_LIMIT = 10
+
+HIDDEN_KEY = 'autocomplete-hidden:{user_id}:{version}'
+
+
+def fold(username):
+    return username.casefold()
+
+
+def apply_change(entries, by_id, user_id, entry):
+    """
+    Adds or renames (`entry`) or removes (None) a user in a sorted entry
+    list and its mapping by ID, in place.
+    """
+    previous = by_id.pop(user_id, None)
+    if previous is not None:
+        index = bisect.bisect_left(entries, previous)
+        if index < len(entries) and entries[index] == previous:
+            del entries[index]
+    if entry is not None:
+        bisect.insort(entries, entry)
+        by_id[user_id] = entry
+
+
+class UsernameIndex:
+    """
+    Sorted, case-folded index of the usernames.
+
+    Attributes:
+        - entries (list): Sorted (folded username, username, user ID) tuples.
+        - by_id (dict): Entry of each user ID, to update renamed users.
+        - loaded_at (float): Monotonic time of the last load, None before.
+        - journals (list): Changes made during each running load, as
+          (user ID, entry or None) tuples.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.by_id = {}
+        self.loaded_at = None
+        self.journals = []
+
+    def load(self):
+        """
+        Reloads the index from the database.
+
+        The users are read without the lock: the changes made meanwhile are
+        recorded, then applied to the loaded list before it is published.
+        """
+        journal = []
+        with self.lock:
+            self.journals.append(journal)
+        try:
+            users = get_user_model().objects.values_list('username', 'pk')
+            entries = sorted((fold(username), username, pk)
+                             for username, pk in users.iterator())
+        except BaseException:
+            with self.lock:
+                self.journals.remove(journal)
+            raise
+        with self.lock:
+            self.journals.remove(journal)
+            by_id = {entry[2]: entry for entry in entries}
+            for user_id, entry in journal:
+                apply_change(entries, by_id, user_id, entry)
+            # Lookups running meanwhile keep the previous list
+            self.entries = entries
+            self.by_id = by_id
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        ttl = getattr(settings, 'AUTOCOMPLETE_INDEX_TTL', 300)
+        if self.loaded_at is None or (ttl is not None
+                                      and time.monotonic() - self.loaded_at > ttl):
+            self.load()
+
+    def add(self, user_id, username):
+        """
+        Adds or renames a user.
+        """
+        with self.lock:
+            self._change(user_id, (fold(username), username, user_id))
+
+    def remove(self, user_id):
+        with self.lock:
+            self._change(user_id, None)
+
+    def _change(self, user_id, entry):
+        # Called with the lock held. A load reading the users meanwhile may
+        # have missed the change: it is recorded for it
+        for journal in self.journals:
+            journal.append((user_id, entry))
+        # Users are saved on every login: nothing to do if not renamed
+        if self.by_id.get(user_id) != entry:
+            # Copy on write: lookups iterate the published list without the lock
+            entries = list(self.entries)
+            apply_change(entries, self.by_id, user_id, entry)
+            self.entries = entries
+
+    def search(self, prefix, exclude=(), limit=DEFAULT_LIMIT):
+        """
+        Returns the usernames starting with `prefix`, case-insensitively, in
+        alphabetical order.
+
+        Args:
+            prefix (str): Beginning of the username.
+            exclude (set): IDs of the users to leave out.
+            limit (int): Maximum number of usernames.
+        """
+        prefix = fold(prefix)
+        if not prefix:
+            return []
+        self.ensure_loaded()
+        entries = self.entries
+        results = []
+        index = bisect.bisect_left(entries, (prefix,))
+        while index < len(entries) and len(results) < limit:
+            folded, username, user_id = entries[index]
+            if not folded.startswith(prefix):
+                break
+            if user_id not in exclude:
+                results.append(username)
+            index += 1
+        return results
+
+
+index = UsernameIndex()
+
+
+def hidden_user_ids(user):
+    """
+    Returns the IDs of the users hidden from the suggestions of `user`: the
+    user, and the users on either side of a block with them (the block rule
+    of the feeds).
+
+    The IDs are kept in the feed cache under the feed version of the user,
+    which changes whenever a follow relationship of the user changes, so the
+    keystrokes of a search do not query the database.
+    """
+    cache = feed_cache.get_cache()
+    if cache is not None:
+        key = HIDDEN_KEY.format(user_id=user.pk, version=feed_cache.get_version(user.pk))
+        hidden = cache.get(key)
+        if hidden is not None:
+            return hidden
+    blocks = (UserFollows.objects
+              .filter(Q(user=user) | Q(followed_user=user), blocked=True)
+              .values_list('user_id', 'followed_user_id'))
+    hidden = {user.pk}
+    # Cached under the new version: not read from a lagging replica
+    with use_primary():
+        for follower_id, followed_id in blocks:
+            hidden.update((follower_id, followed_id))
+    if cache is not None:
+        cache.set(key, hidden)
+    return hidden
+
+
+def suggest(user, prefix, limit=DEFAULT_LIMIT):
+    """
+    Returns the usernames suggested to `user` for `prefix`.
+    """
+    return index.search(prefix, exclude=hidden_user_ids(user), limit=limit)
@@ -9,7 +9,10 @@ class FollowUsersForm(forms.Form):
         max_length=150,
         widget=forms.TextInput(attrs={'placeholder': 'Nom de l\'utilisateur',
                                       'aria-label': 'Nom de l\'utilisateur',
-                                      'class': 'form-control form-control__searchbar'})
+                                      'class': 'form-control form-control__searchbar',
+                                      # Suggestions of the autocomplete endpoint
+                                      'list': 'username-suggestions',
+                                      'autocomplete': 'off'})
     )
 
     def __init__(self, *args, **kwargs):
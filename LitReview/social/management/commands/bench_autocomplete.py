@@ -0,0 +1,85 @@
+import random
+import statistics
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from social import autocomplete
+
+
+def percentiles(durations):
+    durations = sorted(durations)
+    return {
+        'p50': statistics.median(durations) * 1000,
+        'p99': durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = ("Measures the username autocomplete on simulated keystrokes: the prefix index "
+            "alone, the endpoint, and a LIKE query for comparison.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keystrokes', type=int, default=5000,
+                            help="Number of simulated keystrokes.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--user', help="Username of the requesting user (default: first).")
+        parser.add_argument('--target-p99-ms', type=float, default=5.0,
+                            help="Maximum p99 latency of the endpoint; exceeding it fails.")
+
+    def keystrokes(self, count, seed):
+        """
+        Yields the prefixes typed by users completing random usernames.
+        """
+        usernames = list(get_user_model().objects.values_list('username', flat=True))
+        if not usernames:
+            raise CommandError("Aucun utilisateur.")
+        rng = random.Random(seed)
+        prefixes = []
+        while len(prefixes) < count:
+            username = rng.choice(usernames)
+            prefixes += [username[:length] for length in range(1, len(username) + 1)]
+        return prefixes[:count]
+
+    def measure(self, name, prefixes, lookup):
+        durations = []
+        started = time.perf_counter()
+        for prefix in prefixes:
+            start = time.perf_counter()
+            lookup(prefix)
+            durations.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+        stats = percentiles(durations)
+        self.stdout.write(f"{name:<12} p50 {stats['p50']:7.3f} ms   p99 {stats['p99']:7.3f} ms   "
+                          f"{len(prefixes) / elapsed:9.0f} frappes/s")
+        return stats
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = User.objects.order_by('pk')
+        user = users.get(username=options['user']) if options['user'] else users.first()
+        if user is None:
+            raise CommandError("Aucun utilisateur.")
+        prefixes = self.keystrokes(options['keystrokes'], options['seed'])
+
+        started = time.perf_counter()
+        autocomplete.index.load()
+        self.stdout.write(f"Index de {len(autocomplete.index.entries)} noms chargé en "
+                          f"{(time.perf_counter() - started) * 1000:.0f} ms.")
+        hidden = autocomplete.hidden_user_ids(user)
+        self.measure('index', prefixes,
+                     lambda prefix: autocomplete.index.search(prefix, exclude=hidden))
+        self.measure('LIKE', prefixes, lambda prefix: list(
+            users.filter(username__istartswith=prefix).values_list('username', flat=True)[:10]))
+
+        client = Client()
+        client.force_login(user)
+        url = reverse('username-autocomplete')
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            stats = self.measure('endpoint', prefixes,
+                                 lambda prefix: client.get(url, {'q': prefix}))
+        if stats['p99'] > options['target_p99_ms']:
+            raise CommandError(f"p99 de l'endpoint au-delà de {options['target_p99_ms']} ms.")
+        self.stdout.write(self.style.SUCCESS("Objectif de latence atteint."))
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('social', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userfollows',
+            index=models.Index(fields=['user', 'blocked'], name='userfollows_user_blocked'),
+        ),
+        migrations.AddIndex(
+            model_name='userfollows',
+            index=models.Index(fields=['followed_user', 'blocked'], name='userfollows_followed_blocked'),
+        ),
+    ]
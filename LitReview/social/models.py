@@ -16,6 +16,8 @@ class UserFollows(models.Model):
 
     Meta Options:
         - unique_together: Ensures that a user cannot follow the same person multiple times.
+        - indexes: (user, blocked) and (followed_user, blocked) serve the block
+          lookups of the feeds, in both directions.
 
     Relationships:
         - user.following: Returns a list of users this user is following.
@@ -36,3 +38,8 @@ class UserFollows(models.Model):
 
     class Meta:
         unique_together = ('user', 'followed_user', )
+        indexes = [
+            models.Index(fields=['user', 'blocked'], name='userfollows_user_blocked'),
+            models.Index(fields=['followed_user', 'blocked'],
+                         name='userfollows_followed_blocked'),
+        ]
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .autocomplete import index
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def index_username(sender, instance, **kwargs):
+    """
+    Adds a new or renamed user to the username autocomplete index, once committed.
+    """
+    user_id, username = instance.pk, instance.username
+    transaction.on_commit(lambda: index.add(user_id, username), using=kwargs.get('using'))
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def unindex_username(sender, instance, **kwargs):
+    """
+    Removes a deleted user from the username autocomplete index, once committed.
+    """
+    user_id = instance.pk
+    transaction.on_commit(lambda: index.remove(user_id), using=kwargs.get('using'))
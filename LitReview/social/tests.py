@@ -1,3 +1,108 @@
+from io import StringIO
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from . import autocomplete
+from .models import UserFollows
 
+User = get_user_model()
 
-# Create your tests here.
+
+class UsernameAutocompleteTests(TestCase):
+    """
+    The autocomplete endpoint suggests usernames by prefix from the in-memory
+    index, without the users on either side of a block.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='Lecteur', password='secret')
+        for username in ['Alice', 'alfred', 'Albertine', 'bob', 'Élodie']:
+            User.objects.create_user(username=username, password='secret')
+
+    def setUp(self):
+        caches['feed'].clear()
+        autocomplete.index.load()
+        self.client.force_login(self.user)
+
+    def suggest(self, prefix):
+        response = self.client.get(reverse('username-autocomplete'), {'q': prefix})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_prefix_case_insensitive(self):
+        self.assertEqual(self.suggest('al'), ['Albertine', 'alfred', 'Alice'])
+        self.assertEqual(self.suggest('ALF'), ['alfred'])
+        self.assertEqual(self.suggest('él'), ['Élodie'])
+        self.assertEqual(self.suggest('lect'), [])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_index_follows_users(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            new = User.objects.create_user(username='Alphonse', password='secret')
+        self.assertIn('Alphonse', self.suggest('alp'))
+        with self.captureOnCommitCallbacks(execute=True):
+            new.username = 'Zoé'
+            new.save()
+        self.assertEqual((self.suggest('alp'), self.suggest('zo')), ([], ['Zoé']))
+        with self.captureOnCommitCallbacks(execute=True):
+            new.delete()
+        self.assertEqual(self.suggest('zo'), [])
+
+    def test_changes_during_load_are_kept(self):
+        index = autocomplete.UsernameIndex()
+        bob = User.objects.get(username='bob')
+        users = list(User.objects.values_list('username', 'pk'))
+
+        def read_users():
+            # Sign-up and deletion committed while the load reads the users
+            index.add(1000, 'Albane')
+            index.remove(bob.pk)
+            yield from users
+
+        with mock.patch.object(autocomplete, 'get_user_model') as user_model:
+            user_model.return_value.objects.values_list.return_value.iterator = read_users
+            index.load()
+        self.assertEqual(index.search('al'), ['Albane', 'Albertine', 'alfred', 'Alice'])
+        self.assertEqual(index.search('bo'), [])
+        self.assertEqual(index.journals, [])
+
+    def test_updates_do_not_modify_published_list(self):
+        index = autocomplete.index
+        published = index.entries
+        snapshot = list(published)
+        index.add(1000, 'Albane')
+        index.remove(User.objects.get(username='bob').pk)
+        self.assertEqual(published, snapshot)
+        self.assertEqual(autocomplete.index.search('alb'), ['Albane', 'Albertine'])
+
+    def test_blocked_users_hidden(self):
+        alice = User.objects.get(username='Alice')
+        alfred = User.objects.get(username='alfred')
+        # The feed versions keying the hidden users are bumped on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFollows.objects.create(user=alice, followed_user=self.user, blocked=True)
+        self.assertEqual(self.suggest('al'), ['Albertine', 'alfred'])
+        with self.captureOnCommitCallbacks(execute=True):
+            follow = UserFollows.objects.create(user=self.user, followed_user=alfred)
+            follow.blocked = True
+            follow.save()
+        self.assertEqual(self.suggest('al'), ['Albertine'])
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+        self.assertEqual(self.suggest('al'), ['Albertine', 'alfred'])
+
+    def test_cached_blocks_save_queries(self):
+        self.suggest('a')
+        # Session and user only
+        with self.assertNumQueries(2):
+            self.suggest('al')
+
+    def test_benchmark_command(self):
+        stdout = StringIO()
+        call_command('bench_autocomplete', '--keystrokes', '50', '--target-p99-ms', '1000',
+                     stdout=stdout)
+        self.assertIn('Objectif de latence atteint', stdout.getvalue())
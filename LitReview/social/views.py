@@ -2,6 +2,11 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
+from reviews.conditional import conditional_page, follows_state
+from . import autocomplete
 from .models import UserFollows
 from .forms import FollowUsersForm
 
@@ -9,6 +14,7 @@ User = get_user_model()
 
 
 @login_required
+@conditional_page(follows_state)
 def follow_users_form(request):
     """
         View to manage user follow, unfollow, and block actions.
@@ -85,3 +91,23 @@ def follow_users_form(request):
         'followed_users': followed_users,
         'followers': followers,
     })
+
+
+@login_required
+@require_GET
+def username_autocomplete(request):
+    """
+    Returns the usernames starting with `?q=` as JSON, for the search bar of
+    the follow form.
+
+    Served from the in-memory prefix index (`social.autocomplete`): apart from
+    the session, the only query is the lookup of the blocks of the user.
+
+    Returns:
+        JsonResponse: {"results": [usernames]}, at most 10, in alphabetical order.
+    """
+    prefix = request.GET.get('q', '').strip()[:150]
+    response = JsonResponse({'results': autocomplete.suggest(request.user, prefix)})
+    # Browsers reuse the suggestions of a prefix typed again (backspace)
+    patch_cache_control(response, private=True, max_age=30)
+    return response